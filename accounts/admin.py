@@ -1,5 +1,12 @@
 from django.contrib import admin
+from transport.admin import LargeTableAdmin
 from .models import CustomUser
-# Register your models here.
 
-admin.site.register(CustomUser)
+
+@admin.register(CustomUser)
+class CustomUserAdmin(LargeTableAdmin):
+    list_display = ('username', 'email', 'is_staff', 'is_active', 'date_joined')
+    # username and email are unique, so exact matches are index lookups
+    search_fields = ('=username', '=email')
+    filter_horizontal = ('groups', 'user_permissions')
+    ordering = ('-id',)
@@ -136,6 +136,53 @@ GRAPHENE = {
     "SCHEMA": "transport.schema.schema",
 }
 
+TRANSPORT = {
+    'GRAPHQL_MAX_BATCH_SIZE': 20,
+    'GRAPHQL_COMPRESSION_MIN_BYTES': 1024,
+    'JOB_LEASE_SECONDS': 300,
+    'JOB_RETRY_BASE_SECONDS': 10,
+    'JOB_RETRY_MAX_SECONDS': 3600,
+    'BUS_TURNAROUND_MINUTES': 30,
+    'IDEMPOTENCY_CACHE': 'idempotency',
+    'IDEMPOTENCY_TTL_SECONDS': 24 * 60 * 60,
+    'IDEMPOTENCY_WAIT_SECONDS': 10,
+    'TIMETABLE_ROOT': BASE_DIR / 'timetable',
+    'TIMETABLE_DAYS': 30,
+    'PLACES_REFRESH_SECONDS': 5,
+    'CANCEL_TRIPS_LIMIT': 5000,
+    'FORECAST_HISTORY_WEEKS': 8,
+    'FORECAST_DAYS': 28,
+    'REMINDER_LEAD_HOURS': 24,
+    'REMINDER_HORIZON_HOURS': 24,
+    'REMINDER_BATCH_SIZE': 100,
+    'REMINDER_SENDER': 'transport.reminders.ConsoleSender',
+    'REMINDER_FILE': BASE_DIR / 'reminders.jsonl',
+    'IMPORT_BATCH_SIZE': 500,
+    'LIST_FAST_PATH': True,
+    'SINGLE_FLIGHT_TTL_MS': 100,
+    'RATE_LIMIT_BACKEND': 'transport.ratelimit.LocalBackend',
+    'RATE_LIMITS': {
+        'anonymous': (1, 20),
+        'default': (5, 100),
+        'customer': (5, 100),
+        'organizer': (20, 200),
+        'manager': None,
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Stored mutation results for Idempotency-Key replays. Use a shared
+    # backend (database, Redis, Memcached) when running several processes.
+    'idempotency': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'idempotency',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
@@ -16,12 +16,13 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from graphene_django.views import GraphQLView
 from django.views.decorators.csrf import csrf_exempt
+from transport.views import TransportGraphQLView, timetable_file
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True))),
+    path('graphql/', csrf_exempt(TransportGraphQLView.as_view(graphiql=True))),
+    path('timetable/<path:name>', timetable_file, name='timetable-file'),
     
     path('auth/', include('accounts.urls', namespace='accounts')),
 ]
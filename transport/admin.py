@@ -1,10 +1,89 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from .models import Route, Bus, City, Trip, Booking, Branch
 
-# Register your models here.
+
+def estimated_rows(queryset):
+    """
+    The PostgreSQL planner's row estimate for an unfiltered ``queryset``.
+
+    ``reltuples`` counts every row of the table, so None as soon as the
+    queryset filters anything (a default manager hiding rows included), the
+    table was never analyzed, or the database keeps no such statistic.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    if queryset.query.where:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Pages an unfiltered large table without a COUNT(*) over all of it."""
+    # Below this estimate an exact count is cheap enough
+    exact_below = 100_000
+
+    @cached_property
+    def count(self):
+        estimate = estimated_rows(self.object_list)
+        if estimate is not None and estimate >= self.exact_below:
+            return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Base admin for tables with millions of rows.
+
+    Subclasses should pick foreign keys through ``raw_id_fields`` rather than
+    a ``<select>`` of the whole related table, join what ``list_display``
+    shows through ``list_select_related``, and only search indexed columns.
+    """
+    paginator = EstimatedCountPaginator
+    # Skips the second COUNT(*) Django runs for the "N total" link on filtered pages
+    show_full_result_count = False
+    list_per_page = 50
+
+    def get_queryset(self, request):
+        # Every row, also those a default manager hides (cancelled trips, rows
+        # pending deletion), so the unfiltered list matches the table estimate
+        manager = getattr(self.model, 'all_objects', self.model._default_manager)
+        queryset = manager.get_queryset()
+        ordering = self.get_ordering(request)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return queryset
+
+
+@admin.register(Trip)
+class TripAdmin(LargeTableAdmin):
+    list_display = ('id', 'route', 'departure_time', 'arrival_time', 'bus', 'available_seats', 'cancelled_at')
+    list_select_related = ('route__origin__city', 'route__destination__city', 'bus')
+    raw_id_fields = ('route', 'bus', 'organizer', 'driver', 'crew')
+    search_fields = ('=id', '=bus__plate_number')
+    date_hierarchy = 'departure_time'
+    ordering = ('-departure_time',)
+
+
+@admin.register(Booking)
+class BookingAdmin(LargeTableAdmin):
+    list_display = ('id', 'customer', 'trip', 'seat_number', 'booked_at', 'cancelled_at')
+    # Booking.__str__ (used by the action checkbox) reaches through the trip's route to both cities
+    list_select_related = ('customer', 'trip__route__origin__city', 'trip__route__destination__city')
+    raw_id_fields = ('customer', 'trip')
+    search_fields = ('=id', '=trip__id', '=customer__username', '=customer__email')
+    date_hierarchy = 'booked_at'
+    ordering = ('-booked_at',)
+
 admin.site.register(Route)
 admin.site.register(Bus)
-admin.site.register(City)   
-admin.site.register(Trip)        
-admin.site.register(Booking)        
-admin.site.register(Branch)             
\ No newline at end of file
+admin.site.register(City)
+admin.site.register(Branch)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class TransportConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'transport'
+
+    def ready(self):
+        # Register the background job handlers.
+        from . import tasks  # noqa: F401
@@ -0,0 +1,64 @@
+from django.db import transaction
+from .models import Trip, Booking, ArchivedTrip, ArchivedBooking, ChangeLog
+
+TripCrew = Trip.crew.through
+ArchivedTripCrew = ArchivedTrip.crew.through
+
+
+def archive_chunk(cutoff, chunk_size):
+    """
+    Move up to ``chunk_size`` trips departed before ``cutoff`` into the archive tables.
+
+    The trips, their bookings and their crew links are copied and removed from
+    the hot tables in one short transaction. Returns ``(trips, bookings)`` moved;
+    ``(0, 0)`` means there is nothing left to archive.
+    """
+    with transaction.atomic():
+        trips = list(
+            Trip.all_objects.select_for_update()
+            .filter(departure_time__lt=cutoff)
+            .order_by('pk')[:chunk_size]
+        )
+        if not trips:
+            return 0, 0
+
+        trip_ids = [trip.pk for trip in trips]
+        ArchivedTrip.objects.bulk_create([
+            ArchivedTrip(
+                id=trip.pk,
+                route_id=trip.route_id,
+                bus_id=trip.bus_id,
+                organizer_id=trip.organizer_id,
+                driver_id=trip.driver_id,
+                departure_time=trip.departure_time,
+                available_seats=trip.available_seats,
+                cancelled_at=trip.cancelled_at,
+            )
+            for trip in trips
+        ])
+
+        crew_links = TripCrew.objects.filter(trip_id__in=trip_ids).values_list('trip_id', 'customuser_id')
+        ArchivedTripCrew.objects.bulk_create([
+            ArchivedTripCrew(archivedtrip_id=trip_id, customuser_id=user_id)
+            for trip_id, user_id in crew_links
+        ])
+
+        bookings = Booking.all_objects.filter(trip_id__in=trip_ids)
+        archived = ArchivedBooking.objects.bulk_create([
+            ArchivedBooking(
+                id=booking.pk,
+                customer_id=booking.customer_id,
+                trip_id=booking.trip_id,
+                seat_number=booking.seat_number,
+                booked_at=booking.booked_at,
+                cancelled_at=booking.cancelled_at,
+            )
+            for booking in bookings
+        ])
+
+        bookings.delete()
+        TripCrew.objects.filter(trip_id__in=trip_ids).delete()
+        Trip.all_objects.filter(pk__in=trip_ids).delete()
+        ChangeLog.record(Trip, trip_ids, deleted=True)
+
+    return len(trips), len(archived)
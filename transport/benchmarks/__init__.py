@@ -0,0 +1,15 @@
+from importlib import import_module
+
+# Benchmark name -> module exposing ``run(stdout, size)``.
+BENCHMARKS = {
+    'fleet': 'transport.benchmarks.fleet',
+    'lists': 'transport.benchmarks.lists',
+    'places': 'transport.benchmarks.places',
+    'ratelimit': 'transport.benchmarks.ratelimit',
+    'render': 'transport.benchmarks.render',
+}
+
+
+def run_benchmark(name, stdout, size=None):
+    module = import_module(BENCHMARKS[name])
+    return module.run(stdout, size or module.DEFAULT_SIZE)
@@ -0,0 +1,44 @@
+"""
+Planning time of ``fleet.solve`` for a month of departures at a large branch.
+
+Trips shuttle between the branch and a handful of destinations every few
+minutes, so the solver has to chain return legs and reuse buses.
+"""
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from ..fleet import FleetBus, TripLeg, solve
+
+DEFAULT_SIZE = 6_000
+BRANCH = 1
+DESTINATIONS = (2, 3, 4, 5, 6)
+
+
+def build_problem(size):
+    rng = random.Random(size)
+    start = datetime(2026, 1, 1, 5, tzinfo=timezone.utc)
+    minutes = 30 * 24 * 60 // max(size // 2, 1)
+    trips = []
+    for i in range(size // 2):
+        departure = start + timedelta(minutes=minutes * i)
+        destination = DESTINATIONS[i % len(DESTINATIONS)]
+        duration = timedelta(hours=rng.randint(2, 6))
+        seats = rng.randint(10, 50)
+        trips.append(TripLeg(2 * i, departure, departure + duration, BRANCH, destination, seats))
+        back = departure + duration + timedelta(hours=1)
+        trips.append(TripLeg(2 * i + 1, back, back + duration, destination, BRANCH, seats))
+    buses = [FleetBus(i, rng.choice((30, 45, 50)), BRANCH) for i in range(size // 20 + 1)]
+    return buses, trips
+
+
+def run(stdout, size):
+    buses, trips = build_problem(size)
+    started = time.perf_counter()
+    plan = solve(buses, trips, [], timedelta(minutes=30))
+    elapsed = time.perf_counter() - started
+
+    stdout.write(f"assignBuses plan for {len(trips)} trips and {len(buses)} buses")
+    stdout.write(f"  solve                 {elapsed * 1000:8.1f} ms")
+    stdout.write(f"  assigned              {len(plan.assignments):>8}")
+    stdout.write(f"  unassigned            {len(plan.unassigned):>8}")
+    stdout.write(f"  buses used            {plan.buses_used:>8}")
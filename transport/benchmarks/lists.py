@@ -0,0 +1,79 @@
+"""
+Resolve time and peak memory of a flat ``allTrips``/``allBookings`` selection
+on the model-instance path and on the ``values_list()`` row path.
+
+The rows are inserted into the configured database inside a transaction that
+is rolled back afterwards, so it has to be migrated but is left untouched.
+"""
+import time
+import tracemalloc
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+from ..models import City, Branch, Bus, Route, Trip, Booking
+from ..schema import schema
+
+DEFAULT_SIZE = 10_000
+REPEAT = 3
+QUERIES = {
+    'allTrips': '{ allTrips { id departureTime arrivalTime availableSeats route { id } bus { id } } }',
+    'allBookings': '{ allBookings { id seatNumber bookedAt trip { id } customer { id } } }',
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+def populate(size):
+    User = get_user_model()
+    manager = User.objects.create_user(username='benchmark-manager', email='benchmark@example.com')
+    manager.groups.add(Group.objects.get_or_create(name='manager')[0])
+    city = City.objects.create(name='Benchmark City')
+    origin = Branch.objects.create(name='Benchmark Origin', city=city)
+    destination = Branch.objects.create(name='Benchmark Destination', city=city)
+    bus = Bus.objects.create(plate_number='BENCH-0001', capacity=48, branch=origin)
+    route = Route.objects.create(origin=origin, destination=destination, duration=timedelta(hours=5), distance_km=350)
+    start = timezone.now() + timedelta(days=1)
+    trips = Trip.objects.bulk_create(
+        Trip(route=route, bus=bus, organizer=manager, driver=manager, available_seats=40,
+             departure_time=start + timedelta(minutes=15 * i), arrival_time=start + timedelta(minutes=15 * i, hours=5))
+        for i in range(size)
+    )
+    Booking.objects.bulk_create(
+        Booking(customer=manager, trip=trip, seat_number=1, booked_at=start) for trip in trips
+    )
+    return manager
+
+
+def measure(query, user, fast_path):
+    request = RequestFactory().post('/graphql/')
+    request.user = user
+    timings, peak = [], 0
+    with override_settings(TRANSPORT={'LIST_FAST_PATH': fast_path}):
+        for _ in range(REPEAT):
+            tracemalloc.start()
+            started = time.perf_counter()
+            result = schema.execute(query, context_value=request)
+            timings.append(time.perf_counter() - started)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            assert not result.errors, result.errors
+    return min(timings), peak
+
+
+def run(stdout, size):
+    try:
+        with transaction.atomic():
+            user = populate(size)
+            stdout.write(f"flat list selections over {size} trips and {size} bookings (timed under tracemalloc)")
+            for field, query in QUERIES.items():
+                for label, fast_path in (('model instances', False), ('values rows', True)):
+                    elapsed, peak = measure(query, user, fast_path)
+                    stdout.write(f"  {field:<12} {label:<16} {elapsed * 1000:8.1f} ms  {peak / 2 ** 20:8.1f} MiB peak")
+            raise Rollback
+    except Rollback:
+        pass
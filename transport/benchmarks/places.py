@@ -0,0 +1,53 @@
+"""
+Build and lookup time of the ``suggestPlaces`` index.
+
+Generates place names from random syllables and times prefix lookups and
+misspelled lookups that fall back to trigram matching.
+"""
+import random
+import time
+from ..places import Place, PlaceIndex
+
+DEFAULT_SIZE = 100_000
+QUERIES = 2_000
+SYLLABLES = [onset + vowel + coda for onset in 'bdfghjklmnqrstwyz' for vowel in 'aeiou' for coda in ('', 'l', 'n', 'r', 's')]
+SUFFIXES = ('', ' Central', ' North', ' Station', ' Gate', ' Market')
+
+
+def build_places(size):
+    rng = random.Random(size)
+    places = []
+    for i in range(size):
+        name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+        places.append(Place('branch', i, name + rng.choice(SUFFIXES), name))
+    return places
+
+
+def misspell(name, rng):
+    position = rng.randrange(1, len(name))
+    return name[:position] + name[position + 1:]
+
+
+def time_queries(index, queries):
+    started = time.perf_counter()
+    for query in queries:
+        index.search(query, 10)
+    return (time.perf_counter() - started) / len(queries)
+
+
+def run(stdout, size):
+    places = build_places(size)
+    rng = random.Random(0)
+
+    started = time.perf_counter()
+    index = PlaceIndex(places)
+    build_time = time.perf_counter() - started
+
+    samples = [rng.choice(places).name for _ in range(QUERIES)]
+    prefixes = [name[:rng.randint(2, 6)] for name in samples]
+    typos = [misspell(name.split()[0], rng) for name in samples]
+
+    stdout.write(f"suggestPlaces index over {size} places")
+    stdout.write(f"  build                 {build_time * 1000:8.1f} ms")
+    stdout.write(f"  prefix lookup         {time_queries(index, prefixes) * 1e6:8.1f} µs")
+    stdout.write(f"  misspelled lookup     {time_queries(index, typos) * 1e6:8.1f} µs")
@@ -0,0 +1,28 @@
+"""
+Per-request overhead of the /graphql/ rate limiter.
+
+Times ``limit_for`` plus ``admit`` for a rotating set of users against the
+in-process and the cache backend. The budget is 50µs per request.
+"""
+import time
+from django.test import override_settings
+from .. import ratelimit
+
+DEFAULT_SIZE = 100_000
+USERS = 1000
+BACKENDS = ('transport.ratelimit.LocalBackend', 'transport.ratelimit.CacheBackend')
+
+
+def run(stdout, size):
+    roles = frozenset({'customer'})
+    # Fresh keys per run so the shared cache holds no buckets from earlier runs.
+    keys = [f'benchmark:{time.time_ns()}:{i}' for i in range(USERS)]
+    stdout.write(f"rate limit check, {size} requests from {USERS} users")
+    for path in BACKENDS:
+        with override_settings(TRANSPORT={'RATE_LIMIT_BACKEND': path}):
+            started = time.perf_counter()
+            for i in range(size):
+                ratelimit.admit(keys[i % USERS], ratelimit.limit_for(roles, True), 1)
+            elapsed = time.perf_counter() - started
+        name = path.rsplit('.', 1)[1]
+        stdout.write(f"  {name:<21} {elapsed / size * 1e6:8.2f} µs/request")
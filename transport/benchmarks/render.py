@@ -0,0 +1,62 @@
+"""
+Encode time and bytes-on-wire of an ``allTrips`` response.
+
+Compares the stdlib encoder GraphQLView used before with the renderer and
+compression of ``TransportGraphQLView``.
+"""
+import gzip
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from django.test import RequestFactory
+from ..views import TransportGraphQLView, brotli, orjson
+
+DEFAULT_SIZE = 10_000
+REPEAT = 5
+
+
+def build_response(size):
+    start = datetime(2026, 1, 1, 8, tzinfo=timezone.utc)
+    trips = []
+    for i in range(size):
+        trips.append({
+            'id': str(i + 1),
+            'departureTime': (start + timedelta(minutes=15 * i)).isoformat(),
+            'availableSeats': 40 - i % 40,
+            'route': {'id': str(i % 50 + 1), 'duration': '05:30:00', 'distanceKm': 350.5},
+            'bus': {'plateNumber': f'BUS-{i % 300:04}', 'capacity': 48},
+            'availableSeatNumbers': list(range(i % 40 + 1, 49)),
+        })
+    return {'data': {'allTrips': trips}}
+
+
+def best_of(func):
+    timings = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def run(stdout, size):
+    response = build_response(size)
+    view = TransportGraphQLView()
+    request = RequestFactory().post('/graphql/')
+
+    stdlib_time, stdlib_body = best_of(lambda: json.dumps(response, separators=(",", ":")))
+    view_time, view_body = best_of(lambda: view.json_encode(request, response))
+    body = view_body.encode()
+
+    stdout.write(f"allTrips response with {size} trips")
+    stdout.write(f"  json.dumps            {stdlib_time * 1000:8.1f} ms  {len(stdlib_body.encode()):>10} bytes")
+    renderer = 'orjson' if orjson is not None else 'json (orjson missing)'
+    stdout.write(f"  {renderer:<21} {view_time * 1000:8.1f} ms  {len(body):>10} bytes")
+
+    gzip_time, gzipped = best_of(lambda: gzip.compress(body, compresslevel=view.gzip_level, mtime=0))
+    stdout.write(f"  + gzip                {gzip_time * 1000:8.1f} ms  {len(gzipped):>10} bytes")
+    if brotli is not None:
+        brotli_time, compressed = best_of(lambda: brotli.compress(body, quality=view.brotli_quality))
+        stdout.write(f"  + brotli              {brotli_time * 1000:8.1f} ms  {len(compressed):>10} bytes")
+    else:
+        stdout.write("  + brotli              not installed")
@@ -0,0 +1,70 @@
+"""
+Cancelling many trips at once, e.g. every departure of a route on a day a road is closed.
+
+Trips and bookings are flipped with one UPDATE each, and every affected
+customer gets a single notification job listing all of their cancelled
+trips, however many bookings they held.
+"""
+from collections import defaultdict
+from typing import NamedTuple
+from django.core.mail import send_mail
+from django.db import transaction
+from django.utils import timezone
+from .jobs import enqueue_many
+from .models import Trip, Booking, WaitlistEntry, ChangeLog
+from .singleflight import invalidate_trip
+
+
+class CancellationResult(NamedTuple):
+    trips: int
+    bookings: int
+    customers: int
+
+
+def cancel_trips(trips, reason=''):
+    """
+    Cancel the trips of the ``trips`` queryset and queue the customer notifications.
+
+    Their bookings are marked cancelled and their waitlists dropped; the
+    customers of both are notified through ``notify_trip_cancellation`` jobs.
+    """
+    with transaction.atomic():
+        trip_ids = list(trips.select_for_update(of=('self',)).values_list('pk', flat=True))
+        if not trip_ids:
+            return CancellationResult(0, 0, 0)
+        now = timezone.now()
+        Trip.all_objects.filter(pk__in=trip_ids).update(cancelled_at=now, available_seats=0)
+
+        bookings = Booking.all_objects.filter(trip_id__in=trip_ids, cancelled_at=None)
+        affected = defaultdict(set)
+        for customer_id, trip_id in bookings.values_list('customer_id', 'trip_id').distinct():
+            affected[customer_id].add(trip_id)
+        cancelled_bookings = bookings.update(cancelled_at=now)
+
+        waitlist = WaitlistEntry.objects.filter(trip_id__in=trip_ids)
+        for customer_id, trip_id in waitlist.values_list('customer_id', 'trip_id'):
+            affected[customer_id].add(trip_id)
+        waitlist.delete()
+
+        ChangeLog.record(Trip, trip_ids)
+        enqueue_many('notify_trip_cancellation', (
+            {'customer_id': customer_id, 'trip_ids': sorted(customer_trips), 'reason': reason}
+            for customer_id, customer_trips in affected.items()
+        ))
+        for trip_id in trip_ids:
+            invalidate_trip(trip_id)
+    return CancellationResult(len(trip_ids), cancelled_bookings, len(affected))
+
+
+def notify_cancellation(customer, trips, reason=''):
+    """Email ``customer`` one message listing all of their cancelled ``trips``."""
+    trips = list(trips)
+    lines = [f"- {trip}" for trip in trips]
+    if reason:
+        lines += ['', f"Reason: {reason}"]
+    send_mail(
+        subject=f"{len(trips)} trip(s) cancelled",
+        message="The following trips you booked or were waiting for have been cancelled:\n\n" + "\n".join(lines),
+        from_email=None,
+        recipient_list=[customer.email],
+    )
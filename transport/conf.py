@@ -0,0 +1,68 @@
+from django.conf import settings
+
+DEFAULTS = {
+    # Maximum number of operations accepted in a single batched POST to /graphql/.
+    'GRAPHQL_MAX_BATCH_SIZE': 20,
+    # JSON responses smaller than this many bytes are sent uncompressed.
+    'GRAPHQL_COMPRESSION_MIN_BYTES': 1024,
+    # Seconds a worker may hold a job without reporting progress before it is retried elsewhere.
+    'JOB_LEASE_SECONDS': 300,
+    # Failed jobs are retried after JOB_RETRY_BASE_SECONDS * 2 ** (attempt - 1), capped below.
+    'JOB_RETRY_BASE_SECONDS': 10,
+    'JOB_RETRY_MAX_SECONDS': 3600,
+    # Minimum time a bus spends at a branch between two trips when assignBuses plans the fleet.
+    'BUS_TURNAROUND_MINUTES': 30,
+    # Cache alias holding mutation results replayed for a repeated Idempotency-Key header.
+    # The cache must be shared by all web processes; its MAX_ENTRIES bounds the store.
+    'IDEMPOTENCY_CACHE': 'default',
+    'IDEMPOTENCY_TTL_SECONDS': 24 * 60 * 60,
+    # How long a duplicate waits for the first request with the same key to finish.
+    'IDEMPOTENCY_WAIT_SECONDS': 10,
+    # Directory of the static timetable snapshot; None means <BASE_DIR>/timetable.
+    'TIMETABLE_ROOT': None,
+    # Days of upcoming trips included in the snapshot.
+    'TIMETABLE_DAYS': 30,
+    # Seconds suggestPlaces trusts its in-memory index before checking for changes made elsewhere.
+    'PLACES_REFRESH_SECONDS': 5,
+    # Departure reminders (run_reminders): sent REMINDER_LEAD_HOURS before departure; the scheduler
+    # keeps REMINDER_HORIZON_HOURS of reminders in memory and hands them to REMINDER_SENDER in batches.
+    'REMINDER_LEAD_HOURS': 24,
+    'REMINDER_HORIZON_HOURS': 24,
+    'REMINDER_BATCH_SIZE': 100,
+    'REMINDER_SENDER': 'transport.reminders.ConsoleSender',
+    # Where transport.reminders.FileSender appends its reminders.
+    'REMINDER_FILE': 'reminders.jsonl',
+    # forecast_demand fits FORECAST_HISTORY_WEEKS of bookings and predicts FORECAST_DAYS ahead.
+    'FORECAST_HISTORY_WEEKS': 8,
+    'FORECAST_DAYS': 28,
+    # Most trips one cancelTrips call may cancel.
+    'CANCEL_TRIPS_LIMIT': 5000,
+    # Records upserted per transaction by import_network and the importNetwork mutation.
+    'IMPORT_BATCH_SIZE': 500,
+    # Serve allTrips/allBookings/customerBookings from values_list() rows when only flat fields are selected.
+    'LIST_FAST_PATH': True,
+    # How long identical trip reads reuse a result computed by another request in this process.
+    'SINGLE_FLIGHT_TTL_MS': 100,
+    # Dotted path of the token-bucket store: LocalBackend (per process) or CacheBackend (shared).
+    'RATE_LIMIT_BACKEND': 'transport.ratelimit.LocalBackend',
+    'RATE_LIMIT_CACHE': 'default',
+    # Role -> (operations per second, burst), or None for no limit. 'anonymous' applies to
+    # logged-out clients, 'default' to roles that are not listed.
+    'RATE_LIMITS': {
+        'anonymous': (1, 20),
+        'default': (5, 100),
+        'customer': (5, 100),
+        'organizer': (20, 200),
+        'manager': None,
+    },
+}
+
+
+def transport_setting(name):
+    """
+    Return a value from the ``TRANSPORT`` settings dict, falling back to the default.
+
+    Args:
+        name (str): Key of the setting, e.g. ``'GRAPHQL_MAX_BATCH_SIZE'``.
+    """
+    return getattr(settings, 'TRANSPORT', {}).get(name, DEFAULTS[name])
@@ -0,0 +1,128 @@
+from django.db import transaction
+from django.db.models import Q
+from .jobs import enqueue
+from .models import City, Branch, Bus, Route, Trip, Booking, ArchivedTrip, ChangeLog
+
+TripCrew = Trip.crew.through
+
+
+def schedule_deletion(instance):
+    """
+    Hide ``instance`` and everything that depends on it, then queue the cascade.
+
+    The entity and the branches, buses and routes below it are flagged
+    ``pending_deletion`` in a few set-based UPDATEs, which removes them (and
+    the trips and bookings on those routes) from every query straight away.
+    The rows themselves are removed by the ``cascade_delete`` job.
+    """
+    model = type(instance)
+    with transaction.atomic():
+        if model is City:
+            hidden = {
+                City: City.all_objects.filter(pk=instance.pk),
+                Branch: Branch.all_objects.filter(city=instance),
+                Bus: Bus.all_objects.filter(branch__city=instance),
+                Route: Route.all_objects.filter(Q(origin__city=instance) | Q(destination__city=instance)),
+            }
+        elif model is Branch:
+            hidden = {
+                Branch: Branch.all_objects.filter(pk=instance.pk),
+                Bus: Bus.all_objects.filter(branch=instance),
+                Route: Route.all_objects.filter(Q(origin=instance) | Q(destination=instance)),
+            }
+        elif model in (Bus, Route):
+            hidden = {model: model.all_objects.filter(pk=instance.pk)}
+        else:
+            raise ValueError(f"Cascade deletion is not supported for {model.__name__}.")
+
+        for hidden_model, queryset in hidden.items():
+            ids = list(queryset.values_list('pk', flat=True))
+            hidden_model.all_objects.filter(pk__in=ids).update(pending_deletion=True)
+            # Sync clients drop the trips of a deleted route along with it.
+            ChangeLog.record(hidden_model, ids, deleted=True)
+
+        return enqueue('cascade_delete', {'model': model._meta.model_name, 'id': instance.pk})
+
+
+def _chunks(queryset, chunk_size):
+    """Yield lists of primary keys from ``queryset`` until it is empty."""
+    while True:
+        ids = list(queryset.values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return
+        yield ids
+
+
+class CascadeDeleter:
+    """
+    Deletes a pending entity and its dependants in bounded chunks.
+
+    Every chunk is a separate statement in autocommit mode, so locks are held
+    briefly and an interrupted run can simply be started again.
+    """
+
+    def __init__(self, job, chunk_size=1000):
+        self.job = job
+        self.chunk_size = chunk_size
+        self.counts = dict.fromkeys(
+            ('bookings', 'trips', 'routes', 'buses', 'branches', 'cities'), 0
+        )
+
+    def count(self, key, amount):
+        self.counts[key] += amount
+        self.job.report_progress(**self.counts)
+
+    def delete_routes(self, routes):
+        route_ids = list(routes.values_list('pk', flat=True))
+        bookings = Booking.all_objects.filter(trip__route_id__in=route_ids)
+        for ids in _chunks(bookings, self.chunk_size):
+            Booking.all_objects.filter(pk__in=ids).delete()
+            self.count('bookings', len(ids))
+
+        trips = Trip.all_objects.filter(route_id__in=route_ids)
+        for ids in _chunks(trips, self.chunk_size):
+            with transaction.atomic():
+                TripCrew.objects.filter(trip_id__in=ids).delete()
+                Trip.all_objects.filter(pk__in=ids).delete()
+            self.count('trips', len(ids))
+
+        for ids in _chunks(ArchivedTrip.objects.filter(route_id__in=route_ids), self.chunk_size):
+            ArchivedTrip.objects.filter(pk__in=ids).update(route=None)
+
+        Route.all_objects.filter(pk__in=route_ids).delete()
+        self.count('routes', len(route_ids))
+
+    def delete_buses(self, buses):
+        bus_ids = list(buses.values_list('pk', flat=True))
+        for ids in _chunks(Trip.all_objects.filter(bus_id__in=bus_ids), self.chunk_size):
+            Trip.all_objects.filter(pk__in=ids).update(bus=None)
+            ChangeLog.record(Trip, ids)
+        for ids in _chunks(ArchivedTrip.objects.filter(bus_id__in=bus_ids), self.chunk_size):
+            ArchivedTrip.objects.filter(pk__in=ids).update(bus=None)
+
+        Bus.all_objects.filter(pk__in=bus_ids).delete()
+        self.count('buses', len(bus_ids))
+
+    def delete_branches(self, branches):
+        branch_ids = list(branches.values_list('pk', flat=True))
+        self.delete_routes(Route.all_objects.filter(
+            Q(origin_id__in=branch_ids) | Q(destination_id__in=branch_ids)
+        ))
+        self.delete_buses(Bus.all_objects.filter(branch_id__in=branch_ids))
+        Branch.all_objects.filter(pk__in=branch_ids).delete()
+        self.count('branches', len(branch_ids))
+
+    def run(self, model_name, pk):
+        if model_name == 'city':
+            self.delete_branches(Branch.all_objects.filter(city_id=pk))
+            City.all_objects.filter(pk=pk).delete()
+            self.count('cities', 1)
+        elif model_name == 'branch':
+            self.delete_branches(Branch.all_objects.filter(pk=pk))
+        elif model_name == 'bus':
+            self.delete_buses(Bus.all_objects.filter(pk=pk))
+        elif model_name == 'route':
+            self.delete_routes(Route.all_objects.filter(pk=pk))
+        else:
+            raise ValueError(f"Unknown model {model_name!r}.")
+        return self.counts
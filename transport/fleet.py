@@ -0,0 +1,186 @@
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import timedelta
+from typing import NamedTuple, Optional
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+from .models import Bus, ChangeLog, Trip
+
+
+class FleetBus(NamedTuple):
+    id: int
+    capacity: int
+    location: int  # branch the bus is parked at when the window opens
+
+
+class TripLeg(NamedTuple):
+    id: int
+    departure: object
+    arrival: object
+    origin: int
+    destination: int
+    seats: int = 0
+    bus_id: Optional[int] = None  # set for trips that already have a bus
+
+
+class FleetPlan(NamedTuple):
+    assignments: dict  # trip id -> bus id
+    unassigned: dict  # trip id -> reason
+    buses_used: int
+
+
+class _BusState:
+    __slots__ = ('bus', 'location', 'free_at', 'fixed', 'fixed_starts', 'used')
+
+    def __init__(self, bus, fixed):
+        self.bus = bus
+        self.location = bus.location
+        self.free_at = None
+        self.fixed = fixed
+        self.fixed_starts = [leg.departure for leg in fixed]
+        self.used = bool(fixed)
+
+    def next_fixed(self, after):
+        index = bisect_right(self.fixed_starts, after)
+        return self.fixed[index] if index < len(self.fixed) else None
+
+
+def solve(buses, trips, fixed, turnaround):
+    """
+    Greedy interval scheduling of ``trips`` onto ``buses``.
+
+    Trips are taken in departure order, together with the ``fixed`` trips the
+    buses already serve. A bus can take a trip when it is parked at the trip's
+    origin, has finished its previous trip plus ``turnaround``, holds at least
+    ``seats`` passengers, and can still reach the origin of its next fixed trip
+    in time. Among those, buses already in service are preferred, then the
+    smallest that fits, so the plan uses as few buses as possible without
+    parking big buses on small trips. Runs in O(n log n + n * b) for n trips
+    and b buses per branch.
+    """
+    fixed_by_bus = defaultdict(list)
+    for leg in sorted(fixed, key=lambda leg: leg.departure):
+        fixed_by_bus[leg.bus_id].append(leg)
+    states = {bus.id: _BusState(bus, fixed_by_bus[bus.id]) for bus in buses}
+    parked = defaultdict(set)
+    for state in states.values():
+        parked[state.location].add(state.bus.id)
+
+    events = sorted(
+        [(leg.departure, 0, leg) for leg in fixed if leg.bus_id in states]
+        + [(leg.departure, 1, leg) for leg in trips],
+        key=lambda event: (event[0], event[1], event[2].id)
+    )
+
+    assignments = {}
+    unassigned = {}
+    for _, is_new, leg in events:
+        if not is_new:
+            state = states[leg.bus_id]
+            parked[state.location].discard(state.bus.id)
+            state.location = leg.destination
+            state.free_at = leg.arrival + turnaround
+            parked[state.location].add(state.bus.id)
+            continue
+
+        best = None
+        reason = "No bus is parked at the origin branch."
+        for bus_id in parked[leg.origin]:
+            state = states[bus_id]
+            if state.free_at is not None and state.free_at > leg.departure:
+                reason = "Every bus at the origin is still on another trip."
+                continue
+            if state.bus.capacity < leg.seats:
+                reason = "No free bus at the origin is large enough."
+                continue
+            upcoming = state.next_fixed(leg.departure)
+            if upcoming is not None and (
+                upcoming.origin != leg.destination or leg.arrival + turnaround > upcoming.departure
+            ):
+                reason = "Free buses at the origin are needed elsewhere for later trips."
+                continue
+            rank = (not state.used, state.bus.capacity, state.bus.id)
+            if best is None or rank < best[0]:
+                best = (rank, state)
+
+        if best is None:
+            unassigned[leg.id] = reason
+            continue
+
+        state = best[1]
+        assignments[leg.id] = state.bus.id
+        parked[state.location].discard(state.bus.id)
+        state.location = leg.destination
+        state.free_at = leg.arrival + turnaround
+        state.used = True
+        parked[state.location].add(state.bus.id)
+
+    return FleetPlan(assignments, unassigned, sum(state.used for state in states.values()))
+
+
+def plan_branch(branch, start, end, turnaround):
+    """
+    Build a ``FleetPlan`` for the unassigned trips of ``branch`` between ``start`` and ``end``.
+
+    Candidate trips are those without a bus on routes from or to the branch;
+    the fleet is ``branch.buses``. Everything is loaded in three queries.
+    Returns ``(plan, trips, buses)`` with the trips and buses keyed by id.
+    """
+    last_destination = Trip.objects.filter(
+        bus=OuterRef('pk'), arrival_time__lte=start
+    ).order_by('-arrival_time').values('route__destination_id')[:1]
+    buses = {
+        bus.pk: bus for bus in Bus.objects.filter(branch=branch).annotate(last_destination=Subquery(last_destination))
+    }
+
+    trips = {
+        trip.pk: trip for trip in Trip.objects.select_related('route').filter(
+            Q(route__origin=branch) | Q(route__destination=branch),
+            bus__isnull=True,
+            departure_time__gte=start,
+            departure_time__lt=end,
+        )
+    }
+
+    # Trips the buses already serve, including a day past the window so a plan
+    # does not strand a bus away from its next morning departure.
+    fixed = [
+        TripLeg(trip_id, departure, arrival, origin, destination, bus_id=bus_id)
+        for trip_id, departure, arrival, origin, destination, bus_id in Trip.objects.filter(
+            bus_id__in=buses, departure_time__lt=end + timedelta(days=1), arrival_time__gt=start
+        ).values_list(
+            'id', 'departure_time', 'arrival_time', 'route__origin_id', 'route__destination_id', 'bus_id'
+        )
+    ]
+
+    plan = solve(
+        [FleetBus(bus.pk, bus.capacity, bus.last_destination or bus.branch_id) for bus in buses.values()],
+        [
+            TripLeg(trip.pk, trip.departure_time, trip.arrival_time,
+                    trip.route.origin_id, trip.route.destination_id, trip.available_seats)
+            for trip in trips.values()
+        ],
+        fixed,
+        turnaround,
+    )
+    return plan, trips, buses
+
+
+def apply_plan(plan):
+    """
+    Store the assignments with one UPDATE per bus and return the assigned trip ids.
+
+    Trips that received a bus since the plan was made are left alone.
+    """
+    by_bus = defaultdict(list)
+    for trip_id, bus_id in plan.assignments.items():
+        by_bus[bus_id].append(trip_id)
+
+    applied = []
+    with transaction.atomic():
+        for bus_id, trip_ids in by_bus.items():
+            still_free = list(Trip.objects.filter(pk__in=trip_ids, bus__isnull=True).values_list('pk', flat=True))
+            Trip.objects.filter(pk__in=still_free).update(bus_id=bus_id)
+            ChangeLog.record(Trip, still_free)
+            applied.extend(still_free)
+    return applied
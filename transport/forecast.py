@@ -0,0 +1,102 @@
+"""
+Per-route, per-day demand forecasts from the booking history.
+
+``build_forecasts`` counts bookings per route and departure day over the last
+``FORECAST_HISTORY_WEEKS`` weeks (one grouped aggregate over live bookings
+and one over archived ones), and fits a weekday baseline for all routes at
+once: the expected bookings of a route on a weekday are the mean of that
+weekday over the history, each week weighted ``WEEK_DECAY`` times less than
+the one after it. The predictions for the next ``FORECAST_DAYS`` days are
+upserted into ``DemandForecast``, where ``forecastDemand`` reads them.
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .conf import transport_setting
+from .models import Route, Booking, ArchivedBooking, DemandForecast
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - optional dependency
+    numpy = None
+
+WEEK_DECAY = 0.7
+
+
+def booking_counts(start, end):
+    """``(route_id, day, bookings)`` per route and UTC departure day in ``[start, end)``."""
+    window = (
+        datetime.combine(start, time.min, dt_timezone.utc),
+        datetime.combine(end, time.min, dt_timezone.utc),
+    )
+    # Bookings of cancelled trips or of routes being deleted never turned into travel
+    live = Booking.objects.filter(cancelled_at=None)
+    archived = ArchivedBooking.objects.filter(cancelled_at=None, trip__cancelled_at=None)
+    for bookings in (live, archived):
+        yield from (
+            bookings.filter(trip__departure_time__gte=window[0], trip__departure_time__lt=window[1],
+                            trip__route__isnull=False)
+            .annotate(day=TruncDate('trip__departure_time', tzinfo=dt_timezone.utc))
+            .values_list('trip__route_id', 'day')
+            .annotate(bookings=Count('id'))
+            .order_by()
+        )
+
+
+def history_matrix(route_ids, start, days, counts):
+    """Place the ``counts`` rows in a ``len(route_ids) x days`` array; ``route_ids`` must be sorted."""
+    matrix = numpy.zeros((len(route_ids), days))
+    if not counts:
+        return matrix
+    route_column, day_column, values = zip(*counts)
+    routes = numpy.asarray(route_column)
+    rows = numpy.searchsorted(route_ids, routes)
+    columns = numpy.fromiter(((day - start).days for day in day_column), dtype=int, count=len(day_column))
+    known = (rows < len(route_ids)) & (route_ids[numpy.minimum(rows, len(route_ids) - 1)] == routes)
+    numpy.add.at(matrix, (rows[known], columns[known]), numpy.asarray(values, dtype=float)[known])
+    return matrix
+
+
+def weekday_baseline(matrix, start):
+    """Decay-weighted mean bookings per weekday, a ``routes x 7`` array (Monday first)."""
+    days = matrix.shape[1]
+    index = numpy.arange(days)
+    weekdays = (start.weekday() + index) % 7
+    weights = WEEK_DECAY ** ((days - 1 - index) // 7)
+    # days x 7: the weight of each history day under its weekday
+    weighted = numpy.zeros((days, 7))
+    weighted[index, weekdays] = weights
+    totals = weights @ (weighted > 0)
+    return (matrix @ weighted) / numpy.where(totals > 0, totals, 1)
+
+
+def build_forecasts(today=None, weeks=None, days=None):
+    """Refit the baseline and store forecasts for ``days`` days from ``today``; returns the rows written."""
+    if numpy is None:
+        raise RuntimeError("Demand forecasting needs numpy.")
+    today = today or timezone.now().date()
+    weeks = weeks or transport_setting('FORECAST_HISTORY_WEEKS')
+    days = days or transport_setting('FORECAST_DAYS')
+
+    route_ids = numpy.asarray(sorted(Route.objects.values_list('pk', flat=True)), dtype=int)
+    if not len(route_ids):
+        return 0
+    start = today - timedelta(weeks=weeks)
+    matrix = history_matrix(route_ids, start, weeks * 7, list(booking_counts(start, today)))
+    baseline = weekday_baseline(matrix, start)
+
+    targets = [today + timedelta(days=offset) for offset in range(days)]
+    expected = baseline[:, [day.weekday() for day in targets]].round(2)
+    generated_at = timezone.now()
+    forecasts = [
+        DemandForecast(route_id=route_id, day=day, expected_bookings=value, generated_at=generated_at)
+        for route_id, row in zip(route_ids.tolist(), expected.tolist())
+        for day, value in zip(targets, row)
+    ]
+    # Past days keep their last forecast, to compare with what was actually booked
+    DemandForecast.objects.bulk_create(
+        forecasts, batch_size=1000, update_conflicts=True,
+        unique_fields=['route', 'day'], update_fields=['expected_bookings', 'generated_at'],
+    )
+    return len(forecasts)
@@ -0,0 +1,189 @@
+import math
+import threading
+import time
+from collections import defaultdict
+from django.db.models import Max
+from .conf import transport_setting
+from .models import Branch, ChangeLog
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - optional dependency
+    numpy = None
+
+EARTH_RADIUS_KM = 6371.0088
+# Size of a grid cell in degrees of latitude (about 55 km)
+CELL_DEGREES = 0.5
+# A road is never shorter than the great-circle distance (5% slack for
+# imprecise coordinates) and rarely more than three times as long.
+MIN_DETOUR, MAX_DETOUR = 0.95, 3.0
+# More branch changes than this since the last sync rebuild the grid from scratch
+MAX_INCREMENTAL_CHANGES = 1000
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in degrees."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_many_km(lat1, lon1, lat2, lon2):
+    """
+    Element-wise ``haversine_km`` over equally long sequences, as a list.
+
+    Uses numpy when it is installed, which is about two orders of magnitude
+    faster than the Python loop for large inputs.
+    """
+    if numpy is None:
+        return [haversine_km(*point) for point in zip(lat1, lon1, lat2, lon2)]
+
+    lat1, lon1, lat2, lon2 = (numpy.radians(numpy.asarray(values, dtype=float)) for values in (lat1, lon1, lat2, lon2))
+    a = numpy.sin((lat2 - lat1) / 2) ** 2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2) ** 2
+    return (2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.minimum(1.0, numpy.sqrt(a)))).tolist()
+
+
+def implausible_distances(rows):
+    """
+    Check road distances against the straight-line distance of their endpoints.
+
+    ``rows`` are ``(key, distance_km, origin_lat, origin_lon, dest_lat, dest_lon)``;
+    rows with a missing coordinate are skipped. Returns ``(key, distance_km,
+    great_circle_km)`` for every distance outside MIN_DETOUR..MAX_DETOUR times
+    the great-circle distance.
+    """
+    rows = [row for row in rows if None not in row[2:]]
+    if not rows:
+        return []
+    keys, distances, *coordinates = zip(*rows)
+    straight = haversine_many_km(*coordinates)
+    return [
+        (key, distance, great_circle)
+        for key, distance, great_circle in zip(keys, distances, straight)
+        if not great_circle * MIN_DETOUR <= distance <= max(great_circle * MAX_DETOUR, 1.0)
+    ]
+
+
+def cell_of(lat, lon):
+    return math.floor(lat / CELL_DEGREES), math.floor(lon / CELL_DEGREES)
+
+
+class BranchGrid:
+    """
+    Branch coordinates bucketed into a fixed latitude/longitude grid.
+
+    A radius search only visits the cells overlapping the circle's bounding
+    box and measures the branches in them exactly. Branches are added, moved
+    and removed one at a time, so keeping the grid current costs O(changes).
+    """
+
+    def __init__(self):
+        self.cells = defaultdict(dict)
+        self.positions = {}
+
+    def upsert(self, branch_id, lat, lon):
+        self.remove(branch_id)
+        cell = cell_of(lat, lon)
+        self.cells[cell][branch_id] = (lat, lon)
+        self.positions[branch_id] = cell
+
+    def remove(self, branch_id):
+        cell = self.positions.pop(branch_id, None)
+        if cell is not None:
+            del self.cells[cell][branch_id]
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def nearest(self, lat, lon, radius_km, limit):
+        """Return up to ``limit`` ``(branch_id, distance_km)`` within ``radius_km``, closest first."""
+        lat_span = math.degrees(radius_km / EARTH_RADIUS_KM)
+        cos_lat = math.cos(math.radians(min(abs(lat) + lat_span, 90.0)))
+        lon_span = 180.0 if cos_lat < 1e-6 else min(180.0, lat_span / cos_lat)
+
+        low_row, low_col = cell_of(max(lat - lat_span, -90.0), lon - lon_span)
+        high_row, high_col = cell_of(min(lat + lat_span, 90.0), lon + lon_span)
+        wrap = round(360 / CELL_DEGREES)
+        columns = range(low_col, high_col + 1)
+        if len(columns) >= wrap:
+            # Every column once; -180 and 180 degrees fall in the same cell after wrapping
+            columns = range(-wrap // 2, wrap // 2)
+
+        found = []
+        for row in range(low_row, high_row + 1):
+            for column in columns:
+                # Cells west of -180 or east of 180 degrees wrap around the antimeridian
+                column = (column + wrap // 2) % wrap - wrap // 2
+                for branch_id, (branch_lat, branch_lon) in self.cells.get((row, column), {}).items():
+                    distance = haversine_km(lat, lon, branch_lat, branch_lon)
+                    if distance <= radius_km:
+                        found.append((distance, branch_id))
+        found.sort()
+        return [(branch_id, distance) for distance, branch_id in found[:limit]]
+
+
+class _GridHolder:
+    lock = threading.Lock()
+    grid = None
+    version = None
+    checked_at = 0.0
+
+
+def _load_grid():
+    grid = BranchGrid()
+    for pk, lat, lon in Branch.objects.filter(latitude__isnull=False, longitude__isnull=False).values_list(
+            'pk', 'latitude', 'longitude'):
+        grid.upsert(pk, lat, lon)
+    return grid
+
+
+def _apply_changes(grid, branch_ids):
+    rows = dict((pk, (lat, lon)) for pk, lat, lon in Branch.objects.filter(pk__in=branch_ids).values_list(
+        'pk', 'latitude', 'longitude'))
+    for branch_id in branch_ids:
+        lat, lon = rows.get(branch_id, (None, None))
+        if lat is None or lon is None:
+            grid.remove(branch_id)
+        else:
+            grid.upsert(branch_id, lat, lon)
+
+
+def get_branch_grid():
+    """
+    The process-wide ``BranchGrid``, brought up to date from ``ChangeLog``.
+
+    At most every ``PLACES_REFRESH_SECONDS`` (immediately after
+    ``invalidate_branch_grid``) the branch changes logged since the last sync
+    are applied one by one; only a long backlog triggers a full reload.
+    """
+    holder = _GridHolder
+    now = time.monotonic()
+    if holder.grid is not None and now - holder.checked_at < transport_setting('PLACES_REFRESH_SECONDS'):
+        return holder.grid
+
+    with holder.lock:
+        if holder.grid is not None and now - holder.checked_at < transport_setting('PLACES_REFRESH_SECONDS'):
+            return holder.grid
+        if holder.grid is None:
+            holder.version = ChangeLog.objects.filter(kind='branch').aggregate(version=Max('pk'))['version'] or 0
+            holder.grid = _load_grid()
+        else:
+            changes = list(
+                ChangeLog.objects.filter(kind='branch', pk__gt=holder.version)
+                .order_by('pk').values_list('pk', 'object_id')[:MAX_INCREMENTAL_CHANGES + 1]
+            )
+            if len(changes) > MAX_INCREMENTAL_CHANGES:
+                holder.version = ChangeLog.objects.filter(kind='branch').aggregate(version=Max('pk'))['version']
+                holder.grid = _load_grid()
+            elif changes:
+                _apply_changes(holder.grid, {object_id for _, object_id in changes})
+                holder.version = changes[-1][0]
+        holder.checked_at = now
+        return holder.grid
+
+
+def invalidate_branch_grid():
+    """Make the next ``get_branch_grid()`` call apply pending branch changes; call after branch writes."""
+    _GridHolder.checked_at = 0.0
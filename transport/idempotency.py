@@ -0,0 +1,76 @@
+import hashlib
+import json
+import time
+from django.core.cache import caches
+from .conf import transport_setting
+
+PENDING = 'pending'
+DONE = 'done'
+
+
+class IdempotencyConflict(Exception):
+    """The key is in use by a different operation, or its first execution is still running."""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def get_store():
+    return caches[transport_setting('IDEMPOTENCY_CACHE')]
+
+
+def fingerprint(query, variables, operation_name):
+    payload = json.dumps([query, variables, operation_name], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def store_key(user_id, key):
+    return 'idempotency:%s:%s' % (user_id or 'anonymous', hashlib.sha256(key.encode()).hexdigest())
+
+
+def run_once(user_id, key, operation, execute):
+    """
+    Execute ``execute()`` once per ``(user_id, key)`` and return its ``(body, status)``.
+
+    The first caller marks the key as pending with an atomic ``cache.add``,
+    runs the operation and stores the result for ``IDEMPOTENCY_TTL_SECONDS``.
+    Replays get the stored result back. A duplicate arriving while the first
+    one is still running polls until the result is stored, for at most
+    ``IDEMPOTENCY_WAIT_SECONDS``. ``operation`` is the request fingerprint;
+    reusing a key for a different operation raises ``IdempotencyConflict``.
+
+    If ``execute`` raises, the pending mark is dropped so the client can retry.
+    """
+    store = get_store()
+    cache_key = store_key(user_id, key)
+    deadline = time.monotonic() + transport_setting('IDEMPOTENCY_WAIT_SECONDS')
+    delay = 0.01
+
+    while not store.add(cache_key, {'state': PENDING, 'operation': operation},
+                        transport_setting('IDEMPOTENCY_WAIT_SECONDS') + 30):
+        entry = store.get(cache_key)
+        if entry is None:
+            # Expired or released between add() and get(); try to claim it again.
+            continue
+        if entry['operation'] != operation:
+            raise IdempotencyConflict("Idempotency-Key was already used for a different operation.", 422)
+        if entry['state'] == DONE:
+            return entry['body'], entry['status']
+        if time.monotonic() >= deadline:
+            raise IdempotencyConflict("A request with this Idempotency-Key is still in progress.", 409)
+        time.sleep(delay)
+        delay = min(delay * 2, 0.25)
+
+    try:
+        body, status = execute()
+    except BaseException:
+        store.delete(cache_key)
+        raise
+
+    store.set(
+        cache_key,
+        {'state': DONE, 'operation': operation, 'body': body, 'status': status},
+        transport_setting('IDEMPOTENCY_TTL_SECONDS'),
+    )
+    return body, status
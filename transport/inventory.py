@@ -0,0 +1,67 @@
+from typing import NamedTuple
+from django.db import transaction
+from django.db.models import Count
+from .models import Trip, ChangeLog
+
+
+class SeatFix(NamedTuple):
+    trip_id: int
+    available_seats: int  # stored value
+    expected: int
+
+
+def _seat_counts(trips):
+    """``(pk, available_seats, capacity, booked)`` per trip, from one grouped aggregate."""
+    return trips.filter(bus__isnull=False).annotate(booked=Count('bookings')).values_list(
+        'pk', 'available_seats', 'bus__capacity', 'booked'
+    )
+
+
+def _expected(available_seats, capacity, booked, full_capacity):
+    free = max(capacity - booked, 0)
+    # Organizers may offer fewer seats than the bus has, so by default only
+    # seats that do not exist are taken away.
+    return free if full_capacity else min(available_seats, free)
+
+
+def reconcile_seats(chunk_size=1000, full_capacity=False, dry_run=False):
+    """
+    Compare ``Trip.available_seats`` with the bookings and yield the fixes chunk by chunk.
+
+    Trips are walked in primary key order, ``chunk_size`` at a time, each
+    chunk checked with one grouped aggregate, so memory stays bounded however
+    many trips there are. Drifted trips of a chunk are locked, checked again
+    against the bookings (CreateBooking holds the same lock) and corrected
+    with one ``bulk_update``. By default ``available_seats`` is only lowered
+    to the seats actually free; with ``full_capacity`` it is set to
+    ``bus.capacity - bookings``. Trips without a bus and cancelled trips
+    are skipped.
+    """
+    last_pk = 0
+    while True:
+        rows = list(_seat_counts(Trip.all_objects.filter(pk__gt=last_pk, cancelled_at=None).order_by('pk'))[:chunk_size])
+        if not rows:
+            return
+        last_pk = rows[-1][0]
+
+        drifted = [
+            pk for pk, available_seats, capacity, booked in rows
+            if available_seats != _expected(available_seats, capacity, booked, full_capacity)
+        ]
+        if not drifted:
+            yield []
+            continue
+
+        with transaction.atomic():
+            trips = Trip.all_objects.select_for_update().in_bulk(drifted)
+            fixes = [
+                SeatFix(pk, available_seats, _expected(available_seats, capacity, booked, full_capacity))
+                for pk, available_seats, capacity, booked in _seat_counts(Trip.all_objects.filter(pk__in=drifted))
+                if available_seats != _expected(available_seats, capacity, booked, full_capacity)
+            ]
+            if not dry_run and fixes:
+                for fix in fixes:
+                    trips[fix.trip_id].available_seats = fix.expected
+                Trip.all_objects.bulk_update([trips[fix.trip_id] for fix in fixes], ['available_seats'])
+                ChangeLog.record(Trip, [fix.trip_id for fix in fixes])
+        yield fixes
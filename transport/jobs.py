@@ -0,0 +1,188 @@
+import logging
+import os
+import random
+import socket
+import threading
+from datetime import timedelta
+from django.db import connection, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .conf import transport_setting
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Job name -> callable taking the claimed ``Job``.
+HANDLERS = {}
+
+
+def job_handler(name):
+    """
+    Decorator registering a function as the handler of the jobs called ``name``.
+
+    Handlers live in ``transport/tasks.py``, which is imported when the app is ready.
+    """
+    def decorator(func):
+        HANDLERS[name] = func
+        return func
+
+    return decorator
+
+
+def enqueue(name, payload=None, run_at=None, max_attempts=None):
+    """Queue a job and return it; inside a transaction workers only see it after the commit."""
+    if name not in HANDLERS:
+        raise ValueError(f"No handler registered for job {name!r}.")
+    job = Job(name=name, payload=payload or {})
+    if run_at is not None:
+        job.run_at = run_at
+    if max_attempts is not None:
+        job.max_attempts = max_attempts
+    job.save()
+    return job
+
+
+def enqueue_many(name, payloads, batch_size=500):
+    """Queue one ``name`` job per payload with bulk inserts; returns the number queued."""
+    if name not in HANDLERS:
+        raise ValueError(f"No handler registered for job {name!r}.")
+    jobs = Job.objects.bulk_create((Job(name=name, payload=payload) for payload in payloads), batch_size=batch_size)
+    return len(jobs)
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _claimable(now):
+    """Queued jobs that are due, plus running jobs whose worker let the lease expire."""
+    return Job.objects.filter(
+        Q(status=Job.QUEUED, run_at__lte=now) | Q(status=Job.RUNNING, locked_until__lt=now)
+    ).order_by('run_at', 'pk')
+
+
+def _take(job, worker_id, now):
+    job.status = Job.RUNNING
+    job.attempts += 1
+    job.locked_by = worker_id
+    job.locked_until = now + timedelta(seconds=transport_setting('JOB_LEASE_SECONDS'))
+    job.started_at = now
+    return {
+        'status': job.status,
+        'attempts': job.attempts,
+        'locked_by': job.locked_by,
+        'locked_until': job.locked_until,
+        'started_at': job.started_at,
+    }
+
+
+def claim_next_job(worker_id=None):
+    """
+    Lease the next due job to ``worker_id`` and return it, or ``None`` if there is none.
+
+    Databases supporting ``SELECT ... FOR UPDATE SKIP LOCKED`` let concurrent
+    workers pick different rows without waiting on each other. Elsewhere (e.g.
+    SQLite) the claim is a conditional UPDATE on the row's previous state; a
+    worker that loses the race moves on to the next candidate.
+    """
+    worker_id = worker_id or default_worker_id()
+    now = timezone.now()
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = _claimable(now).select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            Job.objects.filter(pk=job.pk).update(**_take(job, worker_id, now))
+            return job
+
+    while True:
+        job = _claimable(now).first()
+        if job is None:
+            return None
+        previous = {'status': job.status, 'locked_until': job.locked_until}
+        if Job.objects.filter(pk=job.pk, **previous).update(**_take(job, worker_id, now)):
+            return job
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter for the given number of failed attempts."""
+    base = transport_setting('JOB_RETRY_BASE_SECONDS')
+    delay = min(base * 2 ** (attempts - 1), transport_setting('JOB_RETRY_MAX_SECONDS'))
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+class LeaseHeartbeat:
+    """
+    Renews the lease of a claimed job from a background thread while its handler runs.
+
+    Without it a handler that reports no progress for ``JOB_LEASE_SECONDS``
+    (a timetable build, the nightly forecast) would be handed to a second
+    worker while the first is still running it. The thread stops renewing
+    once the job is no longer leased to this worker.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.lease = timedelta(seconds=transport_setting('JOB_LEASE_SECONDS'))
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f"lease-{job.pk}", daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.lease.total_seconds() / 3):
+                renewed = Job.objects.filter(pk=self.job.pk, status=Job.RUNNING, locked_by=self.job.locked_by).update(
+                    locked_until=timezone.now() + self.lease
+                )
+                if not renewed:
+                    return
+        finally:
+            # This thread's own connections
+            connections.close_all()
+
+
+def run_job(job):
+    """
+    Run a claimed job, then mark it succeeded, requeue it with backoff, or mark it failed.
+
+    The outcome is only stored while the job is still leased to this worker; if
+    the lease expired and another worker took over, that worker records it.
+    """
+    owner = job.locked_by
+    try:
+        handler = HANDLERS[job.name]
+        with LeaseHeartbeat(job):
+            handler(job)
+    except Exception as e:
+        logger.exception("Job %s failed (attempt %s of %s)", job, job.attempts, job.max_attempts)
+        job.error = f"{type(e).__name__}: {e}"
+        if job.attempts < job.max_attempts:
+            job.status = Job.QUEUED
+            job.run_at = timezone.now() + retry_delay(job.attempts)
+        else:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+    else:
+        job.status = Job.SUCCEEDED
+        job.error = ''
+        job.finished_at = timezone.now()
+
+    job.locked_by = ''
+    job.locked_until = None
+    Job.objects.filter(pk=job.pk, locked_by=owner).update(
+        status=job.status,
+        error=job.error,
+        run_at=job.run_at,
+        finished_at=job.finished_at,
+        locked_by=job.locked_by,
+        locked_until=job.locked_until,
+    )
+    return job
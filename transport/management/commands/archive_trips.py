@@ -0,0 +1,42 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from transport.archive import archive_chunk
+
+
+class Command(BaseCommand):
+    help = 'Move departed trips, their bookings and crew links into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30,
+                            help='Archive trips that departed more than this many days ago (default: 30)')
+        parser.add_argument('--before', help='Archive trips that departed before this ISO datetime instead')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Trips moved per transaction (default: 500)')
+        parser.add_argument('--max-chunks', type=int,
+                            help='Stop after this many chunks; run again to resume')
+
+    def handle(self, *args, **options):
+        if options['before']:
+            cutoff = parse_datetime(options['before'])
+            if cutoff is None:
+                raise CommandError('--before must be an ISO datetime.')
+            if timezone.is_naive(cutoff):
+                cutoff = timezone.make_aware(cutoff)
+        else:
+            cutoff = timezone.now() - timedelta(days=options['days'])
+
+        total_trips = total_bookings = chunks = 0
+        while options['max_chunks'] is None or chunks < options['max_chunks']:
+            trips, bookings = archive_chunk(cutoff, options['chunk_size'])
+            if not trips:
+                break
+            chunks += 1
+            total_trips += trips
+            total_bookings += bookings
+            self.stdout.write(f'Chunk {chunks}: archived {trips} trips and {bookings} bookings.')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {total_trips} trips and {total_bookings} bookings departed before {cutoff.isoformat()}.'
+        ))
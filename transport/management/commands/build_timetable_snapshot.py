@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from transport.jobs import enqueue
+from transport.timetable import build_snapshot, timetable_root
+
+
+class Command(BaseCommand):
+    help = 'Write the static timetable snapshot of routes and upcoming trips'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Days of upcoming trips to include (default: TIMETABLE_DAYS)')
+        parser.add_argument('--full', action='store_true',
+                            help='Rewrite every partition instead of only the changed ones')
+        parser.add_argument('--background', action='store_true',
+                            help='Queue the build for run_worker instead of running it now')
+
+    def handle(self, *args, **options):
+        if options['background']:
+            job = enqueue('build_timetable_snapshot', {'days': options['days'], 'full': options['full']})
+            self.stdout.write(self.style.SUCCESS(f'Queued job {job.pk}.'))
+            return
+
+        counts = build_snapshot(days=options['days'], full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Timetable written to {timetable_root()}: {counts['written']} partitions written, "
+            f"{counts['kept']} unchanged, {counts['retired']} retired."
+        ))
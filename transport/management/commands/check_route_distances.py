@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from transport.geo import implausible_distances
+from transport.models import Route
+
+
+class Command(BaseCommand):
+    help = 'Report routes whose distance_km does not fit the coordinates of their branches'
+
+    def handle(self, *args, **options):
+        rows = Route.objects.values_list(
+            'pk', 'distance_km',
+            'origin__latitude', 'origin__longitude',
+            'destination__latitude', 'destination__longitude',
+        )
+        problems = implausible_distances(rows)
+        for route_id, distance, great_circle in problems:
+            self.stdout.write(
+                f'Route {route_id}: {distance:g} km for branches {great_circle:.1f} km apart.'
+            )
+        if problems:
+            raise CommandError(f'{len(problems)} route(s) have an implausible distance.')
+        self.stdout.write(self.style.SUCCESS('All route distances fit the branch coordinates.'))
@@ -0,0 +1,23 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from transport.scheduling import find_conflicts, upcoming_slots
+
+
+class Command(BaseCommand):
+    help = 'Report buses, drivers and crew members assigned to overlapping trips'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30,
+                            help='Check trips departing within this many days (default: 30)')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        slots = upcoming_slots(now, now + timedelta(days=options['days']))
+        conflicts = find_conflicts(slots)
+
+        for conflict in conflicts:
+            self.stdout.write(self.style.WARNING(f'Trip {conflict.slot.trip_id}: {conflict}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {len(slots)} trips, found {len(conflicts)} conflicting assignments.'
+        ))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from transport.forecast import build_forecasts
+from transport.jobs import enqueue
+
+
+class Command(BaseCommand):
+    help = 'Refit per-route demand forecasts from the booking history (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--weeks', type=int,
+                            help='Weeks of booking history to fit (default: FORECAST_HISTORY_WEEKS)')
+        parser.add_argument('--days', type=int, help='Days ahead to forecast (default: FORECAST_DAYS)')
+        parser.add_argument('--background', action='store_true',
+                            help='Queue the forecast for run_worker instead of running it now')
+
+    def handle(self, *args, **options):
+        if options['background']:
+            job = enqueue('forecast_demand', {'weeks': options['weeks'], 'days': options['days']})
+            self.stdout.write(self.style.SUCCESS(f'Queued job {job.pk}.'))
+            return
+
+        try:
+            written = build_forecasts(weeks=options['weeks'], days=options['days'])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'{written} forecast(s) written.'))
@@ -0,0 +1,34 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from transport.network import FORMATS, import_network, read_records
+
+
+class Command(BaseCommand):
+    help = 'Create or update cities, branches, buses and routes from a CSV or JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import; see transport.network for the columns')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Input format (default: csv for .csv files, jsonl otherwise)')
+        parser.add_argument('--batch-size', type=int, help='Records upserted per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and report without saving')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        try:
+            stream = open(path, newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(f'Cannot read {path}: {e.strerror}.')
+
+        with stream:
+            report = import_network(read_records(stream, format), options['batch_size'], options['dry_run'])
+
+        for error in report.errors:
+            self.stderr.write(f'{os.path.basename(path)}:{error.line}: {error.message}')
+        prefix = 'Dry run: ' if options['dry_run'] else ''
+        summary = (f'{prefix}{report.created} created, {report.updated} updated, '
+                   f'{report.unchanged} unchanged, {len(report.errors)} rejected.')
+        if report.errors:
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary))
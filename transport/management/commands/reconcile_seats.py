@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from transport.inventory import reconcile_seats
+from transport.jobs import enqueue
+
+
+class Command(BaseCommand):
+    help = 'Correct Trip.available_seats that drifted from the bookings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Trips checked per aggregate query (default: 1000)')
+        parser.add_argument('--full-capacity', action='store_true',
+                            help='Set available seats to bus capacity minus bookings, '
+                                 'instead of only removing seats that are not free')
+        parser.add_argument('--dry-run', action='store_true', help='Report the drift without fixing it')
+        parser.add_argument('--background', action='store_true',
+                            help='Queue the reconciliation for run_worker instead of running it now')
+
+    def handle(self, *args, **options):
+        if options['background']:
+            job = enqueue('reconcile_seats', {
+                'chunk_size': options['chunk_size'], 'full_capacity': options['full_capacity'],
+            })
+            self.stdout.write(self.style.SUCCESS(f'Queued job {job.pk}.'))
+            return
+
+        checked_chunks = fixed = 0
+        for fixes in reconcile_seats(options['chunk_size'], options['full_capacity'], options['dry_run']):
+            checked_chunks += 1
+            fixed += len(fixes)
+            for fix in fixes:
+                self.stdout.write(f'Trip {fix.trip_id}: available seats {fix.available_seats} -> {fix.expected}')
+
+        verb = 'would be corrected' if options['dry_run'] else 'corrected'
+        self.stdout.write(self.style.SUCCESS(f'{fixed} trip(s) {verb} in {checked_chunks} chunk(s).'))
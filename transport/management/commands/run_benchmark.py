@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from transport.benchmarks import BENCHMARKS, run_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Run one of the transport micro-benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(BENCHMARKS))
+        parser.add_argument('--size', type=int, help='Number of rows/items to benchmark with')
+
+    def handle(self, *args, **options):
+        run_benchmark(options['name'], self.stdout, options['size'])
@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from transport.reminders import ReminderScheduler
+
+
+class Command(BaseCommand):
+    help = 'Send departure reminders to the customers and crew of upcoming trips'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Send the reminders due now and exit instead of running continuously')
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help='Seconds between checks for due reminders and changed trips (default: 5)')
+
+    def handle(self, *args, **options):
+        # One scheduler per deployment; a second one would send every reminder twice
+        scheduler = ReminderScheduler()
+        while True:
+            sent = scheduler.tick()
+            if sent:
+                self.stdout.write(self.style.SUCCESS(f'Sent {sent} reminder(s).'))
+            if options['once']:
+                return
+            time.sleep(options['poll_interval'])
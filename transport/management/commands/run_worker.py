@@ -0,0 +1,58 @@
+import multiprocessing
+import time
+from django.core.management.base import BaseCommand
+from django.db import connections
+from transport.jobs import claim_next_job, default_worker_id, run_job
+
+
+class Command(BaseCommand):
+    help = 'Process queued background jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty instead of polling for new jobs')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait between polls when the queue is empty (default: 2)')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Number of worker processes to run (default: 1)')
+
+    def handle(self, *args, **options):
+        if options['processes'] <= 1:
+            self.work(options['once'], options['poll_interval'])
+            return
+
+        # Children must not share the parent's database connection.
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(target=self.work, args=(options['once'], options['poll_interval']))
+            for _ in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+
+    def work(self, once, poll_interval):
+        worker_id = default_worker_id()
+        while True:
+            job = claim_next_job(worker_id)
+            if job is None:
+                if once:
+                    return
+                time.sleep(poll_interval)
+                continue
+
+            self.stdout.write(f'[{worker_id}] Running {job.name} #{job.pk} (attempt {job.attempts})...')
+            run_job(job)
+            if job.status == job.SUCCEEDED:
+                self.stdout.write(self.style.SUCCESS(f'{job.name} #{job.pk} succeeded.'))
+            elif job.status == job.QUEUED:
+                self.stdout.write(self.style.WARNING(
+                    f'{job.name} #{job.pk} failed, retrying at {job.run_at.isoformat()}: {job.error}'
+                ))
+            else:
+                self.stdout.write(self.style.ERROR(f'{job.name} #{job.pk} failed: {job.error}'))
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='trip',
+            name='departure_time',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.CreateModel(
+            name='ArchivedTrip',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('departure_time', models.DateTimeField(db_index=True)),
+                ('available_seats', models.PositiveIntegerField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('bus', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_trips', to='transport.bus')),
+                ('crew', models.ManyToManyField(blank=True, related_name='archived_crewed_trips', to=settings.AUTH_USER_MODEL)),
+                ('driver', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_driven_trips', to=settings.AUTH_USER_MODEL)),
+                ('organizer', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_organized_trips', to=settings.AUTH_USER_MODEL)),
+                ('route', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_trips', to='transport.route')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedBooking',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('seat_number', models.PositiveIntegerField()),
+                ('booked_at', models.DateTimeField()),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_bookings', to=settings.AUTH_USER_MODEL)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bookings', to='transport.archivedtrip')),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0004_job_retries_and_leases'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seats', models.PositiveIntegerField(default=1)),
+                ('sequence', models.PositiveBigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entries', to=settings.AUTH_USER_MODEL)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist', to='transport.trip')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('trip', 'sequence'), name='unique_waitlist_sequence'), models.UniqueConstraint(fields=('trip', 'customer'), name='unique_waitlist_customer')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_arrival_time(apps, schema_editor):
+    Route = apps.get_model('transport', 'Route')
+    Trip = apps.get_model('transport', 'Trip')
+    for route_id, duration in Route.objects.values_list('id', 'duration').iterator():
+        Trip.objects.filter(route_id=route_id).update(arrival_time=F('departure_time') + duration)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0005_waitlist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='arrival_time',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(fill_arrival_time, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='trip',
+            name='arrival_time',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0006_trip_arrival_time'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['driver', 'departure_time'], name='transport_t_driver__ae8ccf_idx'),
+        ),
+    ]
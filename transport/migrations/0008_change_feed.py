@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:13
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def log_existing_rows(apps, schema_editor):
+    # Every existing row gets a change entry so changesSince(0) returns the full data set.
+    ChangeLog = apps.get_model('transport', 'ChangeLog')
+    for kind in ('city', 'branch', 'bus', 'route', 'trip'):
+        model = apps.get_model('transport', kind)
+        ids = model.objects.values_list('id', flat=True).order_by('id').iterator(chunk_size=2000)
+        ChangeLog.objects.bulk_create((ChangeLog(kind=kind, object_id=pk) for pk in ids), batch_size=2000)
+        model.objects.update(version=Subquery(
+            ChangeLog.objects.filter(kind=kind, object_id=OuterRef('pk')).values('pk')[:1]
+        ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0007_trip_driver_departure_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='branch',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='bus',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'object_id'], name='transport_c_kind_7e7634_idx')],
+            },
+        ),
+        migrations.RunPython(log_existing_rows, migrations.RunPython.noop),
+    ]
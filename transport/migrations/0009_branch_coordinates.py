@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0008_change_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='branch',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='branch',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0009_branch_coordinates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatLayout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('rows', models.PositiveIntegerField()),
+                ('columns', models.PositiveIntegerField()),
+                ('aisle_after', models.PositiveIntegerField(default=0)),
+                ('seat_classes', models.JSONField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='bus',
+            name='layout',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='buses', to='transport.seatlayout'),
+        ),
+    ]
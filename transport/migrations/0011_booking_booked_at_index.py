@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0010_seat_layouts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='booking',
+            name='booked_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0013_trip_reminder_sent_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DemandForecast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('expected_bookings', models.FloatField()),
+                ('generated_at', models.DateTimeField()),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='forecasts', to='transport.route')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('route', 'day'), name='unique_forecast_route_day')],
+            },
+        ),
+    ]
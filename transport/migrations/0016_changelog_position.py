@@ -0,0 +1,24 @@
+from django.db import migrations, models
+from django.db.models import F
+
+
+def publish_existing_entries(apps, schema_editor):
+    # Positions start out equal to the ids, so the versions clients already hold stay valid
+    ChangeLog = apps.get_model('transport', 'ChangeLog')
+    ChangeLog.objects.update(position=F('pk'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport', '0015_archive_cancelled_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changelog',
+            name='position',
+            field=models.BigIntegerField(editable=False, null=True, unique=True),
+        ),
+        migrations.RunPython(publish_existing_entries, migrations.RunPython.noop),
+    ]
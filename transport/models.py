@@ -1,47 +1,223 @@
-from django.db import models
+from datetime import timedelta
+from django.db import connections, models, transaction
+from django.db.models import F, Max, OuterRef, Subquery
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from .conf import transport_setting
 
 CustomUser = get_user_model()
 
-class City(models.Model):
+
+class PendingDeletionManager(models.Manager):
+    """Default manager that hides rows whose cascade delete is still being processed."""
+    hidden_lookup = 'pending_deletion'
+
+    def get_queryset(self):
+        return super().get_queryset().filter(**{self.hidden_lookup: False})
+
+class TripManager(PendingDeletionManager):
+    """Also hides cancelled trips; they stay reachable through ``all_objects`` and their bookings."""
+    hidden_lookup = 'route__pending_deletion'
+
+    def get_queryset(self):
+        return super().get_queryset().filter(cancelled_at=None)
+
+class BookingManager(PendingDeletionManager):
+    hidden_lookup = 'trip__route__pending_deletion'
+
+
+# ---- Change Feed ----
+# Key of the PostgreSQL advisory lock that runs ChangeLog.publish() one call at a time
+CHANGE_LOG_LOCK = 0x63686C67
+
+
+class ChangeLog(models.Model):
+    """
+    One change to a synced row; ``position`` is the change version served by ``changesSince``.
+
+    ``deleted`` entries are tombstones: the row is gone, or hidden pending deletion.
+
+    Ids are handed out before commit, so writers can commit them out of order
+    and clients cannot page by id. Entries are written without a position
+    and ``publish`` numbers the committed ones afterwards, one call at a time,
+    so a position never becomes visible after a higher one. Only the latest
+    entry of a row is kept.
+    """
+    kind = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    position = models.BigIntegerField(null=True, unique=True, editable=False)
+
+    class Meta:
+        indexes = [models.Index(fields=['kind', 'object_id']), models.Index(fields=['kind', 'id'])]
+
+    @classmethod
+    def record(cls, model, ids, deleted=False):
+        """
+        Log a change of the ``model`` rows ``ids`` and stamp their ``version``.
+
+        Used directly by code that writes with ``QuerySet.update()`` or
+        ``delete()``; ``VersionedModel.save()`` calls it for single rows.
+        The entries they replace are dropped, so a trip booked a hundred
+        times still has one entry.
+        """
+        ids = list(ids)
+        if not ids:
+            return None
+        kind = model._meta.model_name
+        if len(ids) == 1:
+            cls.objects.filter(kind=kind, object_id=ids[0]).delete()
+            version = cls.objects.create(kind=kind, object_id=ids[0], deleted=deleted).pk
+            if not deleted:
+                model.all_objects.filter(pk=ids[0]).update(version=version)
+            return version
+
+        cls.objects.filter(kind=kind, object_id__in=ids).delete()
+        cls.objects.bulk_create([cls(kind=kind, object_id=pk, deleted=deleted) for pk in ids])
+        if not deleted:
+            model.all_objects.filter(pk__in=ids).update(version=Subquery(
+                cls.objects.filter(kind=kind, object_id=OuterRef('pk')).values('pk')[:1]
+            ))
+        return None
+
+    @classmethod
+    def publish(cls):
+        """
+        Give the committed entries without a position the next positions, in id order.
+
+        Runs in its own short transaction under an advisory lock on PostgreSQL,
+        never inside the writers' transactions. Entries a writer is replacing
+        right now are skipped and get a later position on the next call.
+        """
+        if not cls.objects.filter(position=None).exists():
+            return
+        with transaction.atomic(using=cls.objects.db):
+            connection = connections[cls.objects.db]
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_xact_lock(%s)", [CHANGE_LOG_LOCK])
+            ids = list(
+                cls.objects.select_for_update(skip_locked=True).filter(position=None)
+                .order_by('pk').values_list('pk', flat=True)
+            )
+            if not ids:
+                return
+            # position = id whenever that still sorts after everything published before
+            last = cls.objects.aggregate(last=Max('position'))['last'] or 0
+            offset = max(0, last - ids[0] + 1)
+            for start in range(0, len(ids), 1000):
+                cls.objects.filter(pk__in=ids[start:start + 1000]).update(position=F('pk') + offset)
+
+
+class VersionedModel(models.Model):
+    """Row whose every save is logged in ``ChangeLog``; ``version`` is its latest change."""
+    version = models.PositiveBigIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.version = ChangeLog.record(type(self), [self.pk])
+
+
+class City(VersionedModel):
     name = models.CharField(max_length=100, unique=True)
+    pending_deletion = models.BooleanField(default=False)
+
+    objects = PendingDeletionManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return self.name
 
-class Branch(models.Model):
+class Branch(VersionedModel):
     name = models.CharField(max_length=100)
     city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='branches')
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    pending_deletion = models.BooleanField(default=False)
+
+    objects = PendingDeletionManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return f"{self.name} - {self.city.name}"
 
 # ---- Transportation Models ----
-class Bus(models.Model):
+class SeatLayout(models.Model):
+    """
+    Seat arrangement shared by buses of one model.
+
+    ``seat_classes`` holds a class name for each of the ``rows`` x ``columns``
+    positions, row by row; an empty string marks a position without a seat.
+    The aisle runs after column ``aisle_after`` (0 for none). Seats are
+    numbered from 1 row by row, skipping empty positions.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    rows = models.PositiveIntegerField()
+    columns = models.PositiveIntegerField()
+    aisle_after = models.PositiveIntegerField(default=0)
+    seat_classes = models.JSONField()
+
+    def __str__(self):
+        return self.name
+
+class Bus(VersionedModel):
     plate_number = models.CharField(max_length=20, unique=True)
     capacity = models.PositiveIntegerField()
     branch = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name='buses')
+    layout = models.ForeignKey(SeatLayout, on_delete=models.SET_NULL, null=True, blank=True, related_name='buses')
+    pending_deletion = models.BooleanField(default=False)
+
+    objects = PendingDeletionManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return self.plate_number
 
-class Route(models.Model):
+class Route(VersionedModel):
     origin = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name='routes_from')
     destination = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name='routes_to')
     duration = models.DurationField()
     distance_km = models.FloatField()
+    pending_deletion = models.BooleanField(default=False)
+
+    objects = PendingDeletionManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return f"{self.origin} to {self.destination}"
 
-class Trip(models.Model):
+class Trip(VersionedModel):
     route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='trips')
     bus = models.ForeignKey(Bus, on_delete=models.SET_NULL, null=True, related_name='trips')
     organizer = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, related_name='organized_trips')
     driver = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, related_name='driven_trips')
     crew = models.ManyToManyField(CustomUser, related_name='crewed_trips', blank=True)
-    departure_time = models.DateTimeField()
+    departure_time = models.DateTimeField(db_index=True)
+    # departure_time + route.duration, kept in sync by save() and UpdateRoute
+    arrival_time = models.DateTimeField(db_index=True)
     available_seats = models.PositiveIntegerField()
+    # Set by cancelTrips, together with available_seats = 0
+    cancelled_at = models.DateTimeField(null=True, blank=True)
+    # Set once the departure reminder went out (see reminders.py); cleared when the departure moves
+    reminder_sent_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = TripManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['driver', 'departure_time'])]
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        # Seat count updates leave the arrival alone and so never load the route
+        if update_fields is None or {'departure_time', 'route'} & set(update_fields):
+            self.arrival_time = self.departure_time + self.route.duration
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'arrival_time'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Trip from {self.route.origin} to {self.route.destination} at {self.departure_time}"
@@ -50,10 +226,133 @@ class Booking(models.Model):
     customer = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='bookings')
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='bookings')
     seat_number = models.PositiveIntegerField()
-    booked_at = models.DateTimeField(auto_now_add=True)
+    booked_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Set when the trip is cancelled; the seat stays recorded for the customer's history
+    cancelled_at = models.DateTimeField(null=True, blank=True)
+
+    objects = BookingManager()
+    all_objects = models.Manager()
 
     class Meta:
         unique_together = ('trip', 'seat_number')
 
     def __str__(self):
         return f"{self.customer.username} - Seat {self.seat_number} on {self.trip}"
+
+
+class WaitlistEntry(models.Model):
+    """A customer queued for seats on a sold-out trip, served in ``sequence`` order."""
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='waitlist')
+    customer = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='waitlist_entries')
+    seats = models.PositiveIntegerField(default=1)
+    sequence = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['trip', 'sequence'], name='unique_waitlist_sequence'),
+            models.UniqueConstraint(fields=['trip', 'customer'], name='unique_waitlist_customer'),
+        ]
+
+    def __str__(self):
+        return f"{self.customer.username} waiting for {self.seats} seat(s) on {self.trip}"
+
+# ---- Archive Models ----
+class ArchivedTrip(models.Model):
+    """A departed trip moved out of the hot ``Trip`` table by ``archive_trips``."""
+    id = models.BigIntegerField(primary_key=True)
+    route = models.ForeignKey(Route, on_delete=models.SET_NULL, null=True, related_name='archived_trips')
+    bus = models.ForeignKey(Bus, on_delete=models.SET_NULL, null=True, related_name='archived_trips')
+    organizer = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, related_name='archived_organized_trips')
+    driver = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, related_name='archived_driven_trips')
+    crew = models.ManyToManyField(CustomUser, related_name='archived_crewed_trips', blank=True)
+    departure_time = models.DateTimeField(db_index=True)
+    available_seats = models.PositiveIntegerField()
+    cancelled_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived trip {self.id} at {self.departure_time}"
+
+class ArchivedBooking(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='archived_bookings')
+    trip = models.ForeignKey(ArchivedTrip, on_delete=models.CASCADE, related_name='bookings')
+    seat_number = models.PositiveIntegerField()
+    booked_at = models.DateTimeField()
+    cancelled_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.customer_id} - Seat {self.seat_number} on archived trip {self.trip_id}"
+
+
+# ---- Demand Forecasts ----
+class DemandForecast(models.Model):
+    """Expected bookings of a route on a day, refreshed nightly by ``forecast_demand``."""
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='forecasts')
+    day = models.DateField()
+    expected_bookings = models.FloatField()
+    generated_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['route', 'day'], name='unique_forecast_route_day')]
+
+    def __str__(self):
+        return f"{self.route_id} on {self.day}: {self.expected_bookings:g}"
+
+
+# ---- Background Jobs ----
+class Job(models.Model):
+    """
+    A unit of background work picked up by the ``run_worker`` command.
+
+    A running job holds a lease until ``locked_until``; if its worker dies the
+    lease expires and another worker picks the job up again.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+            models.Index(fields=['status', 'locked_until']),
+        ]
+
+    def report_progress(self, **progress):
+        """
+        Merge ``progress`` into the stored progress without touching the other columns.
+
+        Reporting progress also renews the lease of a running job.
+        """
+        self.progress.update(progress)
+        updates = {'progress': self.progress}
+        if self.status == Job.RUNNING:
+            self.locked_until = updates['locked_until'] = (
+                timezone.now() + timedelta(seconds=transport_setting('JOB_LEASE_SECONDS'))
+            )
+        Job.objects.filter(pk=self.pk).update(**updates)
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
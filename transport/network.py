@@ -0,0 +1,422 @@
+"""
+Bulk import of cities, branches, buses and routes.
+
+Records come from a CSV file (one header row) or JSON Lines, one object per
+line, and are read lazily so a whole region can be onboarded from one file.
+Every record has a ``kind`` and refers to other rows by natural key:
+
+* ``city``: ``name``
+* ``branch``: ``city``, ``name``, optional ``latitude``/``longitude``
+* ``bus``: ``plate_number``, ``city``, ``branch``, ``capacity`` and/or ``layout`` (a seat layout name)
+* ``route``: ``origin_city``, ``origin``, ``destination_city``, ``destination``,
+  ``duration`` (HH:MM:SS), ``distance_km``
+
+Names match case-insensitively, as in the create mutations. Records are
+applied in batches; within a batch cities go first, then branches, buses and
+routes, so a file only has to list a city in the same or an earlier batch
+than the branches in it. A record that fails validation is reported with its
+line number and skipped; the rest of the file is still imported.
+"""
+import csv
+import json
+from contextlib import nullcontext
+from datetime import timedelta
+from itertools import islice
+from typing import NamedTuple
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Lower, Upper
+from .conf import transport_setting
+from .geo import implausible_distances, invalidate_branch_grid
+from .models import City, Branch, Bus, Route, Trip, SeatLayout, ChangeLog
+from .places import invalidate_places
+from .seating import validate_layout
+
+KINDS = ('city', 'branch', 'bus', 'route')
+FORMATS = ('csv', 'jsonl')
+
+
+def parse_duration(text):
+    """Parse ``HH:MM:SS`` into a timedelta; raises ValueError for anything else."""
+    try:
+        hours, minutes, seconds = map(int, text.split(":"))
+    except ValueError:
+        raise ValueError("Invalid duration format. Use HH:MM:SS.")
+    return timedelta(hours=hours, minutes=minutes, seconds=seconds)
+
+
+class RowError(NamedTuple):
+    line: int
+    message: str
+
+
+class Record(NamedTuple):
+    line: int
+    kind: str
+    fields: dict
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.errors = []
+
+    def fail(self, record, message):
+        self.errors.append(RowError(record.line, message))
+
+
+def read_records(stream, format):
+    """
+    Yield ``(line, fields, error)`` for each record of a text stream.
+
+    ``fields`` maps column names to stripped values; ``error`` describes a
+    line that could not be parsed, in which case ``fields`` is None.
+    """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            fields = {
+                key.strip(): value.strip() for key, value in row.items()
+                if key and isinstance(value, str) and value.strip()
+            }
+            yield reader.line_num, fields, None
+        return
+
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            fields = json.loads(text)
+        except ValueError as e:
+            yield line, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(fields, dict):
+            yield line, None, "Each line must be a JSON object."
+            continue
+        yield line, {
+            key: value.strip() if isinstance(value, str) else value
+            for key, value in fields.items() if value not in (None, '')
+        }, None
+
+
+def required(fields, name):
+    value = fields.get(name)
+    if value is None:
+        raise ValueError(f"'{name}' is required.")
+    return str(value)
+
+
+def number(fields, name, cast, required=True):
+    value = fields.get(name)
+    if value is None:
+        if required:
+            raise ValueError(f"'{name}' is required.")
+        return None
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' must be a number.")
+
+
+def import_network(rows, batch_size=None, dry_run=False):
+    """
+    Upsert the ``(line, fields, error)`` rows of ``read_records`` and return an ``ImportReport``.
+
+    Each batch commits on its own, so an interrupted import keeps the batches
+    before it; with ``dry_run`` everything is rolled back at the end.
+    """
+    batch_size = batch_size or transport_setting('IMPORT_BATCH_SIZE')
+    report = ImportReport()
+    rows = iter(rows)
+    with transaction.atomic() if dry_run else nullcontext():
+        while batch := list(islice(rows, batch_size)):
+            with transaction.atomic():
+                import_batch(batch, report)
+        if dry_run:
+            transaction.set_rollback(True)
+    report.errors.sort()
+    if report.created or report.updated:
+        invalidate_places()
+        invalidate_branch_grid()
+    return report
+
+
+def import_batch(batch, report):
+    by_kind = {kind: [] for kind in KINDS}
+    for line, fields, error in batch:
+        record = Record(line, str(fields.get('kind', '')).lower() if fields else '', fields)
+        if error:
+            report.fail(record, error)
+        elif record.kind not in by_kind:
+            report.fail(record, f"Unknown kind {record.fields.get('kind')!r}; use one of {', '.join(KINDS)}.")
+        else:
+            by_kind[record.kind].append(record)
+
+    import_cities(by_kind['city'], report)
+    import_branches(by_kind['branch'], report)
+    import_buses(by_kind['bus'], report)
+    import_routes(by_kind['route'], report)
+
+
+def validated(records, report, parse):
+    """``(record, parse(record))`` for the records ``parse`` accepts; failures go to the report."""
+    for record in records:
+        try:
+            yield record, parse(record.fields)
+        except ValueError as e:
+            report.fail(record, str(e))
+
+
+def city_ids(names):
+    """Map lower-cased city names to the ids of the cities in use."""
+    return dict(
+        City.objects.annotate(key=Lower('name')).filter(key__in={name.lower() for name in names})
+        .values_list('key', 'pk')
+    )
+
+
+def branch_ids(keys):
+    """Map ``(city, branch)`` lower-cased name pairs to branch ids; a duplicated name maps to its oldest branch."""
+    found = {}
+    rows = (
+        Branch.objects.annotate(city_key=Lower('city__name'), key=Lower('name'))
+        .filter(city_key__in={city for city, _ in keys}, key__in={name for _, name in keys})
+        .order_by('-pk').values_list('city_key', 'key', 'pk')
+    )
+    for city, name, pk in rows:
+        found[city, name] = pk
+    return found
+
+
+def import_cities(records, report):
+    def parse(fields):
+        name = required(fields, 'name')
+        if len(name) > 100:
+            raise ValueError("City name is longer than 100 characters.")
+        return name
+
+    rows = {}
+    for record, name in validated(records, report, parse):
+        if name.lower() in rows:
+            report.unchanged += 1
+        else:
+            rows[name.lower()] = (record, name)
+    if not rows:
+        return
+
+    existing = {}
+    for key, pending in (
+        City.all_objects.annotate(key=Lower('name')).filter(key__in=rows).values_list('key', 'pending_deletion')
+    ):
+        existing[key] = pending
+    new = []
+    for key, (record, name) in rows.items():
+        if existing.get(key):
+            report.fail(record, f"City {name!r} is being deleted.")
+        elif key in existing:
+            report.unchanged += 1
+        else:
+            new.append(City(name=name))
+
+    # A city created concurrently by another import is left as it is
+    City.objects.bulk_create(new, update_conflicts=True, unique_fields=['name'], update_fields=['name'])
+    report.created += len(new)
+    ChangeLog.record(City, City.objects.filter(name__in=[city.name for city in new]).values_list('pk', flat=True))
+
+
+def import_branches(records, report):
+    def parse(fields):
+        name = required(fields, 'name')
+        latitude = number(fields, 'latitude', float, required=False)
+        longitude = number(fields, 'longitude', float, required=False)
+        if (latitude is None) != (longitude is None):
+            raise ValueError("Latitude and longitude must be given together.")
+        if latitude is not None and not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise ValueError("Coordinates out of range.")
+        return required(fields, 'city'), name, latitude, longitude
+
+    parsed = list(validated(records, report, parse))
+    cities = city_ids(city for _, (city, _, _, _) in parsed)
+    existing = {
+        (branch.city_id, branch.name.lower()): branch
+        for branch in Branch.objects.filter(city_id__in=cities.values()).order_by('-pk')
+    }
+
+    new, changed = {}, {}
+    for record, (city, name, latitude, longitude) in parsed:
+        city_id = cities.get(city.lower())
+        if city_id is None:
+            report.fail(record, f"City {city!r} not found.")
+            continue
+        key = (city_id, name.lower())
+        branch = existing.get(key) or new.get(key)
+        if branch is None:
+            new[key] = Branch(city_id=city_id, name=name, latitude=latitude, longitude=longitude)
+        elif latitude is not None and (branch.latitude, branch.longitude) != (latitude, longitude):
+            branch.latitude, branch.longitude = latitude, longitude
+            if branch.pk is not None:
+                changed[branch.pk] = branch
+        else:
+            report.unchanged += 1
+
+    # Branches have no unique natural key to upsert on, so they are matched above and split here
+    created = Branch.objects.bulk_create(new.values())
+    Branch.objects.bulk_update(changed.values(), ['latitude', 'longitude'])
+    report.created += len(created)
+    report.updated += len(changed)
+    ChangeLog.record(Branch, [branch.pk for branch in created] + list(changed))
+
+
+def import_buses(records, report):
+    def parse(fields):
+        plate_number = required(fields, 'plate_number')
+        if len(plate_number) > 20:
+            raise ValueError("Plate number is longer than 20 characters.")
+        capacity = number(fields, 'capacity', int, required=False)
+        if capacity is not None and capacity < 1:
+            raise ValueError("Capacity must be at least 1.")
+        layout = fields.get('layout')
+        if capacity is None and layout is None:
+            raise ValueError("Give a capacity or a seat layout.")
+        return plate_number, capacity, str(layout) if layout is not None else None, \
+            required(fields, 'city'), required(fields, 'branch')
+
+    parsed = {}
+    for record, row in validated(records, report, parse):
+        # The last record of a plate wins
+        parsed[row[0].upper()] = (record, row)
+    if not parsed:
+        return
+
+    branches = branch_ids({(row[3].lower(), row[4].lower()) for _, row in parsed.values()})
+    layouts = {
+        layout.name.lower(): layout
+        for layout in SeatLayout.objects.annotate(key=Lower('name'))
+        .filter(key__in={row[2].lower() for _, row in parsed.values() if row[2]})
+    }
+    existing = {
+        bus.plate_key: bus
+        for bus in Bus.all_objects.annotate(plate_key=Upper('plate_number')).filter(plate_key__in=parsed)
+    }
+
+    upserts, created = [], 0
+    for plate_key, (record, (plate_number, capacity, layout_name, city, branch_name)) in parsed.items():
+        bus = existing.get(plate_key)
+        if bus is not None and bus.pending_deletion:
+            report.fail(record, f"Bus {bus.plate_number!r} is being deleted.")
+            continue
+        branch_id = branches.get((city.lower(), branch_name.lower()))
+        if branch_id is None:
+            report.fail(record, f"Branch {branch_name!r} in {city!r} not found.")
+            continue
+
+        layout_id = bus.layout_id if bus is not None else None
+        if layout_name is not None:
+            layout = layouts.get(layout_name.lower())
+            if layout is None:
+                report.fail(record, f"Seat layout {layout_name!r} not found.")
+                continue
+            seats = validate_layout(layout.rows, layout.columns, layout.aisle_after, layout.seat_classes)
+            if capacity is not None and capacity != seats:
+                report.fail(record, f"Capacity must match the {seats} seats of the layout.")
+                continue
+            layout_id, capacity = layout.pk, seats
+        elif layout_id is not None and capacity != bus.capacity:
+            report.fail(record, "The capacity of a bus with a seat layout follows the layout.")
+            continue
+
+        if bus is None:
+            created += 1
+        elif (bus.capacity, bus.branch_id, bus.layout_id) == (capacity, branch_id, layout_id):
+            report.unchanged += 1
+            continue
+        upserts.append(Bus(
+            plate_number=bus.plate_number if bus is not None else plate_number,
+            capacity=capacity, branch_id=branch_id, layout_id=layout_id,
+        ))
+
+    Bus.objects.bulk_create(
+        upserts, update_conflicts=True, unique_fields=['plate_number'],
+        update_fields=['capacity', 'branch', 'layout'],
+    )
+    report.created += created
+    report.updated += len(upserts) - created
+    ChangeLog.record(Bus, Bus.objects.filter(
+        plate_number__in=[bus.plate_number for bus in upserts]
+    ).values_list('pk', flat=True))
+
+
+def import_routes(records, report):
+    def parse(fields):
+        distance_km = number(fields, 'distance_km', float)
+        if distance_km <= 0:
+            raise ValueError("Distance must be positive.")
+        return (
+            (required(fields, 'origin_city').lower(), required(fields, 'origin').lower()),
+            (required(fields, 'destination_city').lower(), required(fields, 'destination').lower()),
+            parse_duration(required(fields, 'duration')),
+            distance_km,
+        )
+
+    parsed = list(validated(records, report, parse))
+    branches = branch_ids({key for _, (origin, destination, _, _) in parsed for key in (origin, destination)})
+    coordinates = {
+        pk: (latitude, longitude)
+        for pk, latitude, longitude in Branch.objects.filter(pk__in=branches.values())
+        .values_list('pk', 'latitude', 'longitude')
+    }
+
+    rows = {}
+    for record, (origin, destination, duration, distance_km) in parsed:
+        origin_id, destination_id = branches.get(origin), branches.get(destination)
+        if origin_id is None or destination_id is None:
+            missing = origin if origin_id is None else destination
+            report.fail(record, f"Branch {record.fields.get('origin' if origin_id is None else 'destination')!r} "
+                                f"in {missing[0]!r} not found.")
+            continue
+        if origin_id == destination_id:
+            report.fail(record, "Origin and destination cannot be the same branch.")
+            continue
+        rows[origin_id, destination_id] = (record, duration, distance_km)
+
+    implausible = implausible_distances(
+        (key, distance_km, *coordinates[key[0]], *coordinates[key[1]])
+        for key, (_, _, distance_km) in rows.items()
+    )
+    for key, distance_km, great_circle in implausible:
+        report.fail(rows.pop(key)[0], f"Distance of {distance_km:g} km is implausible "
+                                      f"for branches {great_circle:.0f} km apart.")
+
+    existing = {}
+    for route in Route.objects.filter(
+        origin_id__in={origin for origin, _ in rows}, destination_id__in={destination for _, destination in rows}
+    ).order_by('-pk'):
+        existing[route.origin_id, route.destination_id] = route
+
+    new, changed, retimed = [], [], []
+    for key, (record, duration, distance_km) in rows.items():
+        route = existing.get(key)
+        if route is None:
+            new.append(Route(origin_id=key[0], destination_id=key[1], duration=duration, distance_km=distance_km))
+        elif (route.duration, route.distance_km) == (duration, distance_km):
+            report.unchanged += 1
+        else:
+            if route.duration != duration:
+                retimed.append(route)
+            route.duration, route.distance_km = duration, distance_km
+            changed.append(route)
+
+    # Like branches, routes are matched by (origin, destination) above rather than upserted
+    created = Route.objects.bulk_create(new)
+    Route.objects.bulk_update(changed, ['duration', 'distance_km'])
+    report.created += len(created)
+    report.updated += len(changed)
+    ChangeLog.record(Route, [route.pk for route in created + changed])
+
+    for route in retimed:
+        # Keep the stored arrival times of every trip on a retimed route in step, as UpdateRoute does
+        trips = Trip.all_objects.filter(route=route)
+        trips.update(arrival_time=F('departure_time') + route.duration)
+        ChangeLog.record(Trip, trips.values_list('pk', flat=True))
@@ -0,0 +1,165 @@
+import heapq
+import math
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from typing import NamedTuple
+from .conf import transport_setting
+from .models import Branch, ChangeLog, City
+
+NON_WORD = re.compile(r'[^\w]+')
+# Share of the query's trigrams a name must contain to count as a typo match
+MIN_SIMILARITY = 0.6
+FULL_PREFIX, WORD_PREFIX = 3.0, 2.0
+
+
+class Place(NamedTuple):
+    kind: str  # 'city' or 'branch'
+    id: int
+    name: str
+    city: str
+
+
+def normalize(text):
+    """Lower-case ``text``, strip accents and collapse punctuation into single spaces."""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return NON_WORD.sub(' ', text.casefold()).strip()
+
+
+def trigrams(text, partial=False):
+    """
+    Trigrams of every word of ``text``, padded like PostgreSQL's pg_trgm.
+
+    Each trigram is prefixed with the first letter of its word: typos rarely
+    hit the first letter, and keying on it keeps the posting lists short.
+    With ``partial`` the last word is a prefix still being typed, so it gets
+    no end padding.
+    """
+    grams = set()
+    words = text.split()
+    for position, word in enumerate(words):
+        padded = f'  {word}' if partial and position == len(words) - 1 else f'  {word} '
+        grams.update(word[0] + padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class PlaceIndex:
+    """
+    Prefix and trigram index over place names.
+
+    Names starting with the query rank first, then names with a word starting
+    with it; both are found by bisecting sorted key lists. When those do not
+    fill ``limit`` and the query has at least four characters, names sharing
+    most of its trigrams are added, so "damscus" still finds "Damascus".
+    Ties go to the shorter name.
+    """
+
+    def __init__(self, places):
+        self.places = list(places)
+        self.names = [normalize(place.name) for place in self.places]
+        self.full_keys = sorted((name, i) for i, name in enumerate(self.names))
+        self.word_keys = sorted(
+            (name[match.start():], i)
+            for i, name in enumerate(self.names)
+            for match in re.finditer(r'(?<= )\w', name)
+        )
+        self.grams = [frozenset(trigrams(name)) for name in self.names]
+        postings = defaultdict(list)
+        for i, grams in enumerate(self.grams):
+            for gram in grams:
+                postings[gram].append(i)
+        self.postings = dict(postings)
+
+    def search(self, text, limit=10):
+        query = normalize(text)
+        if not query or limit < 1:
+            return []
+
+        scores = {}
+        for score, keys in ((FULL_PREFIX, self.full_keys), (WORD_PREFIX, self.word_keys)):
+            position = bisect_left(keys, (query,))
+            while position < len(keys) and keys[position][0].startswith(query) and len(scores) < limit:
+                scores.setdefault(keys[position][1], score)
+                position += 1
+
+        if len(scores) < limit and len(query) >= 4:
+            scores.update((i, score) for i, score in self.similar(query) if i not in scores)
+
+        ranked = heapq.nsmallest(limit, scores, key=lambda i: (-scores[i], len(self.names[i]), self.names[i]))
+        return [self.places[i] for i in ranked]
+
+    def similar(self, query):
+        """
+        Yield ``(i, similarity)`` for names containing at least MIN_SIMILARITY of the query's trigrams.
+
+        A name sharing ``needed`` of ``n`` trigrams must contain one of any
+        ``n - needed + 1`` of them, so candidates are only collected from the
+        rarest ones and then checked with a set intersection.
+        """
+        grams = trigrams(query, partial=True)
+        needed = max(2, math.ceil(MIN_SIMILARITY * len(grams)))
+        rarest = sorted(grams, key=lambda gram: len(self.postings.get(gram, ())))[:len(grams) - needed + 1]
+        candidates = set()
+        for gram in rarest:
+            candidates.update(self.postings.get(gram, ()))
+        for i in candidates:
+            shared = len(grams & self.grams[i])
+            if shared >= needed:
+                yield i, shared / len(grams)
+
+
+def load_places():
+    cities = [Place('city', pk, name, name) for pk, name in City.objects.values_list('pk', 'name')]
+    branches = [
+        Place('branch', pk, name, city)
+        for pk, name, city in Branch.objects.filter(city__pending_deletion=False).values_list('pk', 'name', 'city__name')
+    ]
+    return cities + branches
+
+
+def places_version():
+    """Ids of the latest city and branch changes; the index is rebuilt when they move."""
+    # One (kind, id) index probe per kind, however many trip entries the log holds
+    return tuple(
+        ChangeLog.objects.filter(kind=kind).order_by('-pk').values_list('pk', flat=True).first()
+        for kind in ('city', 'branch')
+    )
+
+
+class _IndexHolder:
+    lock = threading.Lock()
+    index = None
+    version = None
+    checked_at = 0.0
+
+
+def get_place_index():
+    """
+    The process-wide ``PlaceIndex``, rebuilt lazily when places changed.
+
+    Changes made through this process are seen immediately (see
+    ``invalidate_places``); those made by other processes are picked up by
+    comparing ``places_version()`` at most every ``PLACES_REFRESH_SECONDS``.
+    """
+    holder = _IndexHolder
+    now = time.monotonic()
+    if holder.index is not None and now - holder.checked_at < transport_setting('PLACES_REFRESH_SECONDS'):
+        return holder.index
+
+    with holder.lock:
+        if holder.index is None or now - holder.checked_at >= transport_setting('PLACES_REFRESH_SECONDS'):
+            version = places_version()
+            if holder.index is None or version != holder.version:
+                holder.index = PlaceIndex(load_places())
+                holder.version = version
+            holder.checked_at = now
+        return holder.index
+
+
+def invalidate_places():
+    """Make the next ``get_place_index()`` call check for changes; call after city or branch writes."""
+    _IndexHolder.checked_at = 0.0
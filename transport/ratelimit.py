@@ -0,0 +1,120 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from .conf import transport_setting
+
+
+def refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + (now - updated) * rate)
+
+
+def take(tokens, cost, rate):
+    """Return ``(tokens_left, retry_after)``; ``retry_after`` is 0 when ``cost`` tokens were taken."""
+    if tokens >= cost:
+        return tokens - cost, 0
+    return tokens, math.ceil((cost - tokens) / rate)
+
+
+class LocalBackend:
+    """
+    Token buckets held in this process.
+
+    Cheap (a dict lookup under a lock) but every worker process counts on its
+    own, so the effective limit is multiplied by the number of processes.
+    Once ``max_keys`` is reached, buckets that have refilled completely are
+    dropped, then the least recently used ones; an evicted client simply
+    starts again from a full bucket.
+    """
+    max_keys = 10000
+
+    def __init__(self):
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def consume(self, key, rate, burst, cost, now):
+        with self.lock:
+            bucket = self.buckets.pop(key, None)
+            tokens = burst if bucket is None else refill(bucket[0], bucket[1], now, rate, burst)
+            tokens, retry_after = take(tokens, cost, rate)
+            if len(self.buckets) >= self.max_keys:
+                self.prune(now)
+            self.buckets[key] = (tokens, now, rate, burst)
+            return retry_after
+
+    def prune(self, now):
+        self.buckets = OrderedDict(
+            (key, bucket) for key, bucket in self.buckets.items()
+            if refill(bucket[0], bucket[1], now, bucket[2], bucket[3]) < bucket[3]
+        )
+        # Oldest first: drop clients that have been quiet longest
+        while len(self.buckets) >= self.max_keys:
+            self.buckets.popitem(last=False)
+
+
+class CacheBackend:
+    """
+    Token buckets stored in the ``RATE_LIMIT_CACHE`` cache, shared by all processes.
+
+    The read-modify-write is not atomic, so concurrent requests of one user
+    may occasionally both take the last token; the limit is approximate by at
+    most the number of processes. Entries expire once the bucket is full again.
+    """
+
+    def __init__(self):
+        self.cache = caches[transport_setting('RATE_LIMIT_CACHE')]
+
+    def consume(self, key, rate, burst, cost, now):
+        cache_key = f'ratelimit:{key}'
+        bucket = self.cache.get(cache_key)
+        tokens = burst if bucket is None else refill(bucket[0], bucket[1], now, rate, burst)
+        tokens, retry_after = take(tokens, cost, rate)
+        self.cache.set(cache_key, (tokens, now), math.ceil((burst - tokens) / rate) + 1)
+        return retry_after
+
+
+@lru_cache(maxsize=None)
+def load_backend(path):
+    return import_string(path)()
+
+
+def get_backend():
+    return load_backend(transport_setting('RATE_LIMIT_BACKEND'))
+
+
+def limit_for(roles, authenticated):
+    """
+    The ``(rate, burst)`` granted to a user with ``roles``, or None for no limit.
+
+    The most generous of the user's roles wins. Authenticated users without a
+    group are limited as customers, like ``check_role_permission`` treats them.
+    """
+    limits = transport_setting('RATE_LIMITS')
+    if not authenticated:
+        return limits.get('anonymous')
+    best = limits.get('default')
+    for role in roles or ('customer',):
+        if role not in limits:
+            continue
+        limit = limits[role]
+        if limit is None:
+            return None
+        if best is None or limit[0] > best[0]:
+            best = limit
+    return best
+
+
+def admit(key, limit, cost):
+    """
+    Take ``cost`` tokens from the bucket of ``key`` and return seconds to wait, 0 if admitted.
+
+    ``limit`` is ``(tokens per second, burst)``. A request never costs more
+    than a full bucket, so a large batch is slowed down but not refused forever.
+    """
+    if limit is None:
+        return 0
+    rate, burst = limit
+    return get_backend().consume(key, rate, burst, min(cost, burst), time.time())
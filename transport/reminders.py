@@ -0,0 +1,203 @@
+"""
+Departure reminders for the customers and crew of a trip, ``REMINDER_LEAD_HOURS`` before it leaves.
+
+``ReminderScheduler`` keeps the reminders due within ``REMINDER_HORIZON_HOURS``
+in an in-process heap instead of polling the trips table. It loads the
+horizon once, then follows the trip entries of the ``ChangeLog`` (written by
+every trip and booking mutation) to reschedule or drop just the trips that
+changed, and reloads when the horizon runs out. A trip is marked with
+``reminder_sent_at`` once its reminder went out, so a restarted scheduler
+rebuilds its heap from the database without reminding anyone twice.
+
+Due reminders are handed in batches to the sender named by ``REMINDER_SENDER``.
+"""
+import heapq
+import json
+import sys
+from datetime import timedelta
+from typing import NamedTuple
+from django.core.mail import send_mass_mail
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .conf import transport_setting
+from .models import Trip, Booking, ChangeLog
+
+TripCrew = Trip.crew.through
+
+
+class Reminder(NamedTuple):
+    trip_id: int
+    departure_time: object
+    route: str
+    customers: tuple  # email addresses
+    crew: tuple  # email addresses of the driver and crew
+
+
+class ConsoleSender:
+    """Writes reminders to stdout; a stand-in for development."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def send(self, reminders):
+        for reminder in reminders:
+            self.stream.write(
+                f"Reminder: {reminder.route} departs at {reminder.departure_time.isoformat()} "
+                f"({len(reminder.customers)} customer(s), {len(reminder.crew)} crew)\n"
+            )
+
+
+class FileSender:
+    """Appends reminders as JSON lines to ``REMINDER_FILE``."""
+
+    def __init__(self, path=None):
+        self.path = path or transport_setting('REMINDER_FILE')
+
+    def send(self, reminders):
+        with open(self.path, 'a') as handle:
+            for reminder in reminders:
+                handle.write(json.dumps({**reminder._asdict(), 'departure_time': reminder.departure_time.isoformat()}))
+                handle.write('\n')
+
+
+class EmailSender:
+    """Emails every customer and crew member, one connection per batch."""
+
+    def send(self, reminders):
+        messages = []
+        for reminder in reminders:
+            subject = f"Your trip {reminder.route} departs soon"
+            body = f"{reminder.route} departs at {timezone.localtime(reminder.departure_time):%Y-%m-%d %H:%M}."
+            messages.extend((subject, body, None, [email]) for email in reminder.customers + reminder.crew)
+        send_mass_mail(messages)
+
+
+def get_sender():
+    return import_string(transport_setting('REMINDER_SENDER'))()
+
+
+class ReminderHeap:
+    """
+    Trips keyed by their reminder time.
+
+    Rescheduling or cancelling a trip leaves its old entry in the heap; such
+    entries are recognised by ``due`` and skipped when they come up.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.due = {}
+
+    def __len__(self):
+        return len(self.due)
+
+    def schedule(self, trip_id, remind_at):
+        if self.due.get(trip_id) != remind_at:
+            self.due[trip_id] = remind_at
+            heapq.heappush(self.heap, (remind_at, trip_id))
+
+    def cancel(self, trip_id):
+        self.due.pop(trip_id, None)
+
+    def pop_due(self, now):
+        trip_ids = []
+        while self.heap and self.heap[0][0] <= now:
+            remind_at, trip_id = heapq.heappop(self.heap)
+            if self.due.get(trip_id) == remind_at:
+                del self.due[trip_id]
+                trip_ids.append(trip_id)
+        return trip_ids
+
+
+class ReminderScheduler:
+
+    def __init__(self, sender=None):
+        self.sender = sender or get_sender()
+        self.lead = timedelta(hours=transport_setting('REMINDER_LEAD_HOURS'))
+        self.horizon = timedelta(hours=transport_setting('REMINDER_HORIZON_HOURS'))
+        self.heap = ReminderHeap()
+        self.version = 0
+        self.horizon_end = self.reload_at = None
+
+    def pending(self, now):
+        """Trips whose reminder is still to be sent and falls before the end of the horizon."""
+        return Trip.objects.filter(
+            reminder_sent_at=None, departure_time__gt=now, departure_time__lte=self.horizon_end + self.lead,
+        )
+
+    def load(self, now):
+        """Rebuild the heap from the database."""
+        # Changes logged from here on are replayed by refresh(), even if the query below already saw them
+        self.version = ChangeLog.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        self.horizon_end = now + self.horizon
+        self.reload_at = now + self.horizon / 2
+        self.heap = ReminderHeap()
+        for trip_id, departure in self.pending(now).values_list('pk', 'departure_time').iterator():
+            self.heap.schedule(trip_id, departure - self.lead)
+
+    def refresh(self, now):
+        """Reschedule the trips changed since the last load or refresh."""
+        changes = list(
+            ChangeLog.objects.filter(pk__gt=self.version, kind='trip').order_by('pk').values_list('pk', 'object_id')
+        )
+        if not changes:
+            return
+        self.version = changes[-1][0]
+        changed = {trip_id for _, trip_id in changes}
+        found = dict(self.pending(now).filter(pk__in=changed).values_list('pk', 'departure_time'))
+        for trip_id in changed:
+            if trip_id in found:
+                self.heap.schedule(trip_id, found[trip_id] - self.lead)
+            else:
+                self.heap.cancel(trip_id)
+
+    def tick(self, now=None):
+        """Bring the heap up to date and send the reminders due at ``now``; returns how many were sent."""
+        now = now or timezone.now()
+        if self.reload_at is None or now >= self.reload_at:
+            self.load(now)
+        else:
+            self.refresh(now)
+
+        due = self.heap.pop_due(now)
+        batch_size = transport_setting('REMINDER_BATCH_SIZE')
+        sent = 0
+        for offset in range(0, len(due), batch_size):
+            sent += self.dispatch(due[offset:offset + batch_size], now)
+        return sent
+
+    def dispatch(self, trip_ids, now):
+        reminders = build_reminders(trip_ids)
+        if reminders:
+            self.sender.send(reminders)
+            # Not a ChangeLog entry: clients never see reminder_sent_at
+            Trip.all_objects.filter(pk__in=[reminder.trip_id for reminder in reminders]).update(reminder_sent_at=now)
+        return len(reminders)
+
+
+def build_reminders(trip_ids):
+    """Reminders for the still scheduled ``trip_ids``, with their recipients fetched in three queries."""
+    trips = Trip.objects.select_related(
+        'route__origin__city', 'route__destination__city', 'driver'
+    ).in_bulk(trip_ids)
+    customers, crew = {}, {}
+    for trip_id, email in Booking.objects.filter(
+        trip_id__in=trips, cancelled_at=None
+    ).values_list('trip_id', 'customer__email').distinct():
+        customers.setdefault(trip_id, []).append(email)
+    for trip_id, email in TripCrew.objects.filter(trip_id__in=trips).values_list('trip_id', 'customuser__email'):
+        crew.setdefault(trip_id, []).append(email)
+
+    reminders = []
+    for trip_id in trip_ids:
+        trip = trips.get(trip_id)
+        if trip is None:
+            continue
+        trip_crew = crew.get(trip_id, [])
+        if trip.driver is not None and trip.driver.email not in trip_crew:
+            trip_crew.append(trip.driver.email)
+        reminders.append(Reminder(
+            trip.pk, trip.departure_time, str(trip.route),
+            tuple(sorted(customers.get(trip_id, ()))), tuple(sorted(trip_crew)),
+        ))
+    return reminders
@@ -0,0 +1,160 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from typing import NamedTuple, Optional
+from django.db.models import DateTimeField, ExpressionWrapper, Q, Subquery, Value
+from .models import Route, Trip
+
+TripCrew = Trip.crew.through
+
+
+class TripSlot(NamedTuple):
+    """The time span a trip occupies its bus, driver and crew."""
+    trip_id: Optional[int]
+    start: object
+    end: object
+    bus_id: Optional[int]
+    driver_id: Optional[int]
+    crew_ids: tuple = ()
+
+    def resources(self):
+        if self.bus_id is not None:
+            yield 'bus', self.bus_id
+        if self.driver_id is not None:
+            yield 'driver', self.driver_id
+        for user_id in self.crew_ids:
+            yield 'crew', user_id
+
+
+class Conflict(NamedTuple):
+    slot: TripSlot
+    resource: str
+    resource_id: int
+    other: TripSlot
+
+    def __str__(self):
+        other = f"trip {self.other.trip_id}" if self.other.trip_id else "another trip in this batch"
+        return (
+            f"{self.resource.capitalize()} {self.resource_id} is already assigned to {other} "
+            f"from {self.other.start:%Y-%m-%d %H:%M} to {self.other.end:%Y-%m-%d %H:%M}."
+        )
+
+
+class ResourceSchedule:
+    """
+    Intervals booked for one bus, driver or crew member, sorted by start.
+
+    Together with the longest interval it lets ``overlapping`` bisect straight
+    to the few entries that can intersect a query span.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.slots = []
+        self.longest = None
+
+    def add(self, slot):
+        index = bisect_right(self.starts, slot.start)
+        self.starts.insert(index, slot.start)
+        self.slots.insert(index, slot)
+        length = slot.end - slot.start
+        if self.longest is None or length > self.longest:
+            self.longest = length
+
+    def overlapping(self, start, end):
+        if not self.slots:
+            return
+        low = bisect_left(self.starts, start - self.longest)
+        high = bisect_left(self.starts, end)
+        for slot in self.slots[low:high]:
+            if slot.end > start:
+                yield slot
+
+
+def find_conflicts(slots):
+    """
+    Check a batch of trip slots against the stored schedule and against each other.
+
+    Existing trips of every bus, driver and crew member involved are loaded in
+    two range queries for the whole batch, so bulk imports cost the same
+    number of queries as a single ``CreateTrip``. A trip overlapping the batch
+    departs at most the longest route duration before it, which bounds the
+    departure time index scan on both sides. Slots carrying a ``trip_id``
+    replace the stored version of that trip. Returns a list of ``Conflict``.
+    """
+    slots = list(slots)
+    if not slots:
+        return []
+
+    buses = {s.bus_id for s in slots if s.bus_id is not None}
+    drivers = {s.driver_id for s in slots if s.driver_id is not None}
+    crew = {user_id for s in slots for user_id in s.crew_ids}
+    replaced = {s.trip_id for s in slots if s.trip_id is not None}
+
+    window_start = min(s.start for s in slots)
+    window_end = max(s.end for s in slots)
+    # Evaluated once by the database, inside the same query
+    earliest_departure = ExpressionWrapper(
+        Value(window_start) - Subquery(Route.all_objects.order_by('-duration').values('duration')[:1]),
+        output_field=DateTimeField(),
+    )
+
+    schedules = defaultdict(ResourceSchedule)
+    existing = {}
+    rows = (
+        Trip.objects.filter(
+            departure_time__gt=earliest_departure, departure_time__lt=window_end, arrival_time__gt=window_start
+        )
+        .filter(Q(bus_id__in=buses) | Q(driver_id__in=drivers))
+        .exclude(pk__in=replaced)
+        .values_list('id', 'departure_time', 'arrival_time', 'bus_id', 'driver_id')
+    )
+    for trip_id, departure, arrival, bus_id, driver_id in rows:
+        existing[trip_id] = TripSlot(trip_id, departure, arrival, bus_id, driver_id)
+        if bus_id in buses:
+            schedules['bus', bus_id].add(existing[trip_id])
+        if driver_id in drivers:
+            schedules['driver', driver_id].add(existing[trip_id])
+
+    if crew:
+        links = (
+            TripCrew.objects.filter(
+                customuser_id__in=crew,
+                trip__departure_time__gt=earliest_departure,
+                trip__departure_time__lt=window_end,
+                trip__arrival_time__gt=window_start,
+                trip__route__pending_deletion=False,
+                trip__cancelled_at=None,
+            )
+            .exclude(trip_id__in=replaced)
+            .values_list('trip_id', 'trip__departure_time', 'trip__arrival_time', 'customuser_id')
+        )
+        for trip_id, departure, arrival, user_id in links:
+            slot = existing.get(trip_id) or TripSlot(trip_id, departure, arrival, None, None)
+            schedules['crew', user_id].add(slot)
+
+    conflicts = []
+    for slot in slots:
+        for resource in slot.resources():
+            for other in schedules[resource].overlapping(slot.start, slot.end):
+                conflicts.append(Conflict(slot, resource[0], resource[1], other))
+        for resource in slot.resources():
+            schedules[resource].add(slot)
+    return conflicts
+
+
+def upcoming_slots(start, end):
+    """Slots of every stored trip departing between ``start`` and ``end``, crew included."""
+    crew = defaultdict(list)
+    links = TripCrew.objects.filter(
+        trip__departure_time__gte=start, trip__departure_time__lt=end
+    ).values_list('trip_id', 'customuser_id')
+    for trip_id, user_id in links:
+        crew[trip_id].append(user_id)
+
+    rows = Trip.objects.filter(
+        departure_time__gte=start, departure_time__lt=end
+    ).values_list('id', 'departure_time', 'arrival_time', 'bus_id', 'driver_id').order_by('departure_time')
+    return [
+        TripSlot(trip_id, departure, arrival, bus_id, driver_id, tuple(crew[trip_id]))
+        for trip_id, departure, arrival, bus_id, driver_id in rows
+    ]
@@ -0,0 +1,112 @@
+from collections import defaultdict
+from graphql import OperationType
+from graphql.execution import ExecutionContext
+from ..models import Booking
+from ..waitlist import waitlist_positions
+
+
+class BatchLoader:
+    """
+    Synchronous DataLoader: collects keys and fetches them in one query.
+
+    List resolvers ``prime()`` the keys of the rows they return; the first
+    ``load()`` then fetches every pending key at once, so a list of N trips
+    costs one query per loader instead of N.
+    """
+    default = None
+
+    def __init__(self):
+        self._cache = {}
+        self._pending = set()
+
+    def batch_load(self, keys):
+        """Return a dict mapping each found key to its value."""
+        raise NotImplementedError
+
+    def prime(self, keys):
+        self._pending.update(key for key in keys if key not in self._cache)
+
+    def seed(self, key, value):
+        """Store a value fetched elsewhere so ``load(key)`` does not query for it."""
+        self._cache[key] = value
+        self._pending.discard(key)
+
+    def load(self, key):
+        if key not in self._cache:
+            self._pending.add(key)
+            keys = list(self._pending)
+            self._pending.clear()
+            found = self.batch_load(keys)
+            for k in keys:
+                self._cache[k] = found.get(k, self.default)
+        return self._cache[key]
+
+    def clear(self):
+        self._cache.clear()
+        self._pending.clear()
+
+
+class TripBookingsLoader(BatchLoader):
+    default = ()
+
+    def batch_load(self, trip_ids):
+        grouped = defaultdict(list)
+        for booking in Booking.objects.filter(trip_id__in=trip_ids).order_by('seat_number'):
+            grouped[booking.trip_id].append(booking)
+        return grouped
+
+
+class TripBookedSeatsLoader(BatchLoader):
+    default = frozenset()
+
+    def batch_load(self, trip_ids):
+        grouped = defaultdict(set)
+        rows = Booking.objects.filter(trip_id__in=trip_ids).values_list('trip_id', 'seat_number')
+        for trip_id, seat_number in rows:
+            grouped[trip_id].add(seat_number)
+        return grouped
+
+
+class WaitlistPositionLoader(BatchLoader):
+
+    def batch_load(self, entry_ids):
+        return waitlist_positions(entry_ids)
+
+
+class Loaders:
+    """The set of loaders shared by every operation of one HTTP request."""
+
+    def __init__(self):
+        self.trip_bookings = TripBookingsLoader()
+        self.trip_booked_seats = TripBookedSeatsLoader()
+        self.waitlist_positions = WaitlistPositionLoader()
+
+    def prime_trips(self, trip_ids):
+        trip_ids = list(trip_ids)
+        self.trip_bookings.prime(trip_ids)
+        self.trip_booked_seats.prime(trip_ids)
+
+    def clear(self):
+        for loader in vars(self).values():
+            loader.clear()
+
+
+def get_loaders(context):
+    """Return the loaders attached to the request, creating them on first use."""
+    loaders = getattr(context, '_loaders', None)
+    if loaders is None:
+        loaders = Loaders()
+        context._loaders = loaders
+    return loaders
+
+
+class LoaderExecutionContext(ExecutionContext):
+    """Drops cached loader results after a mutation so later operations see fresh data."""
+
+    def execute_operation(self, operation, root_value):
+        result = super().execute_operation(operation, root_value)
+        if operation.operation is OperationType.MUTATION:
+            loaders = getattr(self.context_value, '_loaders', None)
+            if loaders is not None:
+                loaders.clear()
+        return result
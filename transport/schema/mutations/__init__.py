@@ -1,10 +1,11 @@
 import graphene
 from .city import CreateCity, UpdateCity, DeleteCity
 from .branch import CreateBranch, UpdateBranch, DeleteBranch
-from .bus import CreateBus, UpdateBus, DeleteBus
+from .bus import CreateBus, UpdateBus, DeleteBus, CreateSeatLayout
 from .route import CreateRoute, UpdateRoute, DeleteRoute
-from .trip import CreateTrip, UpdateTrip, DeleteTrip
-from .booking import CreateBooking, DeleteBooking
+from .trip import CreateTrip, UpdateTrip, DeleteTrip, CancelTrips, AssignBuses
+from .network import ImportNetwork
+from .booking import CreateBooking, DeleteBooking, JoinWaitlist, LeaveWaitlist
 
 
 class Mutation(graphene.ObjectType):
@@ -22,18 +23,28 @@ class Mutation(graphene.ObjectType):
     create_bus = CreateBus.Field()
     update_bus = UpdateBus.Field()
     delete_bus = DeleteBus.Field()
+    create_seat_layout = CreateSeatLayout.Field()
 
     # Route
     create_route = CreateRoute.Field()
     update_route = UpdateRoute.Field()
     delete_route = DeleteRoute.Field()
 
+    # Bulk import of cities, branches, buses and routes
+    import_network = ImportNetwork.Field()
+
     # Trip
     create_trip = CreateTrip.Field()
     update_trip = UpdateTrip.Field()
     delete_trip = DeleteTrip.Field()
+    cancel_trips = CancelTrips.Field()
+    assign_buses = AssignBuses.Field()
 
     # Booking
     create_booking = CreateBooking.Field()
     delete_booking = DeleteBooking.Field()
 
+    # Waitlist
+    join_waitlist = JoinWaitlist.Field()
+    leave_waitlist = LeaveWaitlist.Field()
+
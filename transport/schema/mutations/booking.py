@@ -1,8 +1,11 @@
 import graphene
 from graphql import GraphQLError
+from django.db import transaction
 from django.utils import timezone
-from ...models import Booking, Trip
-from ..types import BookingType
+from ...models import Booking, Trip, WaitlistEntry
+from ...waitlist import join_waitlist, promote_waitlist
+from ...singleflight import invalidate_trip
+from ..types import BookingType, WaitlistEntryType
 from ..permissions import check_role_permission
 
 
@@ -17,35 +20,37 @@ class CreateBooking(graphene.Mutation):
     def mutate(self, info, trip_id, seat_number):
         user = info.context.user
 
-        try:
-            trip = Trip.objects.select_related('bus').get(pk=trip_id)
-        except Trip.DoesNotExist:
-            raise GraphQLError("Trip not found.")
+        with transaction.atomic():
+            try:
+                trip = Trip.objects.select_for_update(of=('self',)).select_related('bus').get(pk=trip_id)
+            except Trip.DoesNotExist:
+                raise GraphQLError("Trip not found.")
 
-        if trip.departure_time < timezone.now():
-            raise GraphQLError("You cannot book a past trip.")
+            if trip.departure_time < timezone.now():
+                raise GraphQLError("You cannot book a past trip.")
 
-        if trip.bus is None:
-            raise GraphQLError("Trip does not have an assigned bus yet.")
+            if trip.bus is None:
+                raise GraphQLError("Trip does not have an assigned bus yet.")
 
-        if seat_number < 1 or seat_number > trip.bus.capacity:
-            raise GraphQLError("Invalid seat number.")
+            if seat_number < 1 or seat_number > trip.bus.capacity:
+                raise GraphQLError("Invalid seat number.")
 
-        if Booking.objects.filter(trip=trip, seat_number=seat_number).exists():
-            raise GraphQLError("Seat already booked.")
+            if Booking.objects.filter(trip=trip, seat_number=seat_number).exists():
+                raise GraphQLError("Seat already booked.")
 
-        if trip.available_seats <= 0:
-            raise GraphQLError("No available seats on this trip.")
+            if trip.available_seats <= 0:
+                raise GraphQLError("No available seats on this trip. Use joinWaitlist to be booked when a seat frees up.")
 
-        booking = Booking.objects.create(
-            customer=user,
-            trip=trip,
-            seat_number=seat_number,
-            booked_at=timezone.now()
-        )
+            booking = Booking.objects.create(
+                customer=user,
+                trip=trip,
+                seat_number=seat_number,
+                booked_at=timezone.now()
+            )
 
-        trip.available_seats -= 1
-        trip.save()
+            trip.available_seats -= 1
+            trip.save(update_fields=['available_seats'])
+            invalidate_trip(trip.pk)
 
         return CreateBooking(booking=booking)
 
@@ -60,18 +65,74 @@ class DeleteBooking(graphene.Mutation):
     def mutate(self, info, id):
         user = info.context.user
 
-        try:
-            booking = Booking.objects.select_related('trip').get(pk=id)
-        except Booking.DoesNotExist:
-            raise GraphQLError("Booking not found.")
+        with transaction.atomic():
+            try:
+                booking = Booking.objects.get(pk=id)
+            except Booking.DoesNotExist:
+                raise GraphQLError("Booking not found.")
 
-        if booking.customer != user:
-            raise GraphQLError("You can only delete your own bookings.")
+            if booking.customer != user:
+                raise GraphQLError("You can only delete your own bookings.")
 
-        # Restore seat
-        if booking.trip:
-            booking.trip.available_seats += 1
-            booking.trip.save()
+            if booking.cancelled_at is not None:
+                raise GraphQLError("This booking was cancelled with its trip.")
+
+            trip = Trip.objects.select_for_update(of=('self',)).select_related('bus').get(pk=booking.trip_id)
+            booking.delete()
+
+            # Restore seat and hand it to the head of the waitlist
+            trip.available_seats += 1
+            promote_waitlist(trip)
+            trip.save(update_fields=['available_seats'])
+            invalidate_trip(trip.pk)
 
-        booking.delete()
         return DeleteBooking(ok=True)
+
+
+class JoinWaitlist(graphene.Mutation):
+    entry = graphene.Field(WaitlistEntryType)
+    created = graphene.Boolean()
+
+    class Arguments:
+        trip_id = graphene.ID(required=True)
+        seats = graphene.Int(default_value=1)
+
+    @check_role_permission(['customer'])
+    def mutate(self, info, trip_id, seats=1):
+        user = info.context.user
+
+        with transaction.atomic():
+            try:
+                trip = Trip.objects.select_for_update(of=('self',)).select_related('bus').get(pk=trip_id)
+            except Trip.DoesNotExist:
+                raise GraphQLError("Trip not found.")
+
+            if trip.departure_time < timezone.now():
+                raise GraphQLError("You cannot wait for a past trip.")
+
+            if trip.bus is None:
+                raise GraphQLError("Trip does not have an assigned bus yet.")
+
+            if seats < 1 or seats > trip.bus.capacity:
+                raise GraphQLError("Seats must be between 1 and bus capacity.")
+
+            if trip.available_seats >= seats and not trip.waitlist.exists():
+                raise GraphQLError("Seats are available on this trip; book them directly.")
+
+            entry, created = join_waitlist(trip, user, seats)
+
+        return JoinWaitlist(entry=entry, created=created)
+
+
+class LeaveWaitlist(graphene.Mutation):
+    ok = graphene.Boolean()
+
+    class Arguments:
+        trip_id = graphene.ID(required=True)
+
+    @check_role_permission(['customer'])
+    def mutate(self, info, trip_id):
+        deleted, _ = WaitlistEntry.objects.filter(trip_id=trip_id, customer=info.context.user).delete()
+        if deleted == 0:
+            raise GraphQLError("You are not on the waitlist for this trip.")
+        return LeaveWaitlist(ok=True)
@@ -3,6 +3,16 @@ from graphql import GraphQLError
 from ...models import Branch, City
 from ..types import BranchType
 from ..permissions import check_role_permission
+from ...deletion import schedule_deletion
+from ...places import invalidate_places
+from ...geo import invalidate_branch_grid
+
+
+def check_coordinates(latitude, longitude):
+    if (latitude is None) != (longitude is None):
+        raise GraphQLError("Latitude and longitude must be given together.")
+    if latitude is not None and not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise GraphQLError("Coordinates out of range.")
 
 
 class CreateBranch(graphene.Mutation):
@@ -11,15 +21,20 @@ class CreateBranch(graphene.Mutation):
     class Arguments:
         name = graphene.String(required=True)
         city_id = graphene.ID(required=True)
+        latitude = graphene.Float()
+        longitude = graphene.Float()
 
     @check_role_permission(['manager'])
-    def mutate(self, info, name, city_id):
+    def mutate(self, info, name, city_id, latitude=None, longitude=None):
         try:
             city = City.objects.get(pk=city_id)
         except City.DoesNotExist:
             raise GraphQLError("City not found.")
 
-        branch = Branch.objects.create(name=name, city=city)
+        check_coordinates(latitude, longitude)
+        branch = Branch.objects.create(name=name, city=city, latitude=latitude, longitude=longitude)
+        invalidate_places()
+        invalidate_branch_grid()
         return CreateBranch(branch=branch)
 
 
@@ -30,9 +45,11 @@ class UpdateBranch(graphene.Mutation):
         id = graphene.ID(required=True)
         name = graphene.String()
         city_id = graphene.ID()
+        latitude = graphene.Float()
+        longitude = graphene.Float()
 
     @check_role_permission(['manager'])
-    def mutate(self, info, id, name=None, city_id=None):
+    def mutate(self, info, id, name=None, city_id=None, latitude=None, longitude=None):
         try:
             branch = Branch.objects.get(pk=id)
         except Branch.DoesNotExist:
@@ -46,13 +63,19 @@ class UpdateBranch(graphene.Mutation):
                 branch.city = city
             except City.DoesNotExist:
                 raise GraphQLError("City not found.")
+        if latitude is not None or longitude is not None:
+            check_coordinates(latitude, longitude)
+            branch.latitude, branch.longitude = latitude, longitude
 
         branch.save()
+        invalidate_places()
+        invalidate_branch_grid()
         return UpdateBranch(branch=branch)
 
 
 class DeleteBranch(graphene.Mutation):
     ok = graphene.Boolean()
+    job_id = graphene.ID()
 
     class Arguments:
         id = graphene.ID(required=True)
@@ -61,7 +84,10 @@ class DeleteBranch(graphene.Mutation):
     def mutate(self, info, id):
         try:
             branch = Branch.objects.get(pk=id)
-            branch.delete()
-            return DeleteBranch(ok=True)
         except Branch.DoesNotExist:
             raise GraphQLError("Branch not found.")
+
+        job = schedule_deletion(branch)
+        invalidate_places()
+        invalidate_branch_grid()
+        return DeleteBranch(ok=True, job_id=job.pk)
@@ -1,8 +1,48 @@
 import graphene
 from graphql import GraphQLError
-from ...models import Bus, Branch
-from ..types import BusType
+from ...models import Bus, Branch, SeatLayout
+from ...seating import validate_layout
+from ..types import BusType, SeatLayoutType
 from ..permissions import check_role_permission
+from ...deletion import schedule_deletion
+
+
+def layout_capacity(layout_id, capacity):
+    """Return the layout and the bus capacity it implies; ``capacity``, if given, must agree."""
+    try:
+        layout = SeatLayout.objects.get(pk=layout_id)
+    except SeatLayout.DoesNotExist:
+        raise GraphQLError("Seat layout not found.")
+    seats = validate_layout(layout.rows, layout.columns, layout.aisle_after, layout.seat_classes)
+    if capacity is not None and capacity != seats:
+        raise GraphQLError(f"Capacity must match the {seats} seats of the layout.")
+    return layout, seats
+
+
+class CreateSeatLayout(graphene.Mutation):
+    layout = graphene.Field(SeatLayoutType)
+
+    class Arguments:
+        name = graphene.String(required=True)
+        rows = graphene.Int(required=True)
+        columns = graphene.Int(required=True)
+        aisle_after = graphene.Int(default_value=0)
+        seat_classes = graphene.List(graphene.List(graphene.String), required=True)
+
+    @check_role_permission(['manager'])
+    def mutate(self, info, name, rows, columns, seat_classes, aisle_after=0):
+        if SeatLayout.objects.filter(name__iexact=name).exists():
+            raise GraphQLError("A seat layout with this name already exists.")
+        seat_classes = [[seat_class or '' for seat_class in row] for row in seat_classes]
+        try:
+            validate_layout(rows, columns, aisle_after, seat_classes)
+        except ValueError as e:
+            raise GraphQLError(str(e))
+
+        layout = SeatLayout.objects.create(
+            name=name, rows=rows, columns=columns, aisle_after=aisle_after, seat_classes=seat_classes
+        )
+        return CreateSeatLayout(layout=layout)
 
 
 class CreateBus(graphene.Mutation):
@@ -10,12 +50,13 @@ class CreateBus(graphene.Mutation):
 
     class Arguments:
         plate_number = graphene.String(required=True)
-        capacity = graphene.Int(required=True)
+        capacity = graphene.Int()
         branch_id = graphene.ID(required=True)
+        layout_id = graphene.ID()
 
     @check_role_permission(['manager'])
-    def mutate(self, info, plate_number, capacity, branch_id):
-        if Bus.objects.filter(plate_number__iexact=plate_number).exists():
+    def mutate(self, info, plate_number, branch_id, capacity=None, layout_id=None):
+        if Bus.all_objects.filter(plate_number__iexact=plate_number).exists():
             raise GraphQLError("A bus with this plate number already exists.")
 
         try:
@@ -23,10 +64,17 @@ class CreateBus(graphene.Mutation):
         except Branch.DoesNotExist:
             raise GraphQLError("Branch not found.")
 
+        layout = None
+        if layout_id is not None:
+            layout, capacity = layout_capacity(layout_id, capacity)
+        elif capacity is None:
+            raise GraphQLError("Give a capacity or a seat layout.")
+
         bus = Bus.objects.create(
             plate_number=plate_number,
             capacity=capacity,
-            branch=branch
+            branch=branch,
+            layout=layout
         )
         return CreateBus(bus=bus)
 
@@ -39,20 +87,25 @@ class UpdateBus(graphene.Mutation):
         plate_number = graphene.String()
         capacity = graphene.Int()
         branch_id = graphene.ID()
+        layout_id = graphene.ID()
 
     @check_role_permission(['manager'])
-    def mutate(self, info, id, plate_number=None, capacity=None, branch_id=None):
+    def mutate(self, info, id, plate_number=None, capacity=None, branch_id=None, layout_id=None):
         try:
             bus = Bus.objects.get(pk=id)
         except Bus.DoesNotExist:
             raise GraphQLError("Bus not found.")
 
         if plate_number:
-            if Bus.objects.exclude(pk=id).filter(plate_number__iexact=plate_number).exists():
+            if Bus.all_objects.exclude(pk=id).filter(plate_number__iexact=plate_number).exists():
                 raise GraphQLError("Another bus with this plate number already exists.")
             bus.plate_number = plate_number
 
-        if capacity is not None:
+        if layout_id is not None:
+            bus.layout, bus.capacity = layout_capacity(layout_id, capacity)
+        elif capacity is not None:
+            if bus.layout_id is not None:
+                raise GraphQLError("The capacity of a bus with a seat layout follows the layout.")
             bus.capacity = capacity
 
         if branch_id:
@@ -67,6 +120,7 @@ class UpdateBus(graphene.Mutation):
 
 class DeleteBus(graphene.Mutation):
     ok = graphene.Boolean()
+    job_id = graphene.ID()
 
     class Arguments:
         id = graphene.ID(required=True)
@@ -77,5 +131,6 @@ class DeleteBus(graphene.Mutation):
             bus = Bus.objects.get(pk=id)
         except Bus.DoesNotExist:
             raise GraphQLError("Bus not found.")
-        bus.delete()
-        return DeleteBus(ok=True)
+
+        job = schedule_deletion(bus)
+        return DeleteBus(ok=True, job_id=job.pk)
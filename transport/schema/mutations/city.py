@@ -3,6 +3,9 @@ from graphql import GraphQLError
 from ...models import City
 from ..types import CityType
 from ..permissions import check_role_permission
+from ...deletion import schedule_deletion
+from ...places import invalidate_places
+from ...geo import invalidate_branch_grid
 
 
 class CreateCity(graphene.Mutation):
@@ -13,10 +16,11 @@ class CreateCity(graphene.Mutation):
 
     @check_role_permission(['manager'])
     def mutate(self, info, name):
-        if City.objects.filter(name__iexact=name).exists():
+        if City.all_objects.filter(name__iexact=name).exists():
             raise GraphQLError("City with this name already exists.")
         city = City.objects.create(name=name)
         city.save()
+        invalidate_places()
         return CreateCity(city=city)
 
 
@@ -35,23 +39,30 @@ class UpdateCity(graphene.Mutation):
             raise GraphQLError("City not found.")
 
         if name:
-            if City.objects.exclude(pk=id).filter(name__iexact=name).exists():
+            if City.all_objects.exclude(pk=id).filter(name__iexact=name).exists():
                 raise GraphQLError("Another city with this name already exists.")
             city.name = name
             city.save()
 
+        invalidate_places()
         return UpdateCity(city=city)
 
 
 class DeleteCity(graphene.Mutation):
     ok = graphene.Boolean()
+    job_id = graphene.ID()
 
     class Arguments:
         id = graphene.ID(required=True)
 
     @check_role_permission(['manager'])
     def mutate(self, info, id):
-        deleted_count, _ = City.objects.filter(pk=id).delete()
-        if deleted_count == 0:
+        try:
+            city = City.objects.get(pk=id)
+        except City.DoesNotExist:
             raise GraphQLError("City not found.")
-        return DeleteCity(ok=True)
+
+        job = schedule_deletion(city)
+        invalidate_places()
+        invalidate_branch_grid()
+        return DeleteCity(ok=True, job_id=job.pk)
@@ -0,0 +1,25 @@
+import io
+import graphene
+from ...network import import_network, read_records
+from ..types import ImportFormat, ImportErrorType, ImportReportType
+from ..permissions import check_role_permission
+
+
+class ImportNetwork(graphene.Mutation):
+    report = graphene.Field(ImportReportType)
+
+    class Arguments:
+        data = graphene.String(required=True)
+        format = ImportFormat(default_value=ImportFormat.CSV)
+        dry_run = graphene.Boolean(default_value=False)
+
+    @check_role_permission(['manager'])
+    def mutate(self, info, data, format=ImportFormat.CSV, dry_run=False):
+        report = import_network(read_records(io.StringIO(data), format.value), dry_run=dry_run)
+        return ImportNetwork(report=ImportReportType(
+            created=report.created,
+            updated=report.updated,
+            unchanged=report.unchanged,
+            errors=[ImportErrorType(line=error.line, message=error.message) for error in report.errors],
+            committed=not dry_run,
+        ))
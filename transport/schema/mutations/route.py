@@ -1,16 +1,29 @@
 import graphene
 from graphql import GraphQLError
-from ...models import Route, Branch
+from django.db import transaction
+from django.db.models import F
+from ...models import Route, Branch, Trip, ChangeLog
 from ..types import RouteType
 from ..permissions import check_role_permission
-from datetime import timedelta
+from ...deletion import schedule_deletion
+from ...geo import implausible_distances
+from ...network import parse_duration
 
 def parse_duration_string(duration_str):
     try:
-        hours, minutes, seconds = map(int, duration_str.split(":"))
-        return timedelta(hours=hours, minutes=minutes, seconds=seconds)
-    except ValueError:
-        raise GraphQLError("Invalid duration format. Use HH:MM:SS.")
+        return parse_duration(duration_str)
+    except ValueError as e:
+        raise GraphQLError(str(e))
+
+
+def check_distance(origin, destination, distance_km):
+    """Reject a road distance that cannot match the branch coordinates, when both have them."""
+    for _, _, great_circle in implausible_distances([
+        (None, distance_km, origin.latitude, origin.longitude, destination.latitude, destination.longitude)
+    ]):
+        raise GraphQLError(
+            f"Distance of {distance_km:g} km is implausible for branches {great_circle:.0f} km apart."
+        )
 
 
 class CreateRoute(graphene.Mutation):
@@ -33,6 +46,7 @@ class CreateRoute(graphene.Mutation):
         if origin.id == destination.id:
             raise GraphQLError("Origin and destination cannot be the same branch.")
         
+        check_distance(origin, destination, distance_km)
         duration = parse_duration_string(duration)
         route = Route.objects.create(
             origin=origin,
@@ -72,6 +86,7 @@ class UpdateRoute(graphene.Mutation):
             except Branch.DoesNotExist:
                 raise GraphQLError("Destination branch not found.")
 
+        previous_duration = route.duration
         if 'duration' in kwargs:
             duration_str = kwargs.pop('duration')
             route.duration = parse_duration_string(duration_str)
@@ -81,21 +96,31 @@ class UpdateRoute(graphene.Mutation):
 
         if route.origin_id == route.destination_id:
             raise GraphQLError("Origin and destination cannot be the same.")
-
-        
-        route.save()
+        check_distance(route.origin, route.destination, route.distance_km)
+
+        with transaction.atomic():
+            route.save()
+            if route.duration != previous_duration:
+                # Keep the stored arrival times of every trip on this route in step
+                trips = Trip.all_objects.filter(route=route)
+                trips.update(arrival_time=F('departure_time') + route.duration)
+                ChangeLog.record(Trip, trips.values_list('pk', flat=True))
         return UpdateRoute(route=route)
 
 
 class DeleteRoute(graphene.Mutation):
     ok = graphene.Boolean()
+    job_id = graphene.ID()
 
     class Arguments:
         id = graphene.ID(required=True)
 
     @check_role_permission(['manager'])
     def mutate(self, info, id):
-        deleted, _ = Route.objects.filter(pk=id).delete()
-        if deleted == 0:
+        try:
+            route = Route.objects.get(pk=id)
+        except Route.DoesNotExist:
             raise GraphQLError("Route not found or already deleted.")
-        return DeleteRoute(ok=True)
+
+        job = schedule_deletion(route)
+        return DeleteRoute(ok=True, job_id=job.pk)
@@ -1,14 +1,38 @@
 import graphene
+from datetime import timedelta
+from django.db import transaction
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 from graphql import GraphQLError
-from ...models import Trip, Bus, Route
-from ..types import TripType
+from ...models import Trip, Bus, Route, Branch, ChangeLog
+from ...conf import transport_setting
+from ...fleet import plan_branch, apply_plan
+from ...cancellation import cancel_trips
+from ..types import (
+    TripType, BusAssignmentType, UnassignedTripType, BusAssignmentPlanType, TripFilterInput, CancelTripsResultType
+)
 from ..permissions import check_role_permission
+from ...scheduling import TripSlot, find_conflicts
+from ...waitlist import promote_waitlist
+from ...singleflight import invalidate_trip
 
 User = get_user_model()
 
 
+def check_assignments(slot):
+    """Reject the trip if its bus, driver or crew is already committed to an overlapping trip."""
+    conflicts = find_conflicts([slot])
+    if conflicts:
+        raise GraphQLError(str(conflicts[0]))
+
+
+def get_crew_members(crew_ids):
+    crew_members = list(User.objects.filter(pk__in=crew_ids))
+    if len(crew_members) != len(set(crew_ids)):
+        raise GraphQLError("One or more crew members not found.")
+    return crew_members
+
+
 class CreateTrip(graphene.Mutation):
     trip = graphene.Field(TripType)
 
@@ -51,6 +75,13 @@ class CreateTrip(graphene.Mutation):
         except User.DoesNotExist:
             raise GraphQLError("Driver not found.")
 
+        crew_members = get_crew_members(crew_ids) if crew_ids else []
+
+        check_assignments(TripSlot(
+            None, departure_time, departure_time + route.duration,
+            bus.pk, driver.pk, tuple(member.pk for member in crew_members)
+        ))
+
         trip = Trip.objects.create(
             route=route,
             bus=bus,
@@ -60,10 +91,7 @@ class CreateTrip(graphene.Mutation):
             available_seats=available_seats
         )
 
-        if crew_ids:
-            crew_members = User.objects.filter(pk__in=crew_ids)
-            if crew_members.count() != len(crew_ids):
-                raise GraphQLError("One or more crew members not found.")
+        if crew_members:
             trip.crew.set(crew_members)
 
         return CreateTrip(trip=trip)
@@ -82,43 +110,57 @@ class UpdateTrip(graphene.Mutation):
 
     @check_role_permission(['organizer', 'manager'])
     def mutate(self, info, id, bus_id=None, driver_id=None, crew_ids=None, departure_time=None, available_seats=None):
+        # Locked like CreateBooking/DeleteBooking do, so seat changes and waitlist promotion cannot race them
+        with transaction.atomic():
+            try:
+                trip = Trip.objects.select_for_update(of=('self',)).select_related('route').get(pk=id)
+            except Trip.DoesNotExist:
+                raise GraphQLError("Trip not found.")
 
-        try:
-            trip = Trip.objects.get(pk=id)
-        except Trip.DoesNotExist:
-            raise GraphQLError("Trip not found.")
+            if bus_id is not None:
+                try:
+                    bus = Bus.objects.get(pk=bus_id)
+                    trip.bus = bus
+                except Bus.DoesNotExist:
+                    raise GraphQLError("Bus not found.")
 
-        if bus_id is not None:
-            try:
-                bus = Bus.objects.get(pk=bus_id)
-                trip.bus = bus
-            except Bus.DoesNotExist:
-                raise GraphQLError("Bus not found.")
+            if driver_id is not None:
+                try:
+                    driver = User.objects.get(pk=driver_id)
+                    trip.driver = driver
+                except User.DoesNotExist:
+                    raise GraphQLError("Driver not found.")
 
-        if driver_id is not None:
-            try:
-                driver = User.objects.get(pk=driver_id)
-                trip.driver = driver
-            except User.DoesNotExist:
-                raise GraphQLError("Driver not found.")
-
-        if crew_ids is not None:
-            crew_members = User.objects.filter(pk__in=crew_ids)
-            if crew_members.count() != len(crew_ids):
-                raise GraphQLError("One or more crew members not found.")
-            trip.crew.set(crew_members)
+            if crew_ids is not None:
+                crew_members = get_crew_members(crew_ids)
+                crew_member_ids = tuple(member.pk for member in crew_members)
+            else:
+                crew_member_ids = tuple(trip.crew.values_list('pk', flat=True))
 
-        if departure_time is not None:
-            if departure_time < timezone.now():
-                raise GraphQLError("Departure time cannot be in the past.")
-            trip.departure_time = departure_time
+            if departure_time is not None:
+                if departure_time < timezone.now():
+                    raise GraphQLError("Departure time cannot be in the past.")
+                if departure_time != trip.departure_time:
+                    trip.reminder_sent_at = None
+                trip.departure_time = departure_time
 
-        if available_seats is not None:
-            if trip.bus and (available_seats > trip.bus.capacity or available_seats < 1):
-                raise GraphQLError("Available seats must be between 1 and bus capacity.")
-            trip.available_seats = available_seats
+            if available_seats is not None:
+                if trip.bus and (available_seats > trip.bus.capacity or available_seats < 1):
+                    raise GraphQLError("Available seats must be between 1 and bus capacity.")
+                trip.available_seats = available_seats
 
-        trip.save()
+            check_assignments(TripSlot(
+                trip.pk, trip.departure_time, trip.departure_time + trip.route.duration,
+                trip.bus_id, trip.driver_id, crew_member_ids
+            ))
+
+            if crew_ids is not None:
+                trip.crew.set(crew_members)
+            if available_seats is not None:
+                # Seats added by the organizer go to the waitlist first
+                promote_waitlist(trip)
+            trip.save()
+            invalidate_trip(trip.pk)
         return UpdateTrip(trip=trip)
 
 
@@ -131,9 +173,94 @@ class DeleteTrip(graphene.Mutation):
     @check_role_permission(['organizer', 'manager'])
     def mutate(self, info, id):
         try:
-            trip = Trip.objects.get(pk=id)
+            trip = Trip.objects.select_related('route').get(pk=id)
         except Trip.DoesNotExist:
             raise GraphQLError("Trip not found.")
 
-        trip.delete()
+        with transaction.atomic():
+            trip_id = trip.pk
+            trip.delete()
+            ChangeLog.record(Trip, [trip_id], deleted=True)
+            invalidate_trip(trip_id)
         return DeleteTrip(ok=True)
+
+
+class CancelTrips(graphene.Mutation):
+    result = graphene.Field(CancelTripsResultType)
+
+    class Arguments:
+        filter = TripFilterInput(required=True)
+        reason = graphene.String(default_value='')
+
+    @check_role_permission(['organizer', 'manager'])
+    def mutate(self, info, filter, reason=''):
+        trips = Trip.objects.all()
+        if filter.ids:
+            trips = trips.filter(pk__in=filter.ids)
+        elif filter.route_id is None or filter.departs_after is None or filter.departs_before is None:
+            raise GraphQLError("Give trip ids, or a route with departsAfter and departsBefore.")
+        if filter.route_id is not None:
+            trips = trips.filter(route_id=filter.route_id)
+        if filter.departs_after is not None:
+            trips = trips.filter(departure_time__gte=filter.departs_after)
+        if filter.departs_before is not None:
+            trips = trips.filter(departure_time__lt=filter.departs_before)
+
+        limit = transport_setting('CANCEL_TRIPS_LIMIT')
+        if trips.count() > limit:
+            raise GraphQLError(f"The filter matches more than {limit} trips; narrow it down.")
+
+        result = cancel_trips(trips.filter(departure_time__gte=timezone.now()), reason)
+        return CancelTrips(result=CancelTripsResultType(
+            cancelled_trips=result.trips,
+            cancelled_bookings=result.bookings,
+            notified_customers=result.customers,
+        ))
+
+
+class AssignBuses(graphene.Mutation):
+    plan = graphene.Field(BusAssignmentPlanType)
+
+    class Arguments:
+        branch_id = graphene.ID(required=True)
+        start = graphene.DateTime(required=True, name='from')
+        end = graphene.DateTime(required=True, name='to')
+        turnaround_minutes = graphene.Int()
+        dry_run = graphene.Boolean(default_value=True)
+
+    @check_role_permission(['organizer', 'manager'])
+    def mutate(self, info, branch_id, start, end, turnaround_minutes=None, dry_run=True):
+        if end <= start:
+            raise GraphQLError("'to' must be after 'from'.")
+        if end - start > timedelta(days=62):
+            raise GraphQLError("Plan at most 62 days at a time.")
+
+        try:
+            branch = Branch.objects.get(pk=branch_id)
+        except Branch.DoesNotExist:
+            raise GraphQLError("Branch not found.")
+
+        if turnaround_minutes is None:
+            turnaround_minutes = transport_setting('BUS_TURNAROUND_MINUTES')
+        if turnaround_minutes < 0:
+            raise GraphQLError("Turnaround cannot be negative.")
+
+        plan, trips, buses = plan_branch(branch, start, end, timedelta(minutes=turnaround_minutes))
+
+        assigned = plan.assignments
+        if not dry_run:
+            applied = set(apply_plan(plan))
+            assigned = {trip_id: bus_id for trip_id, bus_id in assigned.items() if trip_id in applied}
+
+        return AssignBuses(plan=BusAssignmentPlanType(
+            assignments=[
+                BusAssignmentType(trip=trips[trip_id], bus=buses[bus_id])
+                for trip_id, bus_id in sorted(assigned.items(), key=lambda item: trips[item[0]].departure_time)
+            ],
+            unassigned=[
+                UnassignedTripType(trip=trips[trip_id], reason=reason)
+                for trip_id, reason in plan.unassigned.items()
+            ],
+            buses_used=plan.buses_used,
+            committed=not dry_run,
+        ))
@@ -0,0 +1,19 @@
+import base64
+from graphql import GraphQLError
+
+
+def encode_cursor(*parts):
+    """Opaque cursor holding the keyset values of the last row of a page."""
+    raw = '|'.join(str(part) for part in parts)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor, size):
+    """Split a cursor made by ``encode_cursor`` back into its ``size`` string parts."""
+    try:
+        parts = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    except (ValueError, UnicodeDecodeError):
+        raise GraphQLError("Invalid cursor.")
+    if len(parts) != size:
+        raise GraphQLError("Invalid cursor.")
+    return parts
@@ -1,6 +1,25 @@
 from functools import wraps
 from graphql import GraphQLError
 
+
+def get_user_roles(request):
+    """
+    Return the lower-cased group names of the request user.
+
+    The groups are loaded once and cached on the request, so every resolver
+    (and every operation of a batched request) shares a single lookup.
+    """
+    roles = getattr(request, '_user_roles', None)
+    if roles is None:
+        user = request.user
+        if user.is_authenticated:
+            roles = frozenset(name.lower() for name in user.groups.values_list('name', flat=True))
+        else:
+            roles = frozenset()
+        request._user_roles = roles
+    return roles
+
+
 def check_role_permission(allowed_roles):
     """
     Decorator to restrict access based on user group roles.
@@ -8,6 +27,8 @@ def check_role_permission(allowed_roles):
     Args:
         allowed_roles (list[str]): List of role names allowed to perform the action.
     """
+    allowed_roles_lower = {role.lower() for role in allowed_roles}
+
     def decorator(resolver_func):
         @wraps(resolver_func)
         def wrapper(self, info, *args, **kwargs):
@@ -16,17 +37,16 @@ def check_role_permission(allowed_roles):
             if not user.is_authenticated:
                 raise GraphQLError("Authentication required.")
 
+            user_groups = get_user_roles(info.context)
+
             # Manager is always allowed
-            if user.groups.filter(name__iexact="manager").exists():
+            if "manager" in user_groups:
                 return resolver_func(self, info, *args, **kwargs)
 
-            user_groups = [group.name.lower() for group in user.groups.all()]
-            allowed_roles_lower = [role.lower() for role in allowed_roles]
-
             if not user_groups and "customer" in allowed_roles_lower:
                 return resolver_func(self, info, *args, **kwargs)
 
-            if any(role in allowed_roles_lower for role in user_groups):
+            if not user_groups.isdisjoint(allowed_roles_lower):
                 return resolver_func(self, info, *args, **kwargs)
 
             raise GraphQLError("You do not have permission to perform this action.")
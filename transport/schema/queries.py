@@ -1,10 +1,47 @@
 import graphene
 from graphql import GraphQLError
 from django.utils import timezone
-from ..models import City, Branch, Bus, Route, Trip, Booking
-from .types import CityType, BranchType, BusType, RouteType, TripType, BookingType
-from .permissions import check_role_permission
-from django.db.models import Q
+from ..sync import changes_since
+from ..places import get_place_index
+from ..geo import get_branch_grid
+from ..seating import seat_plan
+from ..singleflight import hot_reads
+from ..models import (
+    City, Branch, Bus, Route, Trip, Booking, ArchivedTrip, ArchivedBooking, Job, WaitlistEntry, DemandForecast
+)
+from .types import (
+    CityType, BranchType, BusType, RouteType, TripType, BookingType,
+    ArchivedTripType, JobType, WaitlistEntryType, TripOrder, TripPageType,
+    ChangeSetType, TombstoneType, PlaceType, NearestBranchType, SeatMapType,
+    TRIP_ROWS, BOOKING_ROWS, DemandForecastType
+)
+from .permissions import check_role_permission, get_user_roles
+from .loaders import get_loaders
+from .pagination import encode_cursor, decode_cursor
+from django.db.models import Prefetch, Q
+from django.utils.dateparse import parse_datetime
+
+TripCrew = Trip.crew.through
+
+
+def assigned_trips(user):
+    """
+    Trips ``user`` drives or crews, as a UNION of two indexed lookups.
+
+    Each side of the UNION returns ``(departure_time, id)`` so callers can
+    bound, order and page it; UNION drops the duplicate when the user is both
+    driver and crew of a trip.
+    """
+    driven = Trip.all_objects.filter(driver=user).values_list('departure_time', 'id')
+    crewed = TripCrew.objects.filter(customuser=user).values_list('trip__departure_time', 'trip_id')
+    return driven, crewed
+
+
+def fetch_hot_trip(trip_id):
+    """A trip with its joined relations and the set of its booked seats, the shared part of a trip read."""
+    trip = Trip.objects.select_related('route', 'bus', 'organizer', 'driver').get(pk=trip_id)
+    booked = frozenset(Booking.objects.filter(trip_id=trip_id).values_list('seat_number', flat=True))
+    return trip, booked
 
 
 class Query(graphene.ObjectType):
@@ -20,6 +57,19 @@ class Query(graphene.ObjectType):
     def resolve_city(self, info, id):
         return City.objects.get(pk=id)
 
+    # === PLACE AUTOCOMPLETE ===
+    suggest_places = graphene.List(
+        PlaceType,
+        prefix=graphene.String(required=True),
+        limit=graphene.Int(default_value=10)
+    )
+
+    @check_role_permission(['manager', 'organizer', 'customer', 'driver', 'crew'])
+    def resolve_suggest_places(self, info, prefix, limit=10):
+        if limit < 1 or limit > 50:
+            raise GraphQLError("limit must be between 1 and 50.")
+        return [PlaceType(**place._asdict()) for place in get_place_index().search(prefix, limit)]
+
     # === BRANCH ===
     all_branches = graphene.List(BranchType)
     branch = graphene.Field(BranchType, id=graphene.ID(required=True))
@@ -32,6 +82,30 @@ class Query(graphene.ObjectType):
     def resolve_branch(self, info, id):
         return Branch.objects.get(pk=id)
 
+    nearest_branches = graphene.List(
+        NearestBranchType,
+        lat=graphene.Float(required=True),
+        lon=graphene.Float(required=True),
+        radius_km=graphene.Float(default_value=50),
+        limit=graphene.Int(default_value=10)
+    )
+
+    @check_role_permission(['manager', 'organizer', 'customer', 'driver', 'crew'])
+    def resolve_nearest_branches(self, info, lat, lon, radius_km=50, limit=10):
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise GraphQLError("Coordinates out of range.")
+        if radius_km <= 0 or radius_km > 1000:
+            raise GraphQLError("radiusKm must be between 0 and 1000.")
+        if limit < 1 or limit > 100:
+            raise GraphQLError("limit must be between 1 and 100.")
+
+        nearest = get_branch_grid().nearest(lat, lon, radius_km, limit)
+        branches = Branch.objects.select_related('city').in_bulk([branch_id for branch_id, _ in nearest])
+        return [
+            NearestBranchType(branch=branches[branch_id], distance_km=round(distance, 3))
+            for branch_id, distance in nearest if branch_id in branches
+        ]
+
     # === BUS ===
     all_buses = graphene.List(BusType)
     bus = graphene.Field(BusType, id=graphene.ID(required=True))
@@ -56,39 +130,72 @@ class Query(graphene.ObjectType):
     def resolve_route(self, info, id):
         return Route.objects.get(pk=id)
 
+    forecast_demand = graphene.List(
+        DemandForecastType,
+        route_id=graphene.ID(required=True),
+        start=graphene.Date(required=True, name='from'),
+        end=graphene.Date(required=True, name='to'),
+    )
+
+    @check_role_permission(['manager', 'organizer'])
+    def resolve_forecast_demand(self, info, route_id, start, end):
+        # Precomputed nightly by forecast_demand; served from the (route, day) unique index
+        return DemandForecast.objects.filter(route_id=route_id, day__gte=start, day__lte=end).order_by('day')
+
     # === TRIP ===
-    all_trips = graphene.List(TripType)
+    all_trips = graphene.List(
+        TripType,
+        departs_after=graphene.DateTime(),
+        departs_before=graphene.DateTime(),
+        arrives_after=graphene.DateTime(),
+        arrives_before=graphene.DateTime(),
+        order_by=TripOrder(default_value=TripOrder.DEPARTURE_DESC)
+    )
     trip = graphene.Field(TripType, id=graphene.ID(required=True))
 
     @check_role_permission(['manager', 'organizer', 'customer', 'driver', 'crew'])
-    def resolve_all_trips(self, info):
+    def resolve_all_trips(self, info, departs_after=None, departs_before=None,
+                          arrives_after=None, arrives_before=None,
+                          order_by=TripOrder.DEPARTURE_DESC):
         user = info.context.user
-        user_groups = {g.name.lower() for g in user.groups.all()}
+        user_groups = get_user_roles(info.context)
         now = timezone.now()
 
-        queryset = Trip.objects.select_related(
-            'route', 'bus', 'organizer', 'driver'
-        ).prefetch_related('crew').order_by('-departure_time')
+        queryset = Trip.objects.order_by(order_by.value, 'pk')
+
+        if departs_after is not None:
+            queryset = queryset.filter(departure_time__gte=departs_after)
+        if departs_before is not None:
+            queryset = queryset.filter(departure_time__lt=departs_before)
+        if arrives_after is not None:
+            queryset = queryset.filter(arrival_time__gte=arrives_after)
+        if arrives_before is not None:
+            queryset = queryset.filter(arrival_time__lt=arrives_before)
 
         if 'customer' in user_groups:
-            return queryset.filter(
+            queryset = queryset.filter(
                 departure_time__gte=now,
                 available_seats__gt=0
             )
+        elif 'driver' in user_groups or 'crew' in user_groups:
+            driven, crewed = assigned_trips(user)
+            queryset = queryset.filter(pk__in=driven.values('id').union(crewed.values('trip_id')))
 
-        if 'driver' in user_groups or 'crew' in user_groups:
-            return queryset.filter(Q(driver=user) | Q(crew__in=[user]))
-
-        return queryset
+        trips = TRIP_ROWS.fetch(info, queryset)
+        if trips is None:
+            trips = list(queryset.select_related('route', 'bus', 'organizer', 'driver').prefetch_related('crew'))
+        get_loaders(info.context).prime_trips(trip.id for trip in trips)
+        return trips
     
     @check_role_permission(['manager', 'organizer', 'customer', 'driver', 'crew'])
     def resolve_trip(self, info, id):
-        trip = Trip.objects.select_related(
-            'route', 'bus', 'organizer', 'driver'
-        ).prefetch_related('crew').get(pk=id)
-        
+        # Popular trips are read by many clients at once; identical reads share one fetch
+        trip_id = int(id)
+        trip, booked = hot_reads.do(('trip', trip_id), lambda: fetch_hot_trip(trip_id))
+        get_loaders(info.context).trip_booked_seats.seed(trip_id, booked)
+
         user = info.context.user
-        user_groups = {g.name.lower() for g in user.groups.all()}
+        user_groups = get_user_roles(info.context)
 
         if 'customer' in user_groups and (
             trip.departure_time < timezone.now()
@@ -97,13 +204,142 @@ class Query(graphene.ObjectType):
             raise GraphQLError("You are not allowed to view this trip.")
         
         if ('driver' in user_groups or 'crew' in user_groups) and \
-        (trip.driver != user and user not in trip.crew.all() and trip.organizer != user):
+        (trip.driver_id != user.pk and trip.organizer_id != user.pk
+         and not TripCrew.objects.filter(trip=trip, customuser=user).exists()):
             raise GraphQLError("You are not allowed to view this trip.")
             
         return trip
 
+    seat_map = graphene.Field(SeatMapType, trip_id=graphene.ID(required=True))
+
+    @check_role_permission(['manager', 'organizer', 'customer'])
+    def resolve_seat_map(self, info, trip_id):
+        try:
+            trip = Trip.objects.select_related('bus__layout').get(pk=trip_id)
+        except Trip.DoesNotExist:
+            raise GraphQLError("Trip not found.")
+
+        if 'customer' in get_user_roles(info.context) and trip.departure_time < timezone.now():
+            raise GraphQLError("You are not allowed to view this trip.")
+        if trip.bus is None:
+            raise GraphQLError("Trip does not have an assigned bus yet.")
+        return SeatMapType(trip, seat_plan(trip.bus))
+
+    # === DRIVER / CREW ASSIGNMENTS ===
+    my_assignments = graphene.Field(
+        TripPageType,
+        start=graphene.DateTime(required=True, name='from'),
+        end=graphene.DateTime(required=True, name='to'),
+        first=graphene.Int(default_value=50),
+        after=graphene.String()
+    )
+
+    @check_role_permission(['driver', 'crew'])
+    def resolve_my_assignments(self, info, start, end, first=50, after=None):
+        if first < 1 or first > 500:
+            raise GraphQLError("first must be between 1 and 500.")
+
+        driven, crewed = assigned_trips(info.context.user)
+        driven = driven.filter(
+            departure_time__gte=start, departure_time__lt=end, route__pending_deletion=False, cancelled_at=None
+        )
+        crewed = crewed.filter(
+            trip__departure_time__gte=start,
+            trip__departure_time__lt=end,
+            trip__route__pending_deletion=False,
+            trip__cancelled_at=None,
+        )
+        if after:
+            departure, trip_id = decode_cursor(after, 2)
+            departure = parse_datetime(departure)
+            if departure is None or not trip_id.isdigit():
+                raise GraphQLError("Invalid cursor.")
+            driven = driven.filter(
+                Q(departure_time__gt=departure) | Q(departure_time=departure, id__gt=trip_id)
+            )
+            crewed = crewed.filter(
+                Q(trip__departure_time__gt=departure) | Q(trip__departure_time=departure, trip_id__gt=trip_id)
+            )
+
+        keys = list(driven.union(crewed).order_by('departure_time', 'id')[:first + 1])
+        has_next_page = len(keys) > first
+        keys = keys[:first]
+
+        trips = Trip.objects.select_related(
+            'route', 'bus', 'organizer', 'driver'
+        ).prefetch_related('crew').in_bulk([trip_id for _, trip_id in keys])
+        page = [trips[trip_id] for _, trip_id in keys if trip_id in trips]
+        get_loaders(info.context).prime_trips(trip.id for trip in page)
+
+        end_cursor = encode_cursor(keys[-1][0].isoformat(), keys[-1][1]) if keys else None
+        return TripPageType(trips=page, end_cursor=end_cursor, has_next_page=has_next_page)
+
+    # === DELTA SYNC ===
+    changes_since = graphene.Field(
+        ChangeSetType,
+        version=graphene.BigInt(required=True),
+        first=graphene.Int(default_value=500)
+    )
+
+    @check_role_permission(['manager', 'organizer'])
+    def resolve_changes_since(self, info, version, first=500):
+        if first < 1 or first > 5000:
+            raise GraphQLError("first must be between 1 and 5000.")
+
+        changes = changes_since(version, first)
+        trips = changes.rows['trip']
+        get_loaders(info.context).prime_trips(trip.id for trip in trips)
+        return ChangeSetType(
+            version=changes.version,
+            has_more=changes.has_more,
+            cities=changes.rows['city'],
+            branches=changes.rows['branch'],
+            buses=changes.rows['bus'],
+            routes=changes.rows['route'],
+            trips=trips,
+            deleted=[TombstoneType(kind=kind, id=object_id) for kind, object_id in changes.deleted],
+        )
+
+    # === ARCHIVED TRIPS ===
+    historical_trips = graphene.List(
+        ArchivedTripType,
+        route_id=graphene.ID(),
+        departed_after=graphene.DateTime(),
+        departed_before=graphene.DateTime(),
+        first=graphene.Int(default_value=100)
+    )
+
+    @check_role_permission(['manager', 'organizer'])
+    def resolve_historical_trips(self, info, route_id=None, departed_after=None,
+                                 departed_before=None, first=100):
+        if first < 1 or first > 500:
+            raise GraphQLError("first must be between 1 and 500.")
+
+        queryset = ArchivedTrip.objects.select_related(
+            'route', 'bus', 'organizer', 'driver'
+        ).prefetch_related(
+            'crew', Prefetch('bookings', queryset=ArchivedBooking.objects.select_related('customer'))
+        ).order_by('-departure_time')
+
+        if route_id is not None:
+            queryset = queryset.filter(route_id=route_id)
+        if departed_after is not None:
+            queryset = queryset.filter(departure_time__gte=departed_after)
+        if departed_before is not None:
+            queryset = queryset.filter(departure_time__lt=departed_before)
+
+        return queryset[:first]
+
+    # === BACKGROUND JOBS ===
+    job = graphene.Field(JobType, id=graphene.ID(required=True))
+
+    @check_role_permission(['manager'])
+    def resolve_job(self, info, id):
+        return Job.objects.get(pk=id)
+
     # === CUSTOMER BOOKINGS ===
     my_bookings = graphene.List(BookingType)
+    my_waitlist = graphene.List(WaitlistEntryType)
     all_bookings = graphene.List(BookingType)
     booking = graphene.Field(BookingType, id=graphene.ID(required=True))
     customer_bookings = graphene.List(
@@ -118,11 +354,21 @@ class Query(graphene.ObjectType):
             customer=user
         ).select_related('trip').order_by('-booked_at')
 
+    @check_role_permission(['customer'])
+    def resolve_my_waitlist(self, info):
+        entries = list(WaitlistEntry.objects.filter(
+            customer=info.context.user
+        ).select_related('trip').order_by('created_at'))
+        get_loaders(info.context).waitlist_positions.prime(entry.pk for entry in entries)
+        return entries
+
     @check_role_permission(['manager', 'organizer'])
     def resolve_all_bookings(self, info):
-        return Booking.objects.all().select_related(
-            'trip', 'customer'
-        ).order_by('-booked_at')
+        queryset = Booking.objects.order_by('-booked_at')
+        rows = BOOKING_ROWS.fetch(info, queryset)
+        if rows is not None:
+            return rows
+        return queryset.select_related('trip', 'customer')
 
     @check_role_permission(['manager', 'organizer', 'customer'])
     def resolve_booking(self, info, id):
@@ -132,7 +378,7 @@ class Query(graphene.ObjectType):
         ).get(pk=id)
         
         # Customers can only see their own bookings
-        if 'customer' in [g.name.lower() for g in user.groups.all()]:
+        if 'customer' in get_user_roles(info.context):
             if booking.customer != user:
                 raise GraphQLError("You can only view your own bookings")
         
@@ -144,7 +390,9 @@ class Query(graphene.ObjectType):
         User = get_user_model()
         
         customer = User.objects.get(pk=customer_id)
-        return Booking.objects.filter(
-            customer=customer
-        ).select_related('trip').order_by('-booked_at')
+        queryset = Booking.objects.filter(customer=customer).order_by('-booked_at')
+        rows = BOOKING_ROWS.fetch(info, queryset)
+        if rows is not None:
+            return rows
+        return queryset.select_related('trip')
 
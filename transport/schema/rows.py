@@ -0,0 +1,130 @@
+"""
+Serve large list fields from ``values_list()`` rows instead of model instances.
+
+Most clients select flat fields only — scalars and the ids of related
+objects — and building a model instance (plus its ``select_related``
+relations) for each row costs far more than the row itself. When the
+selection of a list field fits its ``RowSpec`` the resolver fetches just the
+selected columns and hands the types light tuple rows; any other selection
+falls back to the queryset.
+"""
+from collections import namedtuple
+from functools import lru_cache
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import FieldNode, FragmentSpreadNode
+from ..conf import transport_setting
+
+
+class ValuesRow:
+    """Base of the row and reference classes built here; ``model`` is the model they stand for."""
+    __slots__ = ()
+    model = None
+
+    @property
+    def pk(self):
+        return self.id
+
+
+class RowSpec:
+    """
+    What a type can resolve from a values row.
+
+    ``scalars`` are concrete columns, ``refs`` maps each foreign key that may
+    be selected as ``{ id }`` to the related columns the type's resolvers read
+    besides the id, and ``computed`` maps resolver-backed fields to the
+    scalars and refs they read.
+    """
+
+    def __init__(self, model, scalars, refs=None, computed=None):
+        self.model = model
+        self.scalars = frozenset(scalars)
+        self.refs = refs or {}
+        self.computed = computed or {}
+
+    def columns(self, info):
+        """The columns to fetch for the selection of ``info``, or None if it needs model instances."""
+        scalars, refs = {'id'}, set()
+        for node in info.field_nodes:
+            if node.selection_set is None or not self.collect(node.selection_set, info.fragments, scalars, refs):
+                return None
+        columns = sorted(scalars)
+        for name in sorted(refs):
+            columns.append(f'{name}_id')
+            columns.extend(f'{name}__{column}' for column in self.refs[name])
+        return tuple(columns)
+
+    def collect(self, selection_set, fragments, scalars, refs):
+        for node in selection_set.selections:
+            if node.directives:
+                return False
+            if not isinstance(node, FieldNode):
+                inner = fragments[node.name.value] if isinstance(node, FragmentSpreadNode) else node
+                if not self.collect(inner.selection_set, fragments, scalars, refs):
+                    return False
+                continue
+            if node.arguments:
+                return False
+            name = to_snake_case(node.name.value)
+            if name == '__typename':
+                continue
+            if node.selection_set is not None:
+                if name not in self.refs or not selects_only_id(node.selection_set):
+                    return False
+                refs.add(name)
+            elif name in self.scalars:
+                scalars.add(name)
+            elif name in self.computed:
+                for dependency in self.computed[name]:
+                    (refs if dependency in self.refs else scalars).add(dependency)
+            else:
+                return False
+        return True
+
+    def fetch(self, info, queryset):
+        """
+        Rows of ``queryset`` for the selection of ``info``, or None when the
+        selection (or the ``LIST_FAST_PATH`` setting) calls for model instances.
+        """
+        if not transport_setting('LIST_FAST_PATH'):
+            return None
+        columns = self.columns(info)
+        if columns is None:
+            return None
+        return list(map(row_class(self, columns)._make, queryset.values_list(*columns)))
+
+
+def selects_only_id(selection_set):
+    return all(
+        isinstance(node, FieldNode) and not node.directives and node.selection_set is None
+        and node.name.value in ('id', '__typename')
+        for node in selection_set.selections
+    )
+
+
+@lru_cache(maxsize=None)
+def ref_class(model, columns):
+    base = namedtuple(f'{model.__name__}Ref', ('id',) + columns)
+    return type(base.__name__, (ValuesRow, base), {'__slots__': (), 'model': model})
+
+
+def ref_property(spec, name):
+    related = ref_class(spec.model._meta.get_field(name).related_model, tuple(spec.refs[name]))
+    id_column = f'{name}_id'
+    columns = tuple(f'{name}__{column}' for column in spec.refs[name])
+
+    def get(row):
+        pk = getattr(row, id_column)
+        if pk is None:
+            return None
+        return related(pk, *(getattr(row, column) for column in columns))
+    return property(get)
+
+
+@lru_cache(maxsize=256)
+def row_class(spec, columns):
+    base = namedtuple(f'{spec.model.__name__}Row', columns)
+    attrs = {'__slots__': (), 'model': spec.model}
+    for name in spec.refs:
+        if f'{name}_id' in columns:
+            attrs[name] = ref_property(spec, name)
+    return type(base.__name__, (ValuesRow, base), attrs)
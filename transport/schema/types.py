@@ -1,11 +1,33 @@
+from functools import lru_cache
 import graphene
 from graphene_django import DjangoObjectType
-from ..models import City, Branch, Bus, Route, Trip, Booking
+from graphql import GraphQLError
+from ..models import (
+    City, Branch, Bus, Route, Trip, Booking, ArchivedTrip, ArchivedBooking, Job, WaitlistEntry, SeatLayout,
+    DemandForecast
+)
 from django.contrib.auth import get_user_model
+from .loaders import get_loaders
+from .rows import RowSpec, ValuesRow
+from ..seating import class_occupancy
 
 User = get_user_model()
 
-class UserType(DjangoObjectType):
+
+class RowObjectType(DjangoObjectType):
+    """A model type that also resolves ``rows.ValuesRow`` rows of its model."""
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def is_type_of(cls, root, info):
+        if isinstance(root, ValuesRow):
+            return root.model is cls._meta.model
+        return super().is_type_of(root, info)
+
+
+class UserType(RowObjectType):
     class Meta:
         model = User
         fields = ("id", "username", "email")
@@ -13,41 +35,71 @@ class UserType(DjangoObjectType):
 class CityType(DjangoObjectType):
     class Meta:
         model = City
-        fields = ("id", "name")
+        fields = ("id", "name", "version")
 
 
 class BranchType(DjangoObjectType):
     class Meta:
         model = Branch
-        fields = ("id", "name", "city")
+        fields = ("id", "name", "city", "latitude", "longitude", "version")
 
 
-class BusType(DjangoObjectType):
+class SeatLayoutType(DjangoObjectType):
+    class Meta:
+        model = SeatLayout
+        fields = ("id", "name", "rows", "columns", "aisle_after", "seat_classes")
+
+
+class BusType(RowObjectType):
     class Meta:
         model = Bus
-        fields = ("id", "plate_number", "capacity", "branch")
+        fields = ("id", "plate_number", "capacity", "branch", "layout", "version")
 
 
-class RouteType(DjangoObjectType):
+@lru_cache(maxsize=1024)
+def format_duration(duration):
+    total_seconds = int(duration.total_seconds())
+    hours, rem = divmod(total_seconds, 3600)
+    minutes, seconds = divmod(rem, 60)
+    return f"{hours:02}:{minutes:02}:{seconds:02}"
+
+
+class RouteType(RowObjectType):
     duration = graphene.String()
     class Meta:
         model = Route
-        fields = ("id", "origin", "destination", "duration", "distance_km")
+        fields = ("id", "origin", "destination", "duration", "distance_km", "version")
     
     def resolve_duration(self, info):
-        total_seconds = int(self.duration.total_seconds())
-        hours, rem = divmod(total_seconds, 3600)
-        minutes, seconds = divmod(rem, 60)
-        return f"{hours:02}:{minutes:02}:{seconds:02}"
+        # Routes share a handful of durations, so the formatted string is cached
+        return format_duration(self.duration)
     
 
-class BookingType(DjangoObjectType):
+class BookingType(RowObjectType):
     class Meta:
         model = Booking
-        fields = ("id", "customer", "trip", "seat_number", "booked_at")
+        fields = ("id", "customer", "trip", "seat_number", "booked_at", "cancelled_at")
+
 
+BOOKING_ROWS = RowSpec(
+    Booking, scalars=("id", "seat_number", "booked_at", "cancelled_at"), refs={"customer": (), "trip": ()}
+)
 
-class TripType(DjangoObjectType):
+
+class DemandForecastType(DjangoObjectType):
+    class Meta:
+        model = DemandForecast
+        fields = ("id", "route", "day", "expected_bookings", "generated_at")
+
+
+class TripOrder(graphene.Enum):
+    DEPARTURE_ASC = 'departure_time'
+    DEPARTURE_DESC = '-departure_time'
+    ARRIVAL_ASC = 'arrival_time'
+    ARRIVAL_DESC = '-arrival_time'
+
+
+class TripType(RowObjectType):
     organizer = graphene.Field(UserType)
     driver    = graphene.Field(UserType)
     crew      = graphene.List(UserType)
@@ -59,7 +111,7 @@ class TripType(DjangoObjectType):
         model = Trip
         fields = (
             "id", "route", "bus",
-            "departure_time", "available_seats", "bookings"
+            "departure_time", "arrival_time", "available_seats", "bookings", "version", "cancelled_at"
         )
 
     def resolve_organizer(self, info):
@@ -68,22 +120,221 @@ class TripType(DjangoObjectType):
     def resolve_driver(self, info):
         return self.driver
 
+    def resolve_bus(self, info):
+        bus = self.bus
+        if bus is None or bus.pending_deletion:
+            return None
+        return bus
+
     def resolve_crew(self, info):
         return self.crew.all()
 
     def resolve_bookings(self, info):
-        return self.bookings.all()
+        return get_loaders(info.context).trip_bookings.load(self.id)
 
     def resolve_available_seat_numbers(self, info):
         all_seats = set(range(1, self.bus.capacity + 1))
-        booked   = set(self.bookings.values_list("seat_number", flat=True))
-        return sorted(all_seats - booked)
+        booked_seats = get_loaders(info.context).trip_booked_seats.load(self.id)
+        return sorted(all_seats - booked_seats)
+
+
+TRIP_ROWS = RowSpec(
+    Trip,
+    scalars=("id", "departure_time", "arrival_time", "available_seats", "version", "cancelled_at"),
+    # resolve_bus hides buses pending deletion; availableSeatNumbers needs the capacity
+    refs={"route": (), "bus": ("capacity", "pending_deletion"), "organizer": (), "driver": ()},
+    computed={"available_seat_numbers": ("id", "bus")},
+)
+
+
+class TripPageType(graphene.ObjectType):
+    trips = graphene.List(TripType)
+    end_cursor = graphene.String()
+    has_next_page = graphene.Boolean()
+
+
+class SeatType(graphene.ObjectType):
+    number = graphene.Int()
+    row = graphene.Int()
+    column = graphene.Int()
+    seat_class = graphene.String()
+    booked = graphene.Boolean()
+
+
+class SeatClassAvailabilityType(graphene.ObjectType):
+    seat_class = graphene.String()
+    total = graphene.Int()
+    booked = graphene.Int()
+    available = graphene.Int()
+
+
+class SeatMapType(graphene.ObjectType):
+    """Seat map of a trip's bus; built from ``trip`` and its ``plan`` (a ``seating.SeatPlan``)."""
+    rows = graphene.Int()
+    columns = graphene.Int()
+    aisle_after = graphene.Int()
+    seats = graphene.List(SeatType)
+    classes = graphene.List(SeatClassAvailabilityType)
+    adjacent_seats = graphene.List(
+        graphene.List(graphene.Int),
+        count=graphene.Int(required=True),
+        seat_class=graphene.String()
+    )
+
+    def __init__(self, trip, plan):
+        super().__init__(rows=plan.rows, columns=plan.columns, aisle_after=plan.aisle_after)
+        self.trip = trip
+        self.plan = plan
+
+    def resolve_seats(self, info):
+        booked = get_loaders(info.context).trip_booked_seats.load(self.trip.id)
+        return [SeatType(booked=seat.number in booked, **seat._asdict()) for seat in self.plan.seats]
+
+    def resolve_classes(self, info):
+        occupancy = class_occupancy(self.trip.id, self.plan)
+        return [
+            SeatClassAvailabilityType(
+                seat_class=seat_class, total=len(numbers),
+                booked=occupancy[seat_class], available=len(numbers) - occupancy[seat_class]
+            )
+            for seat_class, numbers in self.plan.by_class.items()
+        ]
+
+    def resolve_adjacent_seats(self, info, count, seat_class=None):
+        if count < 1:
+            raise GraphQLError("count must be at least 1.")
+        booked = get_loaders(info.context).trip_booked_seats.load(self.trip.id)
+        return self.plan.adjacent(count, booked, seat_class)
+
+
+class NearestBranchType(graphene.ObjectType):
+    branch = graphene.Field(BranchType)
+    distance_km = graphene.Float()
+
+
+class PlaceType(graphene.ObjectType):
+    kind = graphene.String()
+    id = graphene.ID()
+    name = graphene.String()
+    city = graphene.String()
+
+
+class TombstoneType(graphene.ObjectType):
+    kind = graphene.String()
+    id = graphene.ID()
+
+
+class ChangeSetType(graphene.ObjectType):
+    version = graphene.BigInt()
+    has_more = graphene.Boolean()
+    cities = graphene.List(CityType)
+    branches = graphene.List(BranchType)
+    buses = graphene.List(BusType)
+    routes = graphene.List(RouteType)
+    trips = graphene.List(TripType)
+    deleted = graphene.List(TombstoneType)
+
+
+class ImportFormat(graphene.Enum):
+    CSV = 'csv'
+    JSONL = 'jsonl'
+
+
+class ImportErrorType(graphene.ObjectType):
+    line = graphene.Int()
+    message = graphene.String()
+
+
+class ImportReportType(graphene.ObjectType):
+    """Outcome of a network import; built from a ``network.ImportReport``."""
+    created = graphene.Int()
+    updated = graphene.Int()
+    unchanged = graphene.Int()
+    errors = graphene.List(ImportErrorType)
+    committed = graphene.Boolean()
+
+
+class TripFilterInput(graphene.InputObjectType):
+    """Selects trips by id, or a route's departures within a time window."""
+    ids = graphene.List(graphene.NonNull(graphene.ID))
+    route_id = graphene.ID()
+    departs_after = graphene.DateTime()
+    departs_before = graphene.DateTime()
+
+
+class CancelTripsResultType(graphene.ObjectType):
+    cancelled_trips = graphene.Int()
+    cancelled_bookings = graphene.Int()
+    notified_customers = graphene.Int()
+
+
+class BusAssignmentType(graphene.ObjectType):
+    trip = graphene.Field(TripType)
+    bus = graphene.Field(BusType)
+
+
+class UnassignedTripType(graphene.ObjectType):
+    trip = graphene.Field(TripType)
+    reason = graphene.String()
+
+
+class BusAssignmentPlanType(graphene.ObjectType):
+    assignments = graphene.List(BusAssignmentType)
+    unassigned = graphene.List(UnassignedTripType)
+    buses_used = graphene.Int()
+    committed = graphene.Boolean()
+
+
+class WaitlistEntryType(DjangoObjectType):
+    position = graphene.Int()
+
+    class Meta:
+        model = WaitlistEntry
+        fields = ("id", "trip", "seats", "created_at")
+
+    def resolve_position(self, info):
+        return get_loaders(info.context).waitlist_positions.load(self.pk)
+
+
+class ArchivedBookingType(DjangoObjectType):
+    id = graphene.ID(required=True)
+
+    class Meta:
+        model = ArchivedBooking
+        fields = ("id", "customer", "seat_number", "booked_at", "cancelled_at")
+
+
+class ArchivedTripType(DjangoObjectType):
+    id        = graphene.ID(required=True)
+    organizer = graphene.Field(UserType)
+    driver    = graphene.Field(UserType)
+    crew      = graphene.List(UserType)
+    bookings  = graphene.List(ArchivedBookingType)
+
+    class Meta:
+        model = ArchivedTrip
+        fields = (
+            "id", "route", "bus",
+            "departure_time", "available_seats", "cancelled_at", "archived_at"
+        )
+
+    def resolve_organizer(self, info):
+        return self.organizer
+
+    def resolve_driver(self, info):
+        return self.driver
+
+    def resolve_crew(self, info):
+        return self.crew.all()
 
     def resolve_bookings(self, info):
         return self.bookings.all()
 
-    def resolve_available_seat_numbers(self, info):
-        all_seats = set(range(1, self.bus.capacity + 1))
-        booked_seats = set(self.bookings.values_list("seat_number", flat=True))
-        return sorted(all_seats - booked_seats)
 
+class JobType(DjangoObjectType):
+    class Meta:
+        model = Job
+        fields = (
+            "id", "name", "status", "progress", "error",
+            "created_at", "started_at", "finished_at"
+        )
@@ -0,0 +1,110 @@
+import math
+from functools import lru_cache
+from typing import NamedTuple
+from django.db.models import Count, Q
+from .models import Booking
+
+DEFAULT_CLASS = 'standard'
+# Buses without a layout are assumed to seat two + two with a middle aisle
+DEFAULT_COLUMNS, DEFAULT_AISLE_AFTER = 4, 2
+
+
+class Seat(NamedTuple):
+    number: int
+    row: int
+    column: int
+    seat_class: str
+
+
+class SeatPlan:
+    """
+    Numbered seats of a layout with the lookups group bookings need.
+
+    ``runs`` lists the seats that sit side by side: consecutive columns of
+    one row on the same side of the aisle and of the same class. Finding N
+    adjacent free seats is then a sliding window over each run instead of a
+    search over the whole bus.
+    """
+
+    def __init__(self, rows, columns, aisle_after, seat_classes):
+        self.rows = rows
+        self.columns = columns
+        self.aisle_after = aisle_after
+        self.seats = []
+        self.runs = []
+        by_class = {}
+        for row, row_classes in enumerate(seat_classes, start=1):
+            run = []
+            for column, seat_class in enumerate(row_classes, start=1):
+                breaks_run = (
+                    not seat_class
+                    or column == aisle_after + 1
+                    or (run and self.seats[run[-1] - 1].seat_class != seat_class)
+                )
+                if breaks_run and run:
+                    self.runs.append(tuple(run))
+                    run = []
+                if not seat_class:
+                    continue
+                seat = Seat(len(self.seats) + 1, row, column, seat_class)
+                self.seats.append(seat)
+                by_class.setdefault(seat_class, []).append(seat.number)
+                run.append(seat.number)
+            if run:
+                self.runs.append(tuple(run))
+        self.by_class = {seat_class: tuple(numbers) for seat_class, numbers in by_class.items()}
+
+    def adjacent(self, count, booked, seat_class=None):
+        """Every group of ``count`` side-by-side seats that are all free, front to back."""
+        groups = []
+        for run in self.runs:
+            if len(run) < count or (seat_class and self.seats[run[0] - 1].seat_class != seat_class):
+                continue
+            free = 0
+            for position, number in enumerate(run):
+                free = 0 if number in booked else free + 1
+                if free >= count:
+                    groups.append(run[position - count + 1:position + 1])
+        return groups
+
+
+def validate_layout(rows, columns, aisle_after, seat_classes):
+    """Return the number of seats of a layout, or raise ``ValueError`` describing the problem."""
+    if rows < 1 or columns < 1:
+        raise ValueError("A layout needs at least one row and one column.")
+    if aisle_after >= columns:
+        raise ValueError("The aisle must run between two columns.")
+    if len(seat_classes) != rows or any(len(row) != columns for row in seat_classes):
+        raise ValueError("Seat classes must list every position, one list per row.")
+    seats = sum(1 for row in seat_classes for seat_class in row if seat_class)
+    if not seats:
+        raise ValueError("A layout needs at least one seat.")
+    return seats
+
+
+@lru_cache(maxsize=256)
+def _build_plan(rows, columns, aisle_after, seat_classes):
+    return SeatPlan(rows, columns, aisle_after, seat_classes)
+
+
+def seat_plan(bus):
+    """The ``SeatPlan`` of ``bus``; plans are cached per distinct layout."""
+    layout = bus.layout
+    if layout is not None:
+        classes = tuple(tuple(row) for row in layout.seat_classes)
+        return _build_plan(layout.rows, layout.columns, layout.aisle_after, classes)
+
+    rows = math.ceil(bus.capacity / DEFAULT_COLUMNS)
+    positions = [DEFAULT_CLASS] * bus.capacity + [''] * (rows * DEFAULT_COLUMNS - bus.capacity)
+    classes = tuple(tuple(positions[i:i + DEFAULT_COLUMNS]) for i in range(0, len(positions), DEFAULT_COLUMNS))
+    return _build_plan(rows, DEFAULT_COLUMNS, DEFAULT_AISLE_AFTER, classes)
+
+
+def class_occupancy(trip_id, plan):
+    """``{seat_class: booked seats}`` for the trip, counted by a single aggregate query."""
+    classes = list(plan.by_class)
+    counts = Booking.objects.filter(trip_id=trip_id).aggregate(**{
+        f'class_{index}': Count('pk', filter=Q(seat_number__in=plan.by_class[seat_class]))
+        for index, seat_class in enumerate(classes)
+    })
+    return {seat_class: counts[f'class_{index}'] for index, seat_class in enumerate(classes)}
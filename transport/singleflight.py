@@ -0,0 +1,93 @@
+import threading
+import time
+from functools import partial
+from django.db import transaction
+from .conf import transport_setting
+
+
+class _Call:
+    __slots__ = ('done', 'value', 'error', 'generation')
+
+    def __init__(self, generation):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.generation = generation
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent reads within one process.
+
+    The first caller of ``do(key, fn)`` runs ``fn``; callers arriving while
+    it runs wait for and share its result, and callers within
+    ``SINGLE_FLIGHT_TTL_MS`` afterwards get it from a micro cache. Errors are
+    shared with the waiters but never cached. ``forget(key)`` drops the
+    cached result, and a computation already running when ``forget`` is
+    called is not cached either.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.results = {}  # key -> (expires_at, value)
+        self.generations = {}
+
+    def do(self, key, fn):
+        ttl = transport_setting('SINGLE_FLIGHT_TTL_MS') / 1000
+        with self.lock:
+            cached = self.results.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                return cached[1]
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call(self.generations.get(key, 0))
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+                if call.error is None and ttl > 0 and call.generation == self.generations.get(key, 0):
+                    self.results[key] = (time.monotonic() + ttl, call.value)
+                self.prune()
+            call.done.set()
+        return call.value
+
+    def forget(self, key):
+        with self.lock:
+            self.results.pop(key, None)
+            self.generations[key] = self.generations.get(key, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.results.clear()
+            self.generations.clear()
+
+    def prune(self):
+        # Called with the lock held; keeps the caches from growing with every key ever read.
+        if len(self.results) > 10000:
+            now = time.monotonic()
+            self.results = {key: entry for key, entry in self.results.items() if entry[0] > now}
+        if len(self.generations) > 10000:
+            self.generations = {key: self.generations[key] for key in self.calls if key in self.generations}
+
+
+hot_reads = SingleFlight()
+
+
+def invalidate_trip(trip_id):
+    """Drop the coalesced reads of a trip now and again once the current transaction commits."""
+    key = ('trip', int(trip_id))
+    hot_reads.forget(key)
+    transaction.on_commit(partial(hot_reads.forget, key))
@@ -0,0 +1,56 @@
+from typing import NamedTuple
+from .models import City, Branch, Bus, Route, Trip, ChangeLog
+
+# ChangeLog.kind -> model and the relations its GraphQL type reads
+SYNCED_MODELS = {
+    'city': (City, ()),
+    'branch': (Branch, ('city',)),
+    'bus': (Bus, ('branch',)),
+    'route': (Route, ('origin', 'destination')),
+    'trip': (Trip, ('route', 'bus', 'organizer', 'driver')),
+}
+
+
+class ChangeSet(NamedTuple):
+    version: int
+    has_more: bool
+    rows: dict  # kind -> list of current rows
+    deleted: list  # (kind, id) tombstones
+
+
+def changes_since(version, first):
+    """
+    Rows changed after ``version``, reading at most ``first`` change log entries.
+
+    A row changed several times in the page appears once, in its current
+    state. Rows that are gone or hidden pending deletion come back as
+    tombstones; a route tombstone also removes the route's trips. Clients
+    store the returned ``version`` and ask again while ``has_more`` is set.
+    Costs one query for the log plus one per kind of row in the page, after
+    ``ChangeLog.publish`` numbered the entries committed since the last call.
+    """
+    ChangeLog.publish()
+    entries = list(
+        ChangeLog.objects.filter(position__gt=version).order_by('position')
+        .values_list('position', 'kind', 'object_id', 'deleted')[:first + 1]
+    )
+    has_more = len(entries) > first
+    entries = entries[:first]
+
+    latest = {}
+    for _, kind, object_id, deleted in entries:
+        latest.pop((kind, object_id), None)
+        latest[(kind, object_id)] = deleted
+
+    rows = {kind: [] for kind in SYNCED_MODELS}
+    deleted = [key for key, is_deleted in latest.items() if is_deleted]
+    for kind, (model, related) in SYNCED_MODELS.items():
+        ids = [object_id for (entry_kind, object_id), is_deleted in latest.items()
+               if entry_kind == kind and not is_deleted]
+        if not ids:
+            continue
+        found = model.objects.select_related(*related).in_bulk(ids)
+        rows[kind] = [found[pk] for pk in ids if pk in found]
+        deleted.extend((kind, pk) for pk in ids if pk not in found)
+
+    return ChangeSet(entries[-1][0] if entries else version, has_more, rows, deleted)
@@ -0,0 +1,45 @@
+from django.contrib.auth import get_user_model
+from .cancellation import notify_cancellation
+from .deletion import CascadeDeleter
+from .forecast import build_forecasts
+from .inventory import reconcile_seats
+from .jobs import job_handler
+from .models import Trip
+from .timetable import build_snapshot
+
+
+@job_handler('cascade_delete')
+def cascade_delete(job):
+    CascadeDeleter(job).run(job.payload['model'], job.payload['id'])
+
+
+@job_handler('build_timetable_snapshot')
+def build_timetable_snapshot(job):
+    job.report_progress(**build_snapshot(days=job.payload.get('days'), full=job.payload.get('full', False)))
+
+
+@job_handler('forecast_demand')
+def forecast_demand(job):
+    job.report_progress(forecasts=build_forecasts(weeks=job.payload.get('weeks'), days=job.payload.get('days')))
+
+
+@job_handler('reconcile_seats')
+def reconcile_seats_job(job):
+    chunks = fixed = 0
+    for fixes in reconcile_seats(job.payload.get('chunk_size', 1000), job.payload.get('full_capacity', False)):
+        chunks += 1
+        fixed += len(fixes)
+        # The most recently corrected trips, for the report; the full list could be huge
+        recent = (job.progress.get('recent_fixes', []) + [list(fix) for fix in fixes])[-100:]
+        job.report_progress(chunks=chunks, fixed=fixed, recent_fixes=recent)
+
+
+@job_handler('notify_trip_cancellation')
+def notify_trip_cancellation(job):
+    customer = get_user_model().objects.filter(pk=job.payload['customer_id']).first()
+    if customer is None:
+        return
+    trips = Trip.all_objects.select_related(
+        'route__origin__city', 'route__destination__city'
+    ).filter(pk__in=job.payload['trip_ids']).order_by('departure_time')
+    notify_cancellation(customer, trips, job.payload.get('reason', ''))
@@ -0,0 +1,1434 @@
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone as datetime_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import skipIf
+from django.core import mail
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from .models import (
+    City, Branch, Bus, Route, Trip, Booking, ArchivedTrip, ChangeLog, Job, WaitlistEntry, DemandForecast
+)
+from .cancellation import cancel_trips
+from .fleet import FleetBus, TripLeg, solve
+from .forecast import WEEK_DECAY, numpy, weekday_baseline
+from .idempotency import PENDING, fingerprint, get_store, store_key
+from .geo import BranchGrid, haversine_km, haversine_many_km, implausible_distances
+from .places import Place, PlaceIndex
+from .ratelimit import LocalBackend, limit_for, load_backend
+from .jobs import claim_next_job, enqueue, job_handler, run_job
+from .scheduling import TripSlot, find_conflicts
+from .seating import SeatPlan
+from .reminders import ConsoleSender, ReminderScheduler
+from .singleflight import SingleFlight, hot_reads
+from .timetable import build_snapshot
+from .views import TransportGraphQLView
+
+User = get_user_model()
+
+
+class GraphQLTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager_group, _ = Group.objects.get_or_create(name='manager')
+        cls.customer_group, _ = Group.objects.get_or_create(name='customer')
+
+        cls.manager = User.objects.create_user(username='manager', password='managerpass', email='manager@g.com')
+        cls.manager.groups.add(cls.manager_group)
+
+        cls.customer = User.objects.create_user(username='customer', password='customerpass', email='customer@g.com')
+        cls.customer.groups.add(cls.customer_group)
+
+        cls.city = City.objects.create(name='Damascus')
+        cls.other_city = City.objects.create(name='Aleppo')
+        cls.origin = Branch.objects.create(name='Central', city=cls.city)
+        cls.destination = Branch.objects.create(name='North', city=cls.other_city)
+        cls.bus = Bus.objects.create(plate_number='ABC-123', capacity=4, branch=cls.origin)
+        cls.route = Route.objects.create(
+            origin=cls.origin,
+            destination=cls.destination,
+            duration=timedelta(hours=5),
+            distance_km=350,
+        )
+        cls.trip = Trip.objects.create(
+            route=cls.route,
+            bus=cls.bus,
+            organizer=cls.manager,
+            driver=cls.manager,
+            departure_time=timezone.now() + timedelta(days=1),
+            available_seats=4,
+        )
+
+    def setUp(self):
+        hot_reads.reset()
+
+    def post_graphql(self, payload, user=None, **extra):
+        if user is not None:
+            self.client.force_login(user)
+        return self.client.post('/graphql/', json.dumps(payload), content_type='application/json', **extra)
+
+
+class BatchedGraphQLTests(GraphQLTestCase):
+
+    def test_single_operation_still_returns_an_object(self):
+        response = self.post_graphql({'query': '{ allCities { name } }'}, user=self.manager)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['data']['allCities']), 2)
+
+    def test_batch_returns_one_result_per_operation(self):
+        response = self.post_graphql([
+            {'id': 'cities', 'query': '{ allCities { name } }'},
+            {'id': 'trips', 'query': '{ allTrips { id availableSeatNumbers } }'},
+        ], user=self.manager)
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual([result['id'] for result in results], ['cities', 'trips'])
+        self.assertEqual(results[1]['data']['allTrips'][0]['availableSeatNumbers'], [1, 2, 3, 4])
+
+    def test_batch_shares_role_lookup_and_loaders(self):
+        Booking.objects.create(customer=self.customer, trip=self.trip, seat_number=2)
+        self.client.force_login(self.manager)
+        batch = [
+            {'query': '{ allTrips { availableSeatNumbers bookings { seatNumber } } }'},
+            {'query': '{ allCities { name } }'},
+        ]
+        # session + user + groups + trips + crew prefetch + seats + bookings + cities
+        with self.assertNumQueries(8):
+            response = self.post_graphql(batch)
+        self.assertEqual(response.json()[0]['data']['allTrips'][0]['availableSeatNumbers'], [1, 3, 4])
+
+    def test_mutation_in_batch_refreshes_loaders(self):
+        query = {'query': '{ allTrips { availableSeatNumbers } }'}
+        booking = {'query': 'mutation { createBooking(tripId: %d, seatNumber: 1) { booking { id } } }' % self.trip.id}
+        self.client.force_login(self.customer)
+        results = self.post_graphql([query, booking, query]).json()
+        self.assertEqual(results[0]['data']['allTrips'][0]['availableSeatNumbers'], [1, 2, 3, 4])
+        self.assertEqual(results[2]['data']['allTrips'][0]['availableSeatNumbers'], [2, 3, 4])
+
+    def test_batch_size_is_limited(self):
+        with self.settings(TRANSPORT={'GRAPHQL_MAX_BATCH_SIZE': 1}):
+            response = self.post_graphql([{'query': '{ allCities { name } }'}] * 2, user=self.manager)
+        self.assertEqual(response.status_code, 400)
+
+
+class ResponseRenderingTests(GraphQLTestCase):
+
+    def test_large_responses_are_gzipped_when_accepted(self):
+        with self.settings(TRANSPORT={'GRAPHQL_COMPRESSION_MIN_BYTES': 10}):
+            response = self.post_graphql(
+                {'query': '{ allCities { name } }'}, user=self.manager, HTTP_ACCEPT_ENCODING='gzip'
+            )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        body = json.loads(gzip.decompress(response.content))
+        self.assertEqual(len(body['data']['allCities']), 2)
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.post_graphql(
+            {'query': '{ allCities { name } }'}, user=self.manager, HTTP_ACCEPT_ENCODING='gzip, br'
+        )
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_renderer_handles_decimal_and_datetime(self):
+        request = RequestFactory().post('/graphql/')
+        when = timezone.now()
+        encoded = json.loads(TransportGraphQLView().json_encode(request, {'price': Decimal('1.50'), 'at': when}))
+        self.assertEqual(encoded['price'], '1.50')
+        self.assertEqual(encoded['at'][:19], when.isoformat()[:19])
+
+
+class ArchiveTripsTests(GraphQLTestCase):
+
+    def create_departed_trip(self, days_ago):
+        trip = Trip.objects.create(
+            route=self.route,
+            bus=self.bus,
+            organizer=self.manager,
+            driver=self.manager,
+            departure_time=timezone.now() - timedelta(days=days_ago),
+            available_seats=3,
+        )
+        trip.crew.add(self.manager)
+        Booking.objects.create(customer=self.customer, trip=trip, seat_number=1)
+        return trip
+
+    def test_archive_moves_trips_bookings_and_crew_in_chunks(self):
+        old_trips = [self.create_departed_trip(days_ago=60) for _ in range(3)]
+        recent = self.create_departed_trip(days_ago=5)
+
+        call_command('archive_trips', days=30, chunk_size=2, stdout=StringIO())
+
+        self.assertFalse(Trip.objects.filter(pk__in=[t.pk for t in old_trips]).exists())
+        self.assertTrue(Trip.objects.filter(pk=recent.pk).exists())
+        archived = ArchivedTrip.objects.get(pk=old_trips[0].pk)
+        self.assertEqual(list(archived.crew.all()), [self.manager])
+        self.assertEqual(archived.bookings.get().seat_number, 1)
+        self.assertEqual(Booking.objects.filter(trip__in=old_trips).count(), 0)
+
+    def test_archive_can_resume_after_max_chunks(self):
+        for _ in range(3):
+            self.create_departed_trip(days_ago=60)
+        call_command('archive_trips', days=30, chunk_size=1, max_chunks=1, stdout=StringIO())
+        self.assertEqual(ArchivedTrip.objects.count(), 1)
+        call_command('archive_trips', days=30, chunk_size=1, stdout=StringIO())
+        self.assertEqual(ArchivedTrip.objects.count(), 3)
+
+    def test_archive_keeps_cancellations(self):
+        trip = self.create_departed_trip(days_ago=60)
+        cancel_trips(Trip.objects.filter(pk=trip.pk))
+        call_command('archive_trips', days=30, stdout=StringIO())
+        response = self.post_graphql(
+            {'query': '{ historicalTrips { cancelledAt bookings { cancelledAt } } }'}, user=self.manager
+        )
+        data = response.json()['data']['historicalTrips']
+        self.assertIsNotNone(data[0]['cancelledAt'])
+        self.assertIsNotNone(data[0]['bookings'][0]['cancelledAt'])
+
+    def test_historical_trips_query(self):
+        trip = self.create_departed_trip(days_ago=60)
+        call_command('archive_trips', days=30, stdout=StringIO())
+        response = self.post_graphql(
+            {'query': '{ historicalTrips { id bookings { seatNumber } crew { username } } }'}, user=self.manager
+        )
+        data = response.json()['data']['historicalTrips']
+        self.assertEqual(data, [{'id': str(trip.pk), 'bookings': [{'seatNumber': 1}], 'crew': [{'username': 'manager'}]}])
+
+    def test_historical_trips_are_bounded_and_prefetched(self):
+        for _ in range(3):
+            self.create_departed_trip(days_ago=60)
+        call_command('archive_trips', days=30, stdout=StringIO())
+        query = '{ historicalTrips(first: %d) { id bookings { seatNumber customer { username } } crew { username } } }'
+        self.client.force_login(self.manager)
+        # session + user + groups + trips + crew + bookings with their customers
+        with self.assertNumQueries(6):
+            data = self.post_graphql({'query': query % 10}).json()['data']['historicalTrips']
+        self.assertEqual(len(data), 3)
+        for first in (0, 501):
+            result = self.post_graphql({'query': query % first}).json()
+            self.assertIn('first must be between 1 and 500', result['errors'][0]['message'])
+
+
+class CascadeDeletionTests(GraphQLTestCase):
+
+    def test_delete_branch_hides_entities_and_returns_job(self):
+        Booking.objects.create(customer=self.customer, trip=self.trip, seat_number=1)
+        response = self.post_graphql(
+            {'query': 'mutation { deleteBranch(id: %d) { ok jobId } }' % self.origin.pk}, user=self.manager
+        )
+        result = response.json()['data']['deleteBranch']
+        self.assertTrue(result['ok'])
+
+        self.assertFalse(Branch.objects.filter(pk=self.origin.pk).exists())
+        self.assertFalse(Bus.objects.filter(pk=self.bus.pk).exists())
+        self.assertFalse(Trip.objects.filter(pk=self.trip.pk).exists())
+        self.assertFalse(Booking.objects.exists())
+        self.assertTrue(Booking.all_objects.exists())
+
+        call_command('run_worker', once=True, stdout=StringIO())
+
+        job = Job.objects.get(pk=result['jobId'])
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.progress['bookings'], 1)
+        self.assertEqual(job.progress['trips'], 1)
+        self.assertFalse(Branch.all_objects.filter(pk=self.origin.pk).exists())
+        self.assertFalse(Trip.all_objects.exists())
+        self.assertTrue(City.objects.filter(pk=self.city.pk).exists())
+
+    def test_delete_bus_keeps_trips(self):
+        self.post_graphql({'query': 'mutation { deleteBus(id: %d) { ok } }' % self.bus.pk}, user=self.manager)
+        response = self.post_graphql({'query': '{ allTrips { id bus { id } } }'}, user=self.manager)
+        self.assertEqual(response.json()['data']['allTrips'], [{'id': str(self.trip.pk), 'bus': None}])
+
+        call_command('run_worker', once=True, stdout=StringIO())
+        self.trip.refresh_from_db()
+        self.assertIsNone(self.trip.bus)
+        self.assertFalse(Bus.all_objects.exists())
+
+    def test_job_progress_query(self):
+        response = self.post_graphql(
+            {'query': 'mutation { deleteCity(id: %d) { jobId } }' % self.city.pk}, user=self.manager
+        )
+        job_id = response.json()['data']['deleteCity']['jobId']
+        call_command('run_worker', once=True, stdout=StringIO())
+        response = self.post_graphql({'query': '{ job(id: %s) { status } }' % job_id}, user=self.manager)
+        self.assertEqual(response.json()['data']['job']['status'], 'SUCCEEDED')
+        self.assertFalse(City.all_objects.filter(pk=self.city.pk).exists())
+
+
+FLAKY_FAILURES = []
+
+
+@job_handler('test_flaky')
+def flaky_job(job):
+    if len(FLAKY_FAILURES) < job.payload['failures']:
+        FLAKY_FAILURES.append(job.pk)
+        raise RuntimeError('temporary failure')
+
+
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        FLAKY_FAILURES.clear()
+
+    def test_failed_job_is_retried_with_backoff(self):
+        job = enqueue('test_flaky', {'failures': 1})
+        with self.assertLogs('transport.jobs', 'ERROR'):
+            run_job(claim_next_job('w1'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIsNone(claim_next_job('w1'))
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        run_job(claim_next_job('w1'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_job_fails_after_max_attempts(self):
+        job = enqueue('test_flaky', {'failures': 5}, max_attempts=1)
+        with self.assertLogs('transport.jobs', 'ERROR'):
+            run_job(claim_next_job('w1'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('temporary failure', job.error)
+
+    def test_claimed_job_is_not_claimed_twice_until_lease_expires(self):
+        job = enqueue('test_flaky', {'failures': 0})
+        self.assertEqual(claim_next_job('w1').pk, job.pk)
+        self.assertIsNone(claim_next_job('w2'))
+
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        reclaimed = claim_next_job('w2')
+        self.assertEqual(reclaimed.locked_by, 'w2')
+        self.assertEqual(reclaimed.attempts, 2)
+
+
+
+SLOW_JOB_CLAIMS = []
+
+
+@job_handler('test_slow')
+def slow_job(job):
+    time.sleep(job.payload['seconds'])
+    SLOW_JOB_CLAIMS.append(claim_next_job('w2'))
+
+
+@override_settings(TRANSPORT={'JOB_LEASE_SECONDS': 0.3})
+class JobLeaseHeartbeatTests(TransactionTestCase):
+
+    def test_lease_is_renewed_while_the_handler_runs(self):
+        job = enqueue('test_slow', {'seconds': 0.6})
+        run_job(claim_next_job('w1'))
+        self.assertEqual(SLOW_JOB_CLAIMS, [None])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.attempts, 1)
+
+class WaitlistTests(GraphQLTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.second_customer = User.objects.create_user(username='second', password='secondpass', email='second@g.com')
+        cls.second_customer.groups.add(cls.customer_group)
+        cls.trip.available_seats = 1
+        cls.trip.save()
+        cls.booking = Booking.objects.create(customer=cls.customer, trip=cls.trip, seat_number=1)
+        cls.trip.available_seats = 0
+        cls.trip.save()
+
+    def join(self, user, seats=1):
+        mutation = 'mutation { joinWaitlist(tripId: %d, seats: %d) { created entry { id position } } }'
+        return self.post_graphql({'query': mutation % (self.trip.pk, seats)}, user=user).json()
+
+    def test_join_is_idempotent_and_ordered(self):
+        first = self.join(self.second_customer)['data']['joinWaitlist']
+        again = self.join(self.second_customer)['data']['joinWaitlist']
+        self.assertTrue(first['created'])
+        self.assertFalse(again['created'])
+        self.assertEqual(first['entry']['id'], again['entry']['id'])
+        self.assertEqual(again['entry']['position'], 1)
+        self.assertEqual(WaitlistEntry.objects.count(), 1)
+
+    def test_cancelling_a_booking_promotes_the_head(self):
+        self.join(self.second_customer)
+        response = self.post_graphql(
+            {'query': 'mutation { deleteBooking(id: %d) { ok } }' % self.booking.pk}, user=self.customer
+        )
+        self.assertTrue(response.json()['data']['deleteBooking']['ok'])
+
+        promoted = Booking.objects.get(trip=self.trip)
+        self.assertEqual(promoted.customer, self.second_customer)
+        self.assertFalse(WaitlistEntry.objects.exists())
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.available_seats, 0)
+
+    def test_head_that_does_not_fit_blocks_the_queue(self):
+        WaitlistEntry.objects.create(trip=self.trip, customer=self.second_customer, seats=2, sequence=1)
+        WaitlistEntry.objects.create(trip=self.trip, customer=self.manager, seats=1, sequence=2)
+        self.post_graphql({'query': 'mutation { deleteBooking(id: %d) { ok } }' % self.booking.pk}, user=self.customer)
+        self.assertFalse(Booking.objects.exists())
+        self.assertEqual(WaitlistEntry.objects.count(), 2)
+
+    def test_my_waitlist_positions_are_batched(self):
+        others = [
+            Trip.objects.create(
+                route=self.route, bus=self.bus, organizer=self.manager, driver=self.manager,
+                departure_time=self.trip.departure_time + timedelta(days=i), available_seats=0,
+            )
+            for i in (1, 2)
+        ]
+        for sequence, trip in enumerate([self.trip] + others, 1):
+            WaitlistEntry.objects.create(trip=trip, customer=self.manager, seats=1, sequence=1)
+            WaitlistEntry.objects.create(trip=trip, customer=self.second_customer, seats=1, sequence=1 + sequence)
+        self.client.force_login(self.second_customer)
+        # session + user + groups + entries + positions
+        with self.assertNumQueries(5):
+            result = self.post_graphql({'query': '{ myWaitlist { position } }'}).json()
+        self.assertEqual([entry['position'] for entry in result['data']['myWaitlist']], [2, 2, 2])
+
+    def test_join_rejected_when_seats_are_free(self):
+        self.booking.delete()
+        Trip.objects.filter(pk=self.trip.pk).update(available_seats=1)
+        result = self.join(self.second_customer)
+        self.assertIn('book them directly', result['errors'][0]['message'])
+
+
+class AssignmentConflictTests(GraphQLTestCase):
+
+    def create_trip_mutation(self, departure, driver=None, bus=None):
+        mutation = '''mutation($departure: DateTime!, $bus: ID!, $driver: ID!) {
+            createTrip(routeId: %d, busId: $bus, organizerId: %d, driverId: $driver,
+                       departureTime: $departure, availableSeats: 2) { trip { id } }
+        }''' % (self.route.pk, self.manager.pk)
+        variables = {
+            'departure': departure.isoformat(),
+            'bus': (bus or self.bus).pk,
+            'driver': (driver or self.manager).pk,
+        }
+        return self.post_graphql({'query': mutation, 'variables': variables}, user=self.manager).json()
+
+    def test_overlapping_bus_assignment_is_rejected(self):
+        result = self.create_trip_mutation(self.trip.departure_time + timedelta(hours=4))
+        self.assertIn('Bus %d is already assigned to trip %d' % (self.bus.pk, self.trip.pk), result['errors'][0]['message'])
+
+    def test_back_to_back_trips_are_allowed(self):
+        other_bus = Bus.objects.create(plate_number='XYZ-999', capacity=4, branch=self.origin)
+        result = self.create_trip_mutation(self.trip.departure_time + timedelta(hours=5), bus=other_bus)
+        self.assertNotIn('errors', result)
+
+    def test_crew_conflict_on_update(self):
+        crew_member = User.objects.create_user(username='crew1', password='crewpass', email='crew1@g.com')
+        self.trip.crew.add(crew_member)
+        other_bus = Bus.objects.create(plate_number='XYZ-999', capacity=4, branch=self.origin)
+        driver = User.objects.create_user(username='driver1', password='driverpass', email='driver1@g.com')
+        other = self.create_trip_mutation(self.trip.departure_time + timedelta(days=1), bus=other_bus, driver=driver)
+        other_id = other['data']['createTrip']['trip']['id']
+
+        mutation = 'mutation { updateTrip(id: %s, crewIds: [%d], departureTime: "%s") { trip { id } } }' % (
+            other_id, crew_member.pk, (self.trip.departure_time + timedelta(hours=1)).isoformat()
+        )
+        result = self.post_graphql({'query': mutation}, user=self.manager).json()
+        self.assertIn('Crew %d' % crew_member.pk, result['errors'][0]['message'])
+
+    def test_cancelled_trips_free_their_crew(self):
+        crew_member = User.objects.create_user(username='crew1', password='crewpass', email='crew1@g.com')
+        self.trip.crew.add(crew_member)
+        slot = TripSlot(None, self.trip.departure_time, self.trip.arrival_time, None, None, (crew_member.pk,))
+        self.assertEqual(len(find_conflicts([slot])), 1)
+        cancel_trips(Trip.objects.filter(pk=self.trip.pk))
+        self.assertEqual(find_conflicts([slot]), [])
+
+    def test_batch_check_uses_constant_queries(self):
+        start = self.trip.departure_time + timedelta(days=2)
+        slots = [
+            TripSlot(None, start + timedelta(hours=6 * i), start + timedelta(hours=6 * i + 5), self.bus.pk, self.manager.pk)
+            for i in range(50)
+        ]
+        slots.append(TripSlot(None, start, start + timedelta(hours=1), self.bus.pk, None))
+        with self.assertNumQueries(1):
+            conflicts = find_conflicts(slots)
+        self.assertEqual(len(conflicts), 1)
+        self.assertEqual(conflicts[0].resource, 'bus')
+
+
+class ArrivalTimeTests(GraphQLTestCase):
+
+    def test_arrival_time_is_stored_on_save(self):
+        self.assertEqual(self.trip.arrival_time, self.trip.departure_time + timedelta(hours=5))
+
+    def test_seat_updates_do_not_load_the_route(self):
+        trip = Trip.objects.get(pk=self.trip.pk)
+        trip.available_seats -= 1
+        # trip update + replaced change log entry + change log insert + version stamp
+        with self.assertNumQueries(4):
+            trip.save(update_fields=['available_seats'])
+
+    def test_route_duration_change_recomputes_arrivals(self):
+        mutation = 'mutation { updateRoute(id: %d, duration: "07:30:00") { route { duration } } }' % self.route.pk
+        result = self.post_graphql({'query': mutation}, user=self.manager).json()
+        self.assertEqual(result['data']['updateRoute']['route']['duration'], '07:30:00')
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.arrival_time, self.trip.departure_time + timedelta(hours=7, minutes=30))
+
+    def test_arrive_before_filter_and_arrival_ordering(self):
+        short_route = Route.objects.create(
+            origin=self.destination, destination=self.origin, duration=timedelta(hours=1), distance_km=60
+        )
+        early = Trip.objects.create(
+            route=short_route, bus=None, organizer=self.manager, driver=None,
+            departure_time=self.trip.departure_time + timedelta(hours=1), available_seats=4,
+        )
+        query = '{ allTrips(arrivesBefore: "%s", orderBy: ARRIVAL_ASC) { id } }' % (
+            (self.trip.departure_time + timedelta(hours=3)).isoformat()
+        )
+        result = self.post_graphql({'query': query}, user=self.manager).json()
+        self.assertEqual(result['data']['allTrips'], [{'id': str(early.pk)}])
+
+        result = self.post_graphql({'query': '{ allTrips(orderBy: ARRIVAL_ASC) { id } }'}, user=self.manager).json()
+        self.assertEqual([t['id'] for t in result['data']['allTrips']], [str(early.pk), str(self.trip.pk)])
+        result = self.post_graphql({'query': '{ allTrips { id } }'}, user=self.manager).json()
+        self.assertEqual([t['id'] for t in result['data']['allTrips']], [str(early.pk), str(self.trip.pk)])
+
+
+class MyAssignmentsTests(GraphQLTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        crew_group, _ = Group.objects.get_or_create(name='crew')
+        cls.worker = User.objects.create_user(username='worker', password='workerpass', email='worker@g.com')
+        cls.worker.groups.add(crew_group)
+        start = timezone.now() + timedelta(days=3)
+        cls.assigned = []
+        for i in range(5):
+            trip = Trip.objects.create(
+                route=cls.route, bus=None, organizer=cls.manager,
+                driver=cls.worker if i % 2 == 0 else cls.manager,
+                departure_time=start + timedelta(hours=i), available_seats=4,
+            )
+            if i < 3:
+                trip.crew.add(cls.worker)
+            if i != 3:
+                cls.assigned.append(trip)
+
+    def fetch(self, after=None, first=2, user=None):
+        query = '''query($from: DateTime!, $to: DateTime!, $after: String) {
+            myAssignments(from: $from, to: $to, first: %d, after: $after) {
+                trips { id } endCursor hasNextPage
+            }
+        }''' % first
+        variables = {
+            'from': timezone.now().isoformat(),
+            'to': (timezone.now() + timedelta(days=10)).isoformat(),
+            'after': after,
+        }
+        return self.post_graphql({'query': query, 'variables': variables}, user=user).json()['data']['myAssignments']
+
+    def test_pages_are_deduplicated_and_in_departure_order(self):
+        seen = []
+        after = None
+        while True:
+            page = self.fetch(after, user=self.worker)
+            seen.extend(trip['id'] for trip in page['trips'])
+            if not page['hasNextPage']:
+                break
+            after = page['endCursor']
+        self.assertEqual(seen, [str(trip.pk) for trip in self.assigned])
+
+    def test_cancelled_trips_do_not_shorten_pages(self):
+        cancel_trips(Trip.objects.filter(pk__in=[trip.pk for trip in self.assigned[:2]]))
+        page = self.fetch(first=2, user=self.worker)
+        self.assertEqual([trip['id'] for trip in page['trips']], [str(trip.pk) for trip in self.assigned[2:4]])
+        self.assertFalse(page['hasNextPage'])
+
+    def test_constant_number_of_queries(self):
+        self.client.force_login(self.worker)
+        # session + user + groups + union page + trips + crew prefetch
+        with self.assertNumQueries(6):
+            self.fetch(first=10)
+
+    def test_all_trips_for_crew_has_no_duplicates(self):
+        result = self.post_graphql({'query': '{ allTrips { id } }'}, user=self.worker).json()
+        ids = [trip['id'] for trip in result['data']['allTrips']]
+        self.assertEqual(sorted(ids), sorted(str(trip.pk) for trip in self.assigned))
+
+
+class FleetSolverTests(TestCase):
+    start = timezone.now().replace(microsecond=0)
+
+    def leg(self, trip_id, hours, origin, destination, seats=1, bus_id=None, duration=5):
+        departure = self.start + timedelta(hours=hours)
+        return TripLeg(trip_id, departure, departure + timedelta(hours=duration), origin, destination, seats, bus_id)
+
+    def test_chains_legs_and_prefers_buses_in_service(self):
+        buses = [FleetBus(1, 4, 10), FleetBus(2, 10, 10), FleetBus(3, 4, 10)]
+        trips = [
+            self.leg(1, 0, 10, 20, seats=3),
+            self.leg(2, 6, 20, 10, seats=3),
+            self.leg(3, 1, 10, 20, seats=8),
+            self.leg(4, 2, 10, 20, seats=9),
+            self.leg(5, 12, 10, 20, seats=2),
+        ]
+        plan = solve(buses, trips, [], timedelta(minutes=30))
+        self.assertEqual(plan.assignments, {1: 1, 2: 1, 3: 2, 5: 1})
+        self.assertEqual(list(plan.unassigned), [4])
+        self.assertEqual(plan.buses_used, 2)
+
+    def test_respects_existing_trips_and_turnaround(self):
+        buses = [FleetBus(1, 4, 10)]
+        fixed = [self.leg(100, 5, 10, 20, bus_id=1)]
+        trips = [
+            self.leg(1, 0, 10, 20),  # would leave the bus at 20 before its fixed trip from 10
+            self.leg(2, 10, 20, 10),  # fixed trip arrives at 10:00, turnaround ends 10:30
+            self.leg(3, 11, 20, 10),
+        ]
+        plan = solve(buses, trips, fixed, timedelta(minutes=30))
+        self.assertEqual(plan.assignments, {3: 1})
+        self.assertEqual(set(plan.unassigned), {1, 2})
+
+
+class AssignBusesTests(GraphQLTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.back_route = Route.objects.create(
+            origin=cls.destination, destination=cls.origin, duration=timedelta(hours=5), distance_km=350,
+        )
+        cls.return_trip = Trip.objects.create(
+            route=cls.back_route, bus=None, organizer=cls.manager, driver=cls.manager,
+            departure_time=cls.trip.departure_time + timedelta(hours=6), available_seats=4,
+        )
+        cls.clashing_trip = Trip.objects.create(
+            route=cls.route, bus=None, organizer=cls.manager, driver=cls.manager,
+            departure_time=cls.trip.departure_time + timedelta(hours=1), available_seats=4,
+        )
+
+    def assign(self, dry_run):
+        query = """mutation($branch: ID!, $from: DateTime!, $to: DateTime!, $dryRun: Boolean) {
+            assignBuses(branchId: $branch, from: $from, to: $to, dryRun: $dryRun) {
+                plan {
+                    assignments { trip { id } bus { id } }
+                    unassigned { trip { id } reason }
+                    busesUsed committed
+                }
+            }
+        }"""
+        variables = {
+            'branch': self.origin.pk,
+            'from': timezone.now().isoformat(),
+            'to': (timezone.now() + timedelta(days=3)).isoformat(),
+            'dryRun': dry_run,
+        }
+        result = self.post_graphql({'query': query, 'variables': variables}, user=self.manager).json()
+        return result['data']['assignBuses']['plan']
+
+    def test_dry_run_returns_diff_without_writing(self):
+        plan = self.assign(dry_run=True)
+        self.assertEqual(plan['assignments'], [{'trip': {'id': str(self.return_trip.pk)}, 'bus': {'id': str(self.bus.pk)}}])
+        self.assertEqual([entry['trip']['id'] for entry in plan['unassigned']], [str(self.clashing_trip.pk)])
+        self.assertEqual(plan['busesUsed'], 1)
+        self.assertFalse(plan['committed'])
+        self.return_trip.refresh_from_db()
+        self.assertIsNone(self.return_trip.bus_id)
+
+    def test_commit_assigns_buses(self):
+        plan = self.assign(dry_run=False)
+        self.assertTrue(plan['committed'])
+        self.return_trip.refresh_from_db()
+        self.clashing_trip.refresh_from_db()
+        self.assertEqual(self.return_trip.bus_id, self.bus.pk)
+        self.assertIsNone(self.clashing_trip.bus_id)
+
+
+class IdempotencyTests(GraphQLTestCase):
+    create_city = {'query': 'mutation { createCity(name: "Homs") { city { id name } } }'}
+
+    def setUp(self):
+        super().setUp()
+        get_store().clear()
+
+    def test_replay_returns_stored_result_without_executing(self):
+        first = self.post_graphql(self.create_city, user=self.manager, HTTP_IDEMPOTENCY_KEY='abc')
+        second = self.post_graphql(self.create_city, user=self.manager, HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(City.objects.filter(name='Homs').count(), 1)
+
+        other = self.post_graphql(self.create_city, user=self.manager, HTTP_IDEMPOTENCY_KEY='other')
+        self.assertIn('errors', other.json())
+
+    def test_key_reused_for_another_operation_is_rejected(self):
+        self.post_graphql(self.create_city, user=self.manager, HTTP_IDEMPOTENCY_KEY='abc')
+        response = self.post_graphql(
+            {'query': 'mutation { createCity(name: "Hama") { city { id } } }'},
+            user=self.manager, HTTP_IDEMPOTENCY_KEY='abc',
+        )
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(City.objects.filter(name='Hama').exists())
+
+    def test_batch_operations_are_keyed_by_position(self):
+        batch = [self.create_city, {'query': 'mutation { createCity(name: "Hama") { city { id } } }'}]
+        first = self.post_graphql(batch, user=self.manager, HTTP_IDEMPOTENCY_KEY='batch')
+        second = self.post_graphql(batch, user=self.manager, HTTP_IDEMPOTENCY_KEY='batch')
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(City.objects.filter(name__in=['Homs', 'Hama']).count(), 2)
+
+    @override_settings(TRANSPORT={'IDEMPOTENCY_WAIT_SECONDS': 0})
+    def test_duplicate_of_in_flight_request_times_out(self):
+        get_store().set(
+            store_key(self.manager.pk, 'abc'),
+            {'state': PENDING, 'operation': fingerprint(self.create_city['query'], None, None)},
+        )
+        response = self.post_graphql(self.create_city, user=self.manager, HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(City.objects.filter(name='Homs').exists())
+
+    def test_queries_are_not_stored(self):
+        self.post_graphql({'query': '{ allCities { name } }'}, user=self.manager, HTTP_IDEMPOTENCY_KEY='abc')
+        response = self.post_graphql(self.create_city, user=self.manager, HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(City.objects.filter(name='Homs').exists())
+
+
+@override_settings(TRANSPORT={'RATE_LIMITS': {'anonymous': (1, 1), 'customer': (1, 3), 'manager': None}})
+class RateLimitTests(GraphQLTestCase):
+    query = {'query': '{ allTrips { id } }'}
+
+    def setUp(self):
+        super().setUp()
+        # A fresh backend instance, so no buckets are left from other tests
+        load_backend.cache_clear()
+
+    def test_customer_is_throttled_with_retry_after(self):
+        self.client.force_login(self.customer)
+        for _ in range(3):
+            self.assertEqual(self.post_graphql(self.query).status_code, 200)
+        response = self.post_graphql(self.query)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertIn('Too many requests', response.json()['errors'][0]['message'])
+
+    def test_batch_costs_one_token_per_operation(self):
+        self.client.force_login(self.customer)
+        self.assertEqual(self.post_graphql([self.query] * 3).status_code, 200)
+        self.assertEqual(self.post_graphql(self.query).status_code, 429)
+
+    def test_manager_is_not_limited(self):
+        self.client.force_login(self.manager)
+        for _ in range(5):
+            self.assertEqual(self.post_graphql(self.query).status_code, 200)
+
+    def test_local_backend_stays_bounded(self):
+        backend = LocalBackend()
+        backend.max_keys = 3
+        for i in range(5):
+            # Drained buckets never refill in time to be pruned as full
+            backend.consume(f'client{i}', 1, 2, 2, 100.0)
+        self.assertEqual(list(backend.buckets), ['client2', 'client3', 'client4'])
+        backend.consume('client2', 1, 2, 1, 100.0)
+        backend.consume('client5', 1, 2, 2, 100.0)
+        self.assertEqual(list(backend.buckets), ['client4', 'client2', 'client5'])
+
+    def test_most_generous_role_wins(self):
+        self.assertIsNone(limit_for({'customer', 'manager'}, True))
+        self.assertEqual(limit_for(frozenset(), True), (1, 3))
+        self.assertEqual(limit_for({'driver'}, True), None)
+        self.assertEqual(limit_for(frozenset(), False), (1, 1))
+
+
+class ChangeFeedTests(GraphQLTestCase):
+    query = """query($version: BigInt!, $first: Int) {
+        changesSince(version: $version, first: $first) {
+            version hasMore
+            cities { id } branches { id } buses { id } routes { id } trips { id version }
+            deleted { kind id }
+        }
+    }"""
+
+    def changes(self, version, first=100):
+        variables = {'version': version, 'first': first}
+        result = self.post_graphql({'query': self.query, 'variables': variables}, user=self.manager).json()
+        return result['data']['changesSince']
+
+    def test_full_sync_from_zero(self):
+        changes = self.changes(0)
+        self.assertEqual(len(changes['cities']), 2)
+        self.assertEqual(len(changes['branches']), 2)
+        self.assertEqual(changes['trips'], [{'id': str(self.trip.pk), 'version': self.trip.version}])
+        self.assertEqual(changes['version'], ChangeLog.objects.latest('pk').pk)
+        self.assertFalse(changes['hasMore'])
+
+    def test_only_changes_after_version_are_returned(self):
+        version = self.changes(0)['version']
+        self.assertEqual(self.changes(version)['trips'], [])
+
+        self.trip.available_seats = 3
+        self.trip.save()
+        self.trip.save()
+        other = Trip.objects.create(
+            route=self.route, bus=None, organizer=self.manager, driver=self.manager,
+            departure_time=self.trip.departure_time + timedelta(days=1), available_seats=4,
+        )
+        other_id = other.pk
+        self.post_graphql({'query': 'mutation { deleteTrip(id: %d) { ok } }' % other_id}, user=self.manager)
+
+        changes = self.changes(version)
+        self.assertEqual([trip['id'] for trip in changes['trips']], [str(self.trip.pk)])
+        self.assertEqual(changes['deleted'], [{'kind': 'trip', 'id': str(other_id)}])
+        self.assertEqual(changes['cities'], [])
+
+    def test_entries_committed_out_of_id_order_are_not_skipped(self):
+        version = self.changes(0)['version']
+        # An entry with a low id whose writer committed after the first sync
+        late = ChangeLog.objects.filter(kind='city').order_by('pk').first()
+        ChangeLog.objects.filter(pk=late.pk).update(position=None)
+
+        changes = self.changes(version)
+        self.assertEqual(changes['cities'], [{'id': str(late.object_id)}])
+        self.assertGreater(int(changes['version']), version)
+
+    def test_repeated_saves_keep_one_entry(self):
+        for seats in (3, 2, 1):
+            self.trip.available_seats = seats
+            self.trip.save(update_fields=['available_seats'])
+        self.assertEqual(ChangeLog.objects.filter(kind='trip', object_id=self.trip.pk).count(), 1)
+
+    def test_pages_and_tombstones_for_scheduled_deletion(self):
+        version = self.changes(0)['version']
+        self.post_graphql({'query': 'mutation { deleteBranch(id: %d) { ok } }' % self.destination.pk}, user=self.manager)
+
+        first_page = self.changes(version, first=1)
+        self.assertTrue(first_page['hasMore'])
+        second_page = self.changes(first_page['version'], first=10)
+        self.assertFalse(second_page['hasMore'])
+        self.assertEqual(
+            first_page['deleted'] + second_page['deleted'],
+            [{'kind': 'branch', 'id': str(self.destination.pk)}, {'kind': 'route', 'id': str(self.route.pk)}],
+        )
+
+
+class TimetableSnapshotTests(GraphQLTestCase):
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        settings_override = override_settings(TRANSPORT={'TIMETABLE_ROOT': self.root})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def read(self, name, **headers):
+        return self.client.get(f'/timetable/{name}', **headers)
+
+    def test_only_changed_partitions_are_rewritten(self):
+        self.assertEqual(build_snapshot(), {'written': 1, 'kept': 0, 'retired': 0})
+        self.assertEqual(build_snapshot(), {'written': 0, 'kept': 1, 'retired': 0})
+
+        self.trip.available_seats = 2
+        self.trip.save()
+        self.assertEqual(build_snapshot(), {'written': 1, 'kept': 0, 'retired': 1})
+        index = json.loads(self.read('index.json').content)
+        day = self.trip.departure_time.astimezone(datetime_timezone.utc).date().isoformat()
+        partition = json.loads(self.read(index['routes'][0]['days'][day]).content)
+        self.assertEqual(partition['trips'][0][index['trip_fields'].index('available_seats')], 2)
+
+        # The replaced file is kept for one more build, then removed with its ETag
+        files = sum(len(names) for _, _, names in os.walk(self.root))
+        build_snapshot()
+        self.assertEqual(sum(len(names) for _, _, names in os.walk(self.root)), files - 2)
+
+    def test_bus_capacity_change_rewrites_the_partition(self):
+        build_snapshot()
+        self.bus.capacity = 6
+        self.bus.save()
+        self.assertEqual(build_snapshot(), {'written': 1, 'kept': 0, 'retired': 1})
+
+    def test_served_with_strong_etag_and_gzip(self):
+        build_snapshot()
+        response = self.read('index.json', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        index = json.loads(gzip.decompress(response.content))
+        self.assertEqual(index['routes'][0]['destination']['city'], 'Aleppo')
+
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        with open(os.path.join(self.root, 'index.json.etag')) as handle:
+            self.assertEqual(etag, f'"{handle.read()}"')
+        self.assertEqual(self.read('index.json', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertNotEqual(self.read('index.json')['ETag'], etag)
+        self.assertEqual(self.read('state.json').status_code, 404)
+        self.assertEqual(self.read('../settings.py').status_code, 404)
+
+
+class PlaceSuggestionTests(GraphQLTestCase):
+
+    def test_prefix_matches_rank_before_word_and_typo_matches(self):
+        index = PlaceIndex([
+            Place('city', 1, 'Damascus', 'Damascus'),
+            Place('branch', 2, 'Old Damascus Gate', 'Damascus'),
+            Place('city', 3, 'Dara', 'Dara'),
+            Place('city', 4, 'Hama', 'Hama'),
+        ])
+        self.assertEqual([place.id for place in index.search('dam')], [1, 2])
+        self.assertEqual([place.id for place in index.search('da', limit=2)], [3, 1])
+        self.assertEqual([place.id for place in index.search('Damscus')][:2], [1, 2])
+        self.assertEqual([place.id for place in index.search('HÁMA')], [4])
+        self.assertEqual(index.search('  '), [])
+
+    def test_query_sees_new_places_after_mutation(self):
+        query = '{ suggestPlaces(prefix: "hom") { kind id name city } }'
+        self.assertEqual(self.post_graphql({'query': query}, user=self.customer).json()['data']['suggestPlaces'], [])
+
+        self.post_graphql({'query': 'mutation { createCity(name: "Homs") { city { id } } }'}, user=self.manager)
+        self.post_graphql({'query': 'mutation { createBranch(name: "Homs Central", cityId: %d) { branch { id } } }'
+                           % City.objects.get(name='Homs').pk})
+        places = self.post_graphql({'query': query}).json()['data']['suggestPlaces']
+        self.assertEqual([(place['kind'], place['name'], place['city']) for place in places], [
+            ('city', 'Homs', 'Homs'), ('branch', 'Homs Central', 'Homs'),
+        ])
+
+
+class NearestBranchTests(GraphQLTestCase):
+
+    def test_haversine_paths_agree(self):
+        # Damascus to Aleppo is about 310 km in a straight line
+        self.assertAlmostEqual(haversine_km(33.51, 36.29, 36.20, 37.13), 309.6, delta=1)
+        lats = [33.51, 0.0, 89.9]
+        lons = [36.29, 179.9, 0.0]
+        many = haversine_many_km(lats, lons, [36.20, 0.0, 89.9], [37.13, -179.9, 180.0])
+        for got, expected in zip(many, [haversine_km(33.51, 36.29, 36.20, 37.13),
+                                        haversine_km(0.0, 179.9, 0.0, -179.9),
+                                        haversine_km(89.9, 0.0, 89.9, 180.0)]):
+            self.assertAlmostEqual(got, expected, places=6)
+        self.assertEqual(
+            [key for key, _, _ in implausible_distances([
+                ('ok', 350, 33.51, 36.29, 36.20, 37.13),
+                ('short', 100, 33.51, 36.29, 36.20, 37.13),
+                ('unknown', 5, None, None, 36.20, 37.13),
+            ])],
+            ['short'],
+        )
+
+    def test_grid_search_is_exact_and_wraps_the_antimeridian(self):
+        grid = BranchGrid()
+        grid.upsert(1, 33.51, 36.29)
+        grid.upsert(2, 33.60, 36.40)
+        grid.upsert(3, 36.20, 37.13)
+        grid.upsert(4, 0.0, 179.95)
+        self.assertEqual([branch_id for branch_id, _ in grid.nearest(33.5, 36.3, 50, 10)], [1, 2])
+        self.assertEqual([branch_id for branch_id, _ in grid.nearest(33.5, 36.3, 400, 1)], [1])
+        self.assertEqual([branch_id for branch_id, _ in grid.nearest(0.0, -179.95, 20, 10)], [4])
+        grid.upsert(1, 36.21, 37.14)
+        grid.remove(2)
+        self.assertEqual([branch_id for branch_id, _ in grid.nearest(36.2, 37.13, 10, 10)], [3, 1])
+        self.assertEqual(grid.nearest(33.5, 36.3, 50, 10), [])
+
+    def test_full_circle_search_visits_each_cell_once(self):
+        grid = BranchGrid()
+        grid.upsert(1, 85.0, -179.9)
+        grid.upsert(2, 85.0, -179.6)
+        self.assertEqual([branch_id for branch_id, _ in grid.nearest(85.0, 0.0, 2000, 10)], [2, 1])
+
+    def test_query_follows_branch_mutations(self):
+        query = '{ nearestBranches(lat: 33.5, lon: 36.3, radiusKm: 25) { branch { name } distanceKm } }'
+        self.assertEqual(self.post_graphql({'query': query}, user=self.customer).json()['data']['nearestBranches'], [])
+
+        self.post_graphql({'query': 'mutation { updateBranch(id: %d, latitude: 33.51, longitude: 36.29) { branch { id } } }'
+                           % self.origin.pk}, user=self.manager)
+        result = self.post_graphql({'query': query}).json()['data']['nearestBranches']
+        self.assertEqual([entry['branch']['name'] for entry in result], ['Central'])
+        self.assertLess(result[0]['distanceKm'], 2)
+
+        self.post_graphql({'query': 'mutation { deleteBranch(id: %d) { ok } }' % self.origin.pk})
+        self.assertEqual(self.post_graphql({'query': query}).json()['data']['nearestBranches'], [])
+
+    def test_route_distance_is_checked_against_coordinates(self):
+        Branch.objects.filter(pk=self.origin.pk).update(latitude=33.51, longitude=36.29)
+        Branch.objects.filter(pk=self.destination.pk).update(latitude=36.20, longitude=37.13)
+        result = self.post_graphql({'query': 'mutation { createRoute(originId: %d, destinationId: %d, '
+                                    'duration: "05:00:00", distanceKm: 100) { route { id } } }'
+                                    % (self.origin.pk, self.destination.pk)}, user=self.manager).json()
+        self.assertIn('implausible', result['errors'][0]['message'])
+
+        self.route.distance_km = 100
+        self.route.save()
+        with self.assertRaises(CommandError):
+            call_command('check_route_distances', stdout=StringIO())
+
+
+class SeatMapTests(GraphQLTestCase):
+    classes = [
+        ['business', '', 'business', 'business'],
+        ['economy', 'economy', 'economy', 'economy'],
+        ['economy', 'economy', 'economy', 'economy'],
+    ]
+
+    def test_runs_break_at_aisle_gaps_and_class_changes(self):
+        plan = SeatPlan(3, 4, 2, self.classes)
+        self.assertEqual(len(plan.seats), 11)
+        self.assertEqual(plan.runs, [(1,), (2, 3), (4, 5), (6, 7), (8, 9), (10, 11)])
+        self.assertEqual(plan.adjacent(2, {5, 8}), [(2, 3), (6, 7), (10, 11)])
+        self.assertEqual(plan.adjacent(2, set(), seat_class='business'), [(2, 3)])
+        self.assertEqual(plan.adjacent(3, set()), [])
+
+    def test_seat_map_with_layout(self):
+        layout = self.post_graphql({'query': """mutation($classes: [[String]]!) {
+            createSeatLayout(name: "Coach 11", rows: 3, columns: 4, aisleAfter: 2, seatClasses: $classes) {
+                layout { id }
+            }
+        }""", 'variables': {'classes': self.classes}}, user=self.manager).json()['data']['createSeatLayout']['layout']
+        result = self.post_graphql({'query': 'mutation { updateBus(id: %d, layoutId: %s) { bus { capacity } } }'
+                                    % (self.bus.pk, layout['id'])}).json()
+        self.assertEqual(result['data']['updateBus']['bus']['capacity'], 11)
+        Booking.objects.create(customer=self.customer, trip=self.trip, seat_number=2)
+        Booking.objects.create(customer=self.customer, trip=self.trip, seat_number=6)
+
+        query = '{ seatMap(tripId: %d) { classes { seatClass total booked available } } }' % self.trip.pk
+        self.post_graphql({'query': '{ allCities { id } }'}, user=self.customer)
+        # session + user + groups + trip with bus and layout + one aggregate
+        with self.assertNumQueries(5):
+            classes = self.post_graphql({'query': query}).json()['data']['seatMap']['classes']
+        self.assertEqual(classes, [
+            {'seatClass': 'business', 'total': 3, 'booked': 1, 'available': 2},
+            {'seatClass': 'economy', 'total': 8, 'booked': 1, 'available': 7},
+        ])
+
+        seat_map = self.post_graphql({'query': """{ seatMap(tripId: %d) {
+            rows columns aisleAfter seats { number row column booked } adjacentSeats(count: 2, seatClass: "economy")
+        } }""" % self.trip.pk}).json()['data']['seatMap']
+        self.assertEqual(seat_map['seats'][1], {'number': 2, 'row': 1, 'column': 3, 'booked': True})
+        self.assertEqual(seat_map['adjacentSeats'], [[4, 5], [8, 9], [10, 11]])
+
+    def test_bus_without_layout_gets_default_map(self):
+        seat_map = self.post_graphql({'query': '{ seatMap(tripId: %d) { rows seats { number } '
+                                      'adjacentSeats(count: 2) } }' % self.trip.pk}, user=self.customer).json()
+        self.assertEqual(seat_map['data']['seatMap'], {
+            'rows': 1, 'seats': [{'number': n} for n in range(1, 5)], 'adjacentSeats': [[1, 2], [3, 4]],
+        })
+
+
+class ReconcileSeatsTests(GraphQLTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.trips = [cls.trip] + [
+            Trip.objects.create(
+                route=cls.route, bus=cls.bus, organizer=cls.manager, driver=cls.manager,
+                departure_time=cls.trip.departure_time + timedelta(days=i), available_seats=seats,
+            )
+            for i, seats in ((1, 4), (2, 3), (3, 2))
+        ]
+        for trip in cls.trips[:3]:
+            Booking.objects.create(customer=cls.customer, trip=trip, seat_number=1)
+
+    def seats(self):
+        return [trip.available_seats for trip in Trip.objects.order_by('pk')]
+
+    def test_only_missing_seats_are_removed_by_default(self):
+        out = StringIO()
+        call_command('reconcile_seats', '--chunk-size', '2', stdout=out)
+        # capacity 4 with one booking leaves 3 free; an offer of 2 on an empty trip is kept
+        self.assertEqual(self.seats(), [3, 3, 3, 2])
+        self.assertIn('2 trip(s) corrected in 2 chunk(s)', out.getvalue())
+        self.assertEqual(ChangeLog.objects.filter(kind='trip', object_id=self.trips[1].pk).count(), 1)
+
+    def test_full_capacity_and_dry_run(self):
+        out = StringIO()
+        call_command('reconcile_seats', '--full-capacity', '--dry-run', stdout=out)
+        self.assertIn('3 trip(s) would be corrected', out.getvalue())
+        self.assertEqual(self.seats(), [4, 4, 3, 2])
+
+        call_command('reconcile_seats', '--full-capacity', stdout=StringIO())
+        self.assertEqual(self.seats(), [3, 3, 3, 4])
+
+    def test_background_job(self):
+        call_command('reconcile_seats', '--background', stdout=StringIO())
+        job = claim_next_job('test-worker')
+        run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.progress['fixed'], 2)
+
+
+class SingleFlightTests(GraphQLTestCase):
+
+    def test_concurrent_calls_share_one_computation(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'value'
+
+        leader = threading.Thread(target=lambda: results.append(flight.do('key', compute)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flight.do('key', compute))) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+
+        self.assertEqual(results, ['value'] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_errors_are_not_cached_and_forget_drops_results(self):
+        flight = SingleFlight()
+        with self.assertRaises(KeyError):
+            flight.do('key', lambda: {}['missing'])
+        self.assertEqual(flight.do('key', lambda: 1), 1)
+        self.assertEqual(flight.do('key', lambda: 2), 1)
+        flight.forget('key')
+        self.assertEqual(flight.do('key', lambda: 3), 3)
+        with self.settings(TRANSPORT={'SINGLE_FLIGHT_TTL_MS': 0}):
+            flight.forget('key')
+            self.assertEqual(flight.do('key', lambda: 4), 4)
+            self.assertEqual(flight.do('key', lambda: 5), 5)
+
+    def test_booking_invalidates_the_cached_trip(self):
+        query = {'query': '{ trip(id: %d) { availableSeats availableSeatNumbers } }' % self.trip.pk}
+        first = self.post_graphql(query, user=self.manager).json()['data']['trip']
+        self.assertEqual(first, {'availableSeats': 4, 'availableSeatNumbers': [1, 2, 3, 4]})
+
+        with self.assertNumQueries(0):
+            hot_reads.do(('trip', self.trip.pk), lambda: self.fail('trip was fetched again'))
+
+        self.post_graphql(
+            {'query': 'mutation { createBooking(tripId: %d, seatNumber: 2) { booking { id } } }' % self.trip.pk},
+            user=self.customer,
+        )
+        second = self.post_graphql(query, user=self.manager).json()['data']['trip']
+        self.assertEqual(second, {'availableSeats': 3, 'availableSeatNumbers': [1, 3, 4]})
+
+
+class ListFastPathTests(GraphQLTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Booking.objects.create(customer=cls.customer, trip=cls.trip, seat_number=2)
+
+    def fetch_both(self, query):
+        fast = self.post_graphql({'query': query}, user=self.manager).json()
+        with self.settings(TRANSPORT={'LIST_FAST_PATH': False}):
+            slow = self.post_graphql({'query': query}, user=self.manager).json()
+        self.assertNotIn('errors', fast)
+        self.assertEqual(fast, slow)
+        return fast['data']
+
+    def test_flat_selections_match_the_model_path(self):
+        data = self.fetch_both(
+            '{ allTrips { id departureTime availableSeats availableSeatNumbers route { id } bus { id } '
+            '... on TripType { driver { id __typename } } } }'
+        )
+        self.assertEqual(data['allTrips'][0]['availableSeatNumbers'], [1, 3, 4])
+        self.fetch_both('{ allBookings { id seatNumber bookedAt trip { id } customer { id } } }')
+        self.fetch_both('{ customerBookings(customerId: %d) { seatNumber trip { id } } }' % self.customer.pk)
+
+    def test_rows_fetch_selected_columns_and_nested_fields_fall_back(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.post_graphql({'query': '{ allBookings { id trip { id } } }'}, user=self.manager)
+        booking_sql = [query['sql'] for query in queries if 'transport_booking' in query['sql']]
+        self.assertEqual(len(booking_sql), 1)
+        # only the two selected columns, none of the select_related trip columns
+        self.assertIn('SELECT "transport_booking"."id" AS "id", "transport_booking"."trip_id" AS "trip_id" FROM', booking_sql[0])
+
+        data = self.fetch_both('{ allTrips { id route { id distanceKm } } }')
+        self.assertEqual(data['allTrips'][0]['route']['distanceKm'], 350.0)
+
+
+class ImportNetworkTests(GraphQLTestCase):
+
+    CSV = (
+        'kind,name,city,branch,latitude,longitude,plate_number,capacity,origin_city,origin,'
+        'destination_city,destination,duration,distance_km\n'
+        'city,Homs,,,,,,,,,,,,\n'
+        'branch,East,homs,,34.73,36.71,,,,,,,,\n'
+        'branch,West,Atlantis,,,,,,,,,,,\n'
+        'bus,,Homs,East,,,XYZ-1,40,,,,,,\n'
+        'bus,,Damascus,central,,,abc-123,6,,,,,,\n'
+        'route,,,,,,,,Homs,East,Damascus,Central,2:00:00,160\n'
+        'route,,,,,,,,Damascus,Central,Aleppo,North,6:00,350\n'
+        'planet,Mars,,,,,,,,,,,,\n'
+    )
+
+    def import_csv(self, *args):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(self.CSV)
+        self.addCleanup(os.unlink, f.name)
+        out, err = StringIO(), StringIO()
+        with self.assertRaises(CommandError) as raised:
+            call_command('import_network', f.name, *args, stdout=out, stderr=err)
+        return str(raised.exception), err.getvalue()
+
+    def test_command_upserts_by_natural_key_and_reports_bad_rows(self):
+        summary, errors = self.import_csv('--batch-size', '3')
+        self.assertEqual(summary, '4 created, 1 updated, 0 unchanged, 3 rejected.')
+        self.assertIn(":4: City 'Atlantis' not found.", errors)
+        self.assertIn(':8: Invalid duration format. Use HH:MM:SS.', errors)
+        self.assertIn(":9: Unknown kind 'planet'", errors)
+
+        east = Branch.objects.get(name='East')
+        self.assertEqual((east.city.name, east.latitude), ('Homs', 34.73))
+        self.assertEqual(Bus.objects.get(plate_number='XYZ-1').branch, east)
+        self.bus.refresh_from_db()
+        self.assertEqual(self.bus.capacity, 6)
+        self.assertEqual(Bus.objects.count(), 2)
+        self.assertEqual(Route.objects.get(origin=east).duration, timedelta(hours=2))
+        self.assertTrue(ChangeLog.objects.filter(kind='bus', object_id=self.bus.pk).exists())
+
+        summary, _ = self.import_csv()
+        self.assertEqual(summary, '0 created, 0 updated, 5 unchanged, 3 rejected.')
+
+    def test_dry_run_saves_nothing(self):
+        summary, _ = self.import_csv('--dry-run')
+        self.assertTrue(summary.startswith('Dry run: 4 created'))
+        self.assertFalse(City.objects.filter(name='Homs').exists())
+
+    def test_mutation_imports_json_lines(self):
+        data = '\n'.join([
+            '{"kind": "route", "origin_city": "Damascus", "origin": "Central",'
+            ' "destination_city": "Aleppo", "destination": "North", "duration": "04:00:00", "distance_km": 350}',
+            '{"kind": "bus", "plate_number": "NEW-1", "capacity": 0, "city": "Damascus", "branch": "Central"}',
+            'not json',
+        ])
+        mutation = '''mutation($data: String!) { importNetwork(data: $data, format: JSONL) {
+            report { created updated unchanged committed errors { line message } } } }'''
+        response = self.post_graphql({'query': mutation, 'variables': {'data': data}}, user=self.manager)
+        report = response.json()['data']['importNetwork']['report']
+        self.assertEqual((report['created'], report['updated'], report['committed']), (0, 1, True))
+        self.assertEqual([error['line'] for error in report['errors']], [2, 3])
+
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.arrival_time, self.trip.departure_time + timedelta(hours=4))
+
+
+class LargeTableAdminTests(GraphQLTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass', email='admin@g.com')
+        self.client.force_login(self.admin)
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelists_do_not_query_per_row(self):
+        for url in ('/admin/transport/booking/', '/admin/transport/trip/', '/admin/accounts/customuser/'):
+            Booking.objects.create(customer=self.customer, trip=self.trip, seat_number=Booking.objects.count() + 1)
+            before = self.changelist_queries(url)
+            for _ in range(2):
+                trip = Trip.objects.create(
+                    route=self.route, bus=self.bus, organizer=self.manager, driver=self.manager,
+                    departure_time=self.trip.departure_time, available_seats=4,
+                )
+                user = User.objects.create_user(username=f'u{trip.pk}', email=f'u{trip.pk}@g.com')
+                Booking.objects.create(customer=user, trip=trip, seat_number=1)
+            self.assertEqual(self.changelist_queries(url), before, url)
+
+    def test_changelists_list_cancelled_rows(self):
+        booking = Booking.objects.create(customer=self.customer, trip=self.trip, seat_number=1)
+        cancel_trips(Trip.objects.filter(pk=self.trip.pk))
+        response = self.client.get('/admin/transport/trip/')
+        self.assertContains(response, f'/admin/transport/trip/{self.trip.pk}/change/')
+        response = self.client.get('/admin/transport/booking/')
+        self.assertContains(response, f'/admin/transport/booking/{booking.pk}/change/')
+
+    def test_booking_form_uses_raw_id_widgets(self):
+        booking = Booking.objects.create(customer=self.customer, trip=self.trip, seat_number=1)
+        response = self.client.get(f'/admin/transport/booking/{booking.pk}/change/')
+        self.assertContains(response, 'vForeignKeyRawIdAdminField')
+        self.assertNotContains(response, '<select name="trip"')
+
+
+class CancelTripsTests(GraphQLTestCase):
+
+    MUTATION = '''mutation($filter: TripFilterInput!) { cancelTrips(filter: $filter, reason: "Road closed") {
+        result { cancelledTrips cancelledBookings notifiedCustomers } } }'''
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.second_customer = User.objects.create_user(username='second', password='secondpass', email='second@g.com')
+        cls.later = Trip.objects.create(
+            route=cls.route, bus=cls.bus, organizer=cls.manager, driver=cls.manager,
+            departure_time=cls.trip.departure_time + timedelta(hours=2), available_seats=2,
+        )
+        cls.next_day = Trip.objects.create(
+            route=cls.route, bus=cls.bus, organizer=cls.manager, driver=cls.manager,
+            departure_time=cls.trip.departure_time + timedelta(days=1), available_seats=4,
+        )
+        for trip, customer, seat in ((cls.trip, cls.customer, 1), (cls.trip, cls.customer, 2),
+                                     (cls.later, cls.customer, 1), (cls.next_day, cls.second_customer, 1)):
+            Booking.objects.create(customer=customer, trip=trip, seat_number=seat)
+        WaitlistEntry.objects.create(trip=cls.later, customer=cls.second_customer, seats=1, sequence=1)
+
+    def cancel(self, **filter):
+        response = self.post_graphql({'query': self.MUTATION, 'variables': {'filter': filter}}, user=self.manager)
+        return response.json()
+
+    def test_cancels_a_route_window_with_one_notification_per_customer(self):
+        start = self.trip.departure_time - timedelta(minutes=1)
+        result = self.cancel(
+            routeId=self.route.pk, departsAfter=start.isoformat(), departsBefore=(start + timedelta(hours=12)).isoformat()
+        )['data']['cancelTrips']['result']
+        self.assertEqual(result, {'cancelledTrips': 2, 'cancelledBookings': 3, 'notifiedCustomers': 2})
+
+        self.assertEqual(list(Trip.objects.values_list('pk', flat=True)), [self.next_day.pk])
+        self.assertEqual(Trip.all_objects.get(pk=self.later.pk).available_seats, 0)
+        self.assertEqual(Booking.objects.filter(cancelled_at__isnull=False).count(), 3)
+        self.assertFalse(WaitlistEntry.objects.exists())
+
+        jobs = Job.objects.filter(name='notify_trip_cancellation').order_by('pk')
+        self.assertEqual(sorted(len(job.payload['trip_ids']) for job in jobs), [1, 2])
+        while (job := claim_next_job('test-worker')) is not None:
+            run_job(job)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['customer@g.com', 'second@g.com'])
+        self.assertIn('Reason: Road closed', mail.outbox[0].body)
+
+        bookings = self.post_graphql({'query': '{ myBookings { cancelledAt trip { cancelledAt } } }'},
+                                     user=self.customer).json()['data']['myBookings']
+        self.assertTrue(all(booking['cancelledAt'] and booking['trip']['cancelledAt'] for booking in bookings))
+
+    def test_bookings_of_a_cancelled_trip_cannot_be_deleted(self):
+        booking = Booking.objects.filter(trip=self.trip).first()
+        self.cancel(ids=[self.trip.pk])
+        response = self.post_graphql({'query': 'mutation { deleteBooking(id: %d) { ok } }' % booking.pk},
+                                     user=self.customer).json()
+        self.assertIn('cancelled with its trip', response['errors'][0]['message'])
+        self.assertTrue(Booking.objects.filter(pk=booking.pk).exists())
+
+    def test_filter_must_be_bounded(self):
+        result = self.cancel(routeId=self.route.pk)
+        self.assertIn('Give trip ids', result['errors'][0]['message'])
+        with self.settings(TRANSPORT={'CANCEL_TRIPS_LIMIT': 1}):
+            result = self.cancel(ids=[self.trip.pk, self.later.pk])
+        self.assertIn('more than 1 trips', result['errors'][0]['message'])
+        self.assertEqual(Trip.objects.count(), 3)
+
+
+class RecordingSender:
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, reminders):
+        self.sent.extend(reminders)
+
+
+@override_settings(TRANSPORT={'REMINDER_LEAD_HOURS': 24, 'REMINDER_HORIZON_HOURS': 12, 'REMINDER_BATCH_SIZE': 1})
+class ReminderSchedulerTests(GraphQLTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        self.trip.departure_time = self.now + timedelta(hours=23)
+        self.trip.save()
+        self.trip.crew.set([self.customer])
+        Booking.objects.create(customer=self.customer, trip=self.trip, seat_number=1)
+        self.later = Trip.objects.create(
+            route=self.route, bus=self.bus, organizer=self.manager, driver=self.manager,
+            departure_time=self.now + timedelta(hours=30), available_seats=4,
+        )
+        self.sender = RecordingSender()
+        self.scheduler = ReminderScheduler(self.sender)
+
+    def test_due_reminders_are_sent_once_and_survive_a_restart(self):
+        self.assertEqual(self.scheduler.tick(self.now), 1)
+        reminder = self.sender.sent[0]
+        self.assertEqual(reminder.trip_id, self.trip.pk)
+        self.assertEqual(reminder.customers, ('customer@g.com',))
+        self.assertEqual(reminder.crew, ('customer@g.com', 'manager@g.com'))
+        self.assertEqual(len(self.scheduler.heap), 1)
+
+        restarted = ReminderScheduler(self.sender)
+        self.assertEqual(restarted.tick(self.now + timedelta(minutes=1)), 0)
+        self.assertEqual(restarted.tick(self.now + timedelta(hours=7)), 1)
+        self.assertEqual([reminder.trip_id for reminder in self.sender.sent], [self.trip.pk, self.later.pk])
+
+    def test_changed_trips_are_rescheduled_from_the_change_log(self):
+        self.scheduler.tick(self.now - timedelta(hours=2))
+        self.assertEqual(self.sender.sent, [])
+
+        self.post_graphql({'query': 'mutation { deleteTrip(id: %d) { ok } }' % self.trip.pk}, user=self.manager)
+        response = self.post_graphql({'query': 'mutation { updateTrip(id: %d, departureTime: "%s") { trip { id } } }' % (
+            self.later.pk, (self.now + timedelta(hours=20)).isoformat()
+        )}, user=self.manager)
+        self.assertNotIn('errors', response.json())
+
+        with self.assertNumQueries(6):
+            # changes, the changed trips, then one batch: trips, bookings, crew, mark sent
+            self.assertEqual(self.scheduler.tick(self.now), 1)
+        self.assertEqual([reminder.trip_id for reminder in self.sender.sent], [self.later.pk])
+
+    def test_console_sender(self):
+        out = StringIO()
+        ReminderScheduler(ConsoleSender(out)).tick(self.now)
+        self.assertIn('departs at', out.getvalue())
+
+
+@skipIf(numpy is None, 'numpy is not installed')
+class DemandForecastTests(GraphQLTestCase):
+
+    def test_weekday_baseline_weights_recent_weeks(self):
+        start = date(2026, 1, 5)  # a Monday
+        matrix = numpy.zeros((2, 14))
+        matrix[0, 0], matrix[0, 7] = 10, 20  # two Mondays
+        matrix[1, 2] = 7  # one Wednesday
+        baseline = weekday_baseline(matrix, start)
+        self.assertAlmostEqual(baseline[0, 0], (10 * WEEK_DECAY + 20) / (WEEK_DECAY + 1))
+        self.assertAlmostEqual(baseline[1, 2], 7 * WEEK_DECAY / (WEEK_DECAY + 1))
+        self.assertEqual(baseline[0, 1], 0)
+
+    def test_command_stores_forecasts_served_by_the_query(self):
+        today = timezone.now().date()
+        last_week = datetime.combine(today - timedelta(days=7), datetime.min.time(), datetime_timezone.utc)
+        self.trip.departure_time = last_week + timedelta(hours=9)
+        self.trip.save()
+        for seat in (1, 2, 3):
+            Booking.objects.create(customer=self.customer, trip=self.trip, seat_number=seat)
+        cancelled = Trip.objects.create(
+            route=self.route, bus=self.bus, organizer=self.manager, driver=self.manager,
+            departure_time=self.trip.departure_time + timedelta(hours=6), available_seats=4,
+        )
+        Booking.objects.create(customer=self.customer, trip=cancelled, seat_number=1)
+        cancel_trips(Trip.objects.filter(pk=cancelled.pk))
+
+        out = StringIO()
+        call_command('forecast_demand', '--weeks', '2', '--days', '7', stdout=out)
+        self.assertIn('7 forecast(s) written.', out.getvalue())
+        call_command('forecast_demand', '--weeks', '2', '--days', '7', stdout=StringIO())
+        self.assertEqual(DemandForecast.objects.count(), 7)
+
+        query = '{ forecastDemand(routeId: %d, from: "%s", to: "%s") { day expectedBookings } }' % (
+            self.route.pk, today.isoformat(), (today + timedelta(days=6)).isoformat()
+        )
+        forecasts = self.post_graphql({'query': query}, user=self.manager).json()['data']['forecastDemand']
+        self.assertEqual(len(forecasts), 7)
+        expected = {row['day']: row['expectedBookings'] for row in forecasts}
+        self.assertAlmostEqual(expected[today.isoformat()], round(3 / (WEEK_DECAY + 1), 2))
+        self.assertEqual(expected[(today + timedelta(days=1)).isoformat()], 0)
@@ -0,0 +1,191 @@
+import gzip
+import hashlib
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .conf import transport_setting
+from .models import Route, Trip
+
+INDEX = 'index.json'
+STATE = 'state.json'
+TRIP_FIELDS = ['id', 'departure', 'arrival', 'available_seats', 'capacity']
+# Routes whose trips are read in one query when rebuilding partitions
+ROUTES_PER_QUERY = 200
+
+
+def timetable_root():
+    return str(transport_setting('TIMETABLE_ROOT') or os.path.join(settings.BASE_DIR, 'timetable'))
+
+
+def encode(document):
+    return json.dumps(document, separators=(',', ':'), sort_keys=True).encode()
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.tmp{os.getpid()}'
+    with open(tmp, 'wb') as handle:
+        handle.write(data)
+    os.replace(tmp, path)
+
+
+def write_gzip(root, name, content):
+    """
+    Write ``content`` gzipped as ``name.gz`` and its ETag as ``name.etag``, so serving it never reads the body.
+
+    The ETag goes second: a reader in between sends the new body under the old
+    tag, which the next revalidation corrects, rather than the other way round.
+    """
+    # mtime=0 keeps the bytes, and so the ETag, identical for identical content
+    data = gzip.compress(content, compresslevel=9, mtime=0)
+    write_atomic(os.path.join(root, name + '.gz'), data)
+    write_atomic(os.path.join(root, name + '.etag'), etag_of(data).encode())
+
+
+def etag_of(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def load_state(root):
+    try:
+        with open(os.path.join(root, STATE)) as handle:
+            return json.load(handle)
+    except (FileNotFoundError, ValueError):
+        return {'partitions': {}, 'retired': []}
+
+
+def epoch(moment):
+    return int(moment.timestamp())
+
+
+def partition_fingerprints(start, end):
+    """
+    ``{(route_id, day): fingerprint}`` for every route and day with trips, in one grouped query.
+
+    A partition changes when a trip is added or removed (count), or when a
+    trip, its route or its bus (whose capacity is listed) is saved (versions,
+    see ``ChangeLog``).
+    """
+    rows = (
+        Trip.objects.filter(departure_time__gte=start, departure_time__lt=end)
+        .annotate(day=TruncDate('departure_time', tzinfo=dt_timezone.utc))
+        .values('route_id', 'day')
+        .annotate(
+            count=Count('id'), version=Max('version'), route_version=Max('route__version'),
+            bus_version=Max('bus__version'),
+        )
+        .order_by()
+    )
+    return {
+        (row['route_id'], row['day'].isoformat()):
+            f"{row['count']}:{row['version']}:{row['route_version']}:{row['bus_version']}"
+        for row in rows
+    }
+
+
+def load_partitions(keys):
+    """Trips of the ``(route_id, day)`` partitions in ``keys`` as ``{key: [row, ...]}``."""
+    days_by_route = defaultdict(set)
+    for route_id, day in keys:
+        days_by_route[route_id].add(day)
+
+    trips = defaultdict(list)
+    route_ids = sorted(days_by_route)
+    for offset in range(0, len(route_ids), ROUTES_PER_QUERY):
+        condition = Q()
+        for route_id in route_ids[offset:offset + ROUTES_PER_QUERY]:
+            days = sorted(days_by_route[route_id])
+            first = datetime.combine(datetime.fromisoformat(days[0]), time.min, dt_timezone.utc)
+            last = datetime.combine(datetime.fromisoformat(days[-1]), time.min, dt_timezone.utc) + timedelta(days=1)
+            condition |= Q(route_id=route_id, departure_time__gte=first, departure_time__lt=last)
+
+        rows = Trip.objects.filter(condition).order_by('departure_time', 'pk').values_list(
+            'route_id', 'pk', 'departure_time', 'arrival_time', 'available_seats', 'bus__capacity'
+        )
+        for route_id, pk, departure, arrival, seats, capacity in rows:
+            key = (route_id, departure.astimezone(dt_timezone.utc).date().isoformat())
+            if key in keys:
+                trips[key].append([pk, epoch(departure), epoch(arrival), seats, capacity])
+    return trips
+
+
+def describe_route(route):
+    return {
+        'id': route.pk,
+        'origin': {'branch': route.origin.name, 'city': route.origin.city.name},
+        'destination': {'branch': route.destination.name, 'city': route.destination.city.name},
+        'duration': int(route.duration.total_seconds()),
+        'distance_km': route.distance_km,
+    }
+
+
+def build_snapshot(root=None, days=None, full=False, now=None):
+    """
+    Write the timetable of the next ``days`` days as static, content-hashed files.
+
+    Each route and UTC day is one gzipped partition named after the hash of
+    its content, so it can be cached forever. ``index.json`` lists the routes
+    and the file of every day that has trips. Only partitions whose
+    fingerprint changed since the last build are read and written again,
+    unless ``full`` is set. Files dropped from the index are deleted one
+    build later, so clients holding the previous index can still fetch them.
+
+    Returns counts of the partitions written, kept and retired.
+    """
+    root = root or timetable_root()
+    days = days or transport_setting('TIMETABLE_DAYS')
+    today = (now or timezone.now()).astimezone(dt_timezone.utc).date()
+    start = datetime.combine(today, time.min, dt_timezone.utc)
+    end = start + timedelta(days=days)
+
+    state = load_state(root)
+    previous = {} if full else state['partitions']
+
+    fingerprints = partition_fingerprints(start, end)
+    stale = {
+        key for key, fingerprint in fingerprints.items()
+        if previous.get('%s/%s' % key, {}).get('fingerprint') != fingerprint
+        or not os.path.exists(os.path.join(root, previous['%s/%s' % key]['file'] + '.gz'))
+    }
+
+    partitions = {}
+    for key, rows in load_partitions(stale).items():
+        content = encode({'route': key[0], 'date': key[1], 'fields': TRIP_FIELDS, 'trips': rows})
+        name = 'routes/%s/%s.%s.json' % (key[0], key[1], hashlib.sha256(content).hexdigest()[:16])
+        write_gzip(root, name, content)
+        partitions['%s/%s' % key] = {'fingerprint': fingerprints[key], 'file': name}
+    for key in fingerprints.keys() - stale:
+        partitions['%s/%s' % key] = previous['%s/%s' % key]
+
+    routes = {}
+    for route in Route.objects.select_related('origin__city', 'destination__city').order_by('pk'):
+        routes[route.pk] = dict(describe_route(route), days={})
+    for key, partition in sorted(partitions.items()):
+        route_id, day = key.split('/')
+        if int(route_id) in routes:
+            routes[int(route_id)]['days'][day] = partition['file']
+
+    write_gzip(root, INDEX, encode({
+        'generated_at': timezone.now().isoformat(),
+        'start': today.isoformat(),
+        'days': days,
+        'trip_fields': TRIP_FIELDS,
+        'routes': list(routes.values()),
+    }))
+
+    current = {partition['file'] for partition in partitions.values()}
+    for name in set(state['retired']) - current:
+        for suffix in ('.gz', '.etag'):
+            try:
+                os.remove(os.path.join(root, name + suffix))
+            except FileNotFoundError:
+                pass
+    retired = sorted({partition['file'] for partition in state['partitions'].values()} - current)
+    write_atomic(os.path.join(root, STATE), encode({'partitions': partitions, 'retired': retired}))
+
+    return {'written': len(stale), 'kept': len(partitions) - len(stale), 'retired': len(retired)}
@@ -1,3 +1,237 @@
-from django.shortcuts import render
+import gzip
+import json
+import os
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.http.response import HttpResponseBadRequest
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_safe
+from graphene_django.views import GraphQLView, HttpError
+from graphql import GraphQLError, OperationType, get_operation_ast, parse
+from .conf import transport_setting
+from .idempotency import IdempotencyConflict, fingerprint, run_once
+from .ratelimit import admit, limit_for
+from .timetable import INDEX, etag_of, timetable_root
+from .schema.loaders import LoaderExecutionContext
+from .schema.permissions import get_user_roles
 
-# Create your views here.
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+
+def accepted_encodings(request):
+    """Return the content codings the client accepts, ignoring those sent with ``q=0``."""
+    encodings = set()
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        if coding:
+            encodings.add(coding.strip().lower())
+    return encodings
+
+
+@require_safe
+def timetable_file(request, name):
+    """
+    Serve a file of the timetable snapshot written by ``build_timetable_snapshot``.
+
+    Files are stored gzipped and sent as-is to clients accepting gzip. The
+    strong ETag of the gzipped bytes is written next to the file at build
+    time, so a revalidation is answered without reading the body. Partitions
+    have content-hashed names and are cached for a year; the index is
+    revalidated every minute.
+    """
+    try:
+        path = safe_join(timetable_root(), name + '.gz')
+    except SuspiciousFileOperation:
+        raise Http404("Timetable file not found.")
+    if not name.endswith('.json') or not os.path.isfile(path):
+        raise Http404("Timetable file not found.")
+
+    data = None
+    try:
+        with open(path[:-len('.gz')] + '.etag') as handle:
+            etag = handle.read().strip()
+    except FileNotFoundError:
+        # Written before ETags were stored
+        with open(path, 'rb') as handle:
+            data = handle.read()
+        etag = etag_of(data)
+    send_gzip = 'gzip' in accepted_encodings(request)
+    if not send_gzip:
+        etag += '-identity'
+    etag = f'"{etag}"'
+
+    if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+        response = HttpResponseNotModified()
+    else:
+        if data is None:
+            with open(path, 'rb') as handle:
+                data = handle.read()
+        response = HttpResponse(data if send_gzip else gzip.decompress(data), content_type='application/json')
+        if send_gzip:
+            response['Content-Encoding'] = 'gzip'
+    response['ETag'] = etag
+    response['Cache-Control'] = 'public, max-age=60' if name == INDEX else 'public, max-age=31536000, immutable'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def is_mutation(query, operation_name):
+    """Whether the operation of ``query`` selected by ``operation_name`` is a mutation."""
+    try:
+        operation = get_operation_ast(parse(query), operation_name) if query else None
+    except GraphQLError:
+        return False
+    return operation is not None and operation.operation == OperationType.MUTATION
+
+
+class TransportGraphQLView(GraphQLView):
+    """
+    GraphQL endpoint that accepts a single operation or a JSON array of operations.
+
+    Every operation of a batch runs against the same request object, so
+    authentication, the role lookup done by ``check_role_permission`` and the
+    DataLoaders are shared by the whole batch. Operations run one after the
+    other: the ORM connection is bound to the request thread.
+
+    Responses are rendered with orjson when it is installed and compressed
+    with brotli or gzip once they exceed ``GRAPHQL_COMPRESSION_MIN_BYTES``.
+
+    Mutations sent with an ``Idempotency-Key`` header run once per user and
+    key; retries get the stored response back (see ``idempotency.run_once``).
+    Within a batch the key applies to each operation by position.
+
+    Requests are admitted through a per-user token bucket sized by the user's
+    roles (``RATE_LIMITS``); each operation of a batch costs one token.
+    """
+    execution_context_class = LoaderExecutionContext
+    json_encoder = DjangoJSONEncoder()
+    gzip_level = 6
+    brotli_quality = 5
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        return self.compress_response(request, response)
+
+    def get_response(self, request, data, show_graphiql=False):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return super().get_response(request, data, show_graphiql)
+        if len(key) > 255:
+            raise HttpError(HttpResponseBadRequest("Idempotency-Key must be at most 255 characters."))
+
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+        if not is_mutation(query, operation_name):
+            return super().get_response(request, data, show_graphiql)
+
+        if self.batch:
+            position = getattr(request, '_idempotency_position', 0)
+            request._idempotency_position = position + 1
+            key = f'{key}#{position}'
+
+        user_id = request.user.pk if request.user.is_authenticated else None
+        try:
+            return run_once(
+                user_id, key, fingerprint(query, variables, operation_name),
+                lambda: super(TransportGraphQLView, self).get_response(request, data, show_graphiql),
+            )
+        except IdempotencyConflict as e:
+            response = {'errors': [{'message': str(e)}]}
+            if self.batch:
+                response['id'] = id
+                response['status'] = e.status
+            return self.json_encode(request, response), e.status
+
+    def parse_body(self, request):
+        data = self.parse_request_body(request)
+        self.check_rate_limit(request, len(data) if self.batch else 1)
+        return data
+
+    def check_rate_limit(self, request, cost):
+        """Reject the request with 429 and ``Retry-After`` when the user's bucket is empty."""
+        user = request.user
+        if user.is_authenticated:
+            key = f'user:{user.pk}'
+            limit = limit_for(get_user_roles(request), True)
+        else:
+            key = f'ip:{request.META.get("REMOTE_ADDR")}'
+            limit = limit_for(frozenset(), False)
+
+        retry_after = admit(key, limit, cost)
+        if retry_after:
+            response = HttpResponse(status=429)
+            response['Retry-After'] = str(retry_after)
+            raise HttpError(response, "Too many requests, retry later.")
+
+    def parse_request_body(self, request):
+        if self.get_content_type(request) != 'application/json':
+            return super().parse_body(request)
+
+        try:
+            request_json = json.loads(request.body.decode('utf-8'))
+        except UnicodeDecodeError as e:
+            raise HttpError(HttpResponseBadRequest(str(e)))
+        except (TypeError, ValueError):
+            raise HttpError(HttpResponseBadRequest("POST body sent invalid JSON."))
+
+        if isinstance(request_json, list):
+            if not request_json:
+                raise HttpError(HttpResponseBadRequest("Received an empty list in the batch request."))
+            max_size = transport_setting('GRAPHQL_MAX_BATCH_SIZE')
+            if len(request_json) > max_size:
+                raise HttpError(HttpResponseBadRequest(
+                    f"Batch requests are limited to {max_size} operations."
+                ))
+            if not all(isinstance(entry, dict) for entry in request_json):
+                raise HttpError(HttpResponseBadRequest("Every batch entry must be a JSON query."))
+            self.batch = True
+            return request_json
+
+        if not isinstance(request_json, dict):
+            raise HttpError(HttpResponseBadRequest("The received data is not a valid JSON query."))
+        return request_json
+
+    def json_encode(self, request, d, pretty=False):
+        pretty = self.pretty or pretty or request.GET.get('pretty')
+        if orjson is not None:
+            option = orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS if pretty else 0
+            return orjson.dumps(d, default=self.json_encoder.default, option=option).decode()
+
+        if pretty:
+            return json.dumps(d, sort_keys=True, indent=2, separators=(",", ": "), cls=DjangoJSONEncoder)
+        return json.dumps(d, separators=(",", ":"), cls=DjangoJSONEncoder)
+
+    def compress_response(self, request, response):
+        """Compress JSON bodies above the configured size with brotli or gzip."""
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if not response.get('Content-Type', '').startswith('application/json'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < transport_setting('GRAPHQL_COMPRESSION_MIN_BYTES'):
+            return response
+
+        encodings = accepted_encodings(request)
+        if brotli is not None and 'br' in encodings:
+            response.content = brotli.compress(response.content, quality=self.brotli_quality)
+            response['Content-Encoding'] = 'br'
+        elif 'gzip' in encodings:
+            response.content = gzip.compress(response.content, compresslevel=self.gzip_level, mtime=0)
+            response['Content-Encoding'] = 'gzip'
+        else:
+            return response
+
+        response['Content-Length'] = str(len(response.content))
+        return response
@@ -0,0 +1,80 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from .models import Booking, WaitlistEntry
+
+
+def join_waitlist(trip, customer, seats):
+    """
+    Queue ``customer`` for ``seats`` seats on ``trip`` and return ``(entry, created)``.
+
+    Joining again returns the existing entry, so a client retrying in a loop
+    still holds a single place in the queue. ``trip`` must be locked by the
+    caller so the next sequence number is not handed out twice.
+    """
+    entry = WaitlistEntry.objects.filter(trip=trip, customer=customer).first()
+    if entry is not None:
+        return entry, False
+
+    last = WaitlistEntry.objects.filter(trip=trip).aggregate(last=Max('sequence'))['last'] or 0
+    try:
+        with transaction.atomic():
+            entry = WaitlistEntry.objects.create(trip=trip, customer=customer, seats=seats, sequence=last + 1)
+    except IntegrityError:
+        # A concurrent request from the same customer won the race.
+        return WaitlistEntry.objects.get(trip=trip, customer=customer), False
+    return entry, True
+
+
+def waitlist_positions(entry_ids):
+    """
+    Map each of ``entry_ids`` to its 1-based place in its trip's queue.
+
+    Reads the queues of the trips involved once, in (trip, sequence) index
+    order, so listing N entries of one queue costs one linear query instead
+    of N counts.
+    """
+    positions = {}
+    wanted = set(entry_ids)
+    queues = (
+        WaitlistEntry.objects.filter(trip_id__in=WaitlistEntry.objects.filter(pk__in=wanted).values('trip_id'))
+        .order_by('trip_id', 'sequence').values_list('trip_id', 'pk')
+    )
+    trip_id, position = None, 0
+    for entry_trip_id, entry_id in queues:
+        position = position + 1 if entry_trip_id == trip_id else 1
+        trip_id = entry_trip_id
+        if entry_id in wanted:
+            positions[entry_id] = position
+    return positions
+
+
+def promote_waitlist(trip):
+    """
+    Turn waitlist entries into bookings while the head of the queue fits.
+
+    Must run inside the transaction that freed the seats, with ``trip`` locked.
+    The queue is strictly FIFO: promotion stops at the first entry asking for
+    more seats than are free. Updates ``trip.available_seats`` in memory; the
+    caller saves the trip. Returns the promoted entries.
+    """
+    if trip.bus is None or trip.available_seats <= 0:
+        return []
+
+    booked = set(Booking.objects.filter(trip=trip).values_list('seat_number', flat=True))
+    free_seats = [n for n in range(1, trip.bus.capacity + 1) if n not in booked]
+
+    promoted = []
+    for entry in trip.waitlist.order_by('sequence')[:trip.available_seats]:
+        if entry.seats > trip.available_seats or entry.seats > len(free_seats):
+            break
+        seats, free_seats = free_seats[:entry.seats], free_seats[entry.seats:]
+        Booking.objects.bulk_create([
+            Booking(customer_id=entry.customer_id, trip=trip, seat_number=seat)
+            for seat in seats
+        ])
+        trip.available_seats -= entry.seats
+        promoted.append(entry)
+
+    if promoted:
+        WaitlistEntry.objects.filter(pk__in=[entry.pk for entry in promoted]).delete()
+    return promoted